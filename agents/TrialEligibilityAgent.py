@@ -1,7 +1,13 @@
 import re
-import json
 from document_retrieval.utils import prompts
+from document_retrieval.utils.response_schemas import get_response_format, response_schemas
+from document_retrieval.utils.parse_json_response import parse_json_response, record_parse_outcome
+from document_retrieval.utils.incremental_json_parser import IncrementalJSONArrayParser
+from document_retrieval.utils.parse_timeframes import parse_timeframes
+from document_retrieval.utils.extract_metric_ranges import extract_metric_ranges, METRIC_RANGES_LLM_FALLBACK
 from providers.openai.openai_connection import OpenAIClient
+from providers.corpus.criteria_index import attribute_statements
+from utils.metrics import track_stage
 
 
 class TrialEligibilityAgent:
@@ -20,8 +26,9 @@ class TrialEligibilityAgent:
         self.max_tokens = max_tokens
         self.temperature = temperature
         self.categorisation_role = prompts.categorisation_role
-        self.pattern = r'timeFrame\s*-\s*(.*?)(?=measure|$)'
+        self.pattern = re.compile(r'timeFrame\s*-\s*(.*?)(?=measure|$)', re.DOTALL)
         self.medical_writer_agent_role = prompts.medical_writer_agent_role
+        self.medical_writer_agent_role_packed = prompts.medical_writer_agent_role_packed
         self.filter_role = prompts.filter_role
 
     def draft_eligibility_criteria(self, sample_trial_rationale,
@@ -31,23 +38,28 @@ class TrialEligibilityAgent:
                                    user_provided_trial_conditions,
                                    user_provided_trial_outcome,
                                    generated_inclusion_criteria,
-                                   generated_exclusion_criteria, ):
+                                   generated_exclusion_criteria,
+                                   on_criterion=None):
         """
         Drafts comprehensive Inclusion and Exclusion Criteria for a medical trial based on provided inputs.
 
         Parameters:
             sample_trial_rationale (str): The overall rationale for the medical trial.
-            similar_trial_documents (dict): A similar document from a database.
+            similar_trial_documents (dict | list): A similar document from a database, or a list of similar
+                documents packed into a single drafting call.
             user_provided_inclusion_criteria (str): The user-provided inclusion criteria.
             user_provided_exclusion_criteria (str): The user-provided exclusion criteria.
             user_provided_trial_conditions (str): The trial conditions as provided by the user.
             user_provided_trial_outcome (str): The expected outcome of the trial as provided by the user.
             generated_exclusion_criteria (list): A list of generated exclusion criteria.
             generated_inclusion_criteria (list): A list of generated inclusion criteria.
+            on_criterion (callable, optional): If given, the drafting call is streamed and
+                `on_criterion(criteria_type, criterion)` is called for every criterion as soon as it is complete.
 
         Returns:
             dict: A dictionary containing:
-                - success (bool): Indicates if the process was successful.
+                - success (bool): Indicates if the process was successful. A call that fails after drafting
+                  started is not, but its data keeps the criteria completed before the failure.
                 - message (str): A descriptive message about the process outcome.
                 - data (dict): A dictionary containing:
                     - inclusionCriteria (list): Extracted inclusion criteria.
@@ -69,6 +81,10 @@ class TrialEligibilityAgent:
             inclusion_criteria = []
             exclusion_criteria = []
 
+            # A list of documents means several trials are packed into one drafting call
+            packed = isinstance(similar_trial_documents, list)
+            documents = similar_trial_documents if packed else [similar_trial_documents]
+
             # Constructing the user input message for the medical writer agent
             user_input = f"""
                 Medical Trial Rationale: {sample_trial_rationale}
@@ -83,63 +99,83 @@ class TrialEligibilityAgent:
 
             # Creating a message list for the Azure AI model
             message_list = [
-                {"role": "system", "content": self.medical_writer_agent_role},  # System role defining AI's function
+                {"role": "system", "content": self.medical_writer_agent_role_packed if packed
+                    else self.medical_writer_agent_role},  # System role defining AI's function
                 {"role": "user", "content": user_input}  # User input including trial details
             ]
 
             try:
                 openai_client = OpenAIClient()
-                response_format = {"type": "json_object"}
-
-                # Sending the request to Azure AI chat model
-                response = openai_client.generate_text(messages=message_list, response_format=response_format)
-
-                # Parsing the AI-generated JSON response
-                json_response = json.loads(response["data"].choices[0].message.content)
-
-                # Extracting inclusion and exclusion criteria from the response
-                inclusion_criteria.extend(json_response.get("inclusionCriteria", []))
-                exclusion_criteria.extend(json_response.get("exclusionCriteria", []))
-
-                # Extract Metrics
-                message_list = [
-                    {"role": "system", "content": prompts.values_count_prompt},
-                    {"role": "user", "content": f"{similar_trial_documents}"}
-                ]
-
-                metrics_response = openai_client.generate_text(messages=message_list, response_format=response_format)
+                drafting_schema = "draft_eligibility_criteria_packed" if packed else "draft_eligibility_criteria"
+
+                if on_criterion is not None:
+                    # Stream the response and hand out every criterion as soon as it has been parsed
+                    parser = IncrementalJSONArrayParser()
+                    with track_stage("llm", f"{drafting_schema}_stream") as timer:
+                        for chunk in openai_client.generate_text_stream(messages=message_list,
+                                                                        response_format=get_response_format(drafting_schema)):
+                            for criteria_type, item in parser.feed(chunk):
+                                if criteria_type == "inclusionCriteria":
+                                    inclusion_criteria.append(item)
+                                elif criteria_type == "exclusionCriteria":
+                                    exclusion_criteria.append(item)
+                                else:
+                                    continue
+                                self._attribute_sources([item], documents)
+                                on_criterion(criteria_type, item)
+                        if not parser.complete:
+                            timer.outcome = "incomplete"
+                            print(f"Drafting stream ended early, kept {parser.items_parsed} completed criteria")
+                else:
+                    # Sending the request to Azure AI chat model and parsing the AI-generated JSON response
+                    json_response = self._request_json(openai_client, message_list, drafting_schema)
+
+                    # Extracting inclusion and exclusion criteria from the response
+                    inclusion_criteria.extend(json_response.get("inclusionCriteria", []))
+                    exclusion_criteria.extend(json_response.get("exclusionCriteria", []))
+                    # Streamed criteria are attributed as they arrive
+                    self._attribute_sources(inclusion_criteria, documents)
+                    self._attribute_sources(exclusion_criteria, documents)
+
+                # Extract Metrics with rules, the LLM only sees trials whose HbA1c/BMI limits the rules do not understand
+                drug_output = extract_metric_ranges(documents)
+                if drug_output["unparsed"] and METRIC_RANGES_LLM_FALLBACK:
+                    message_list = [
+                        {"role": "system", "content": prompts.values_count_prompt},
+                        {"role": "user", "content": f"{drug_output['unparsed']}"}
+                    ]
+
+                    try:
+                        drug_output["response"].extend(
+                            self._request_json(openai_client, message_list, "values_count")["response"]
+                        )
+                    except Exception as e:
+                        # The drafted criteria and the ranges the rules understood are kept
+                        print(f"Metric range fallback failed, keeping the rule-based ranges: {e}")
 
-
-                drug_output = json.loads(metrics_response["data"].choices[0].message.content)
-
-                primary_outcomes = similar_trial_documents["document"]["primaryOutcomes"]
-                timeline = self.extract_timeframes_and_text(primary_outcomes)
                 time_line_output = [
                     {
-                        "nctId": similar_trial_documents["nctId"],
-                        "timeLine": timeline
+                        "nctId": document["nctId"],
+                        "timeLine": self.extract_timeframes_and_text(document["document"]["primaryOutcomes"])
                     }
+                    for document in documents
                 ]
-                messages = [
-                    {"role": "system", "content": prompts.timeframe_count_prompt},
-                    {"role": "user", "content": f"{time_line_output}"}
-                ]
-
-                timeframe_response = openai_client.generate_text(messages=messages, response_format=response_format)
-                timeframe_output = json.loads(timeframe_response["data"].choices[0].message.content)
+                # Normalize and count the time frames with rules, the LLM only sees time frames the rules do not understand
+                timeframe_output = parse_timeframes(time_line_output)
+                if timeframe_output["unparsed"]:
+                    messages = [
+                        {"role": "system", "content": prompts.timeframe_count_prompt},
+                        {"role": "user", "content": f"{timeframe_output['unparsed']}"}
+                    ]
+
+                    try:
+                        timeframe_output["response"].extend(
+                            self._request_json(openai_client, messages, "timeframe_count")["response"]
+                        )
+                    except Exception as e:
+                        print(f"Time frame fallback failed, keeping the rule-based time frames: {e}")
 
                 # Preparing final response data
-                for item in inclusion_criteria:
-                    source_statement = item["source"]
-                    item["source"] = {
-                        similar_trial_documents["nctId"]: source_statement
-                    }
-                for item in exclusion_criteria:
-                    source_statement = item["source"]
-                    item["source"] = {
-                        similar_trial_documents["nctId"]: source_statement
-                    }
-
                 final_data = {
                     "inclusionCriteria": inclusion_criteria,
                     "exclusionCriteria": exclusion_criteria,
@@ -149,6 +185,12 @@ class TrialEligibilityAgent:
 
             except Exception as e:
                 print(f"Error processing AI response: {e}")  # Logging error in AI response processing
+                # Keep the criteria completed before the failure, streamed ones were already handed out
+                final_data["inclusionCriteria"] = inclusion_criteria
+                final_data["exclusionCriteria"] = exclusion_criteria
+                final_response["data"] = final_data
+                final_response["message"] = f"Partially drafted eligibility criteria: {e}"
+                return final_response
 
             final_response["data"] = final_data
             final_response["success"] = True
@@ -160,6 +202,102 @@ class TrialEligibilityAgent:
             final_response["message"] = f"Error processing query rationale: {e}"
             return final_response
 
+    @staticmethod
+    def _request_json(openai_client, messages: list, schema_name: str, max_rerequests: int = 1) -> dict:
+        """
+        Sends a chat request in structured output mode and returns the parsed, schema-valid JSON response.
+
+        Malformed responses are repaired locally first; the request is only repeated if the repair fails.
+
+        Parameters:
+            openai_client (OpenAIClient): The client used for the request.
+            messages (list): The chat messages.
+            schema_name (str): The name of the expected schema in `response_schemas`.
+            max_rerequests (int): How often an unparseable response is requested again.
+
+        Returns:
+            dict: The parsed JSON response.
+
+        Raises:
+            ValueError: If no valid response was received.
+        """
+        message = f"No response received for {schema_name}"
+        for attempt in range(max_rerequests + 1):
+            if attempt:
+                record_parse_outcome(schema_name, "rerequested")
+            with track_stage("llm", schema_name) as timer:
+                response = openai_client.generate_text(messages=messages, response_format=get_response_format(schema_name))
+                timer.set_outcome_from(response)
+            if response["success"] is False:
+                message = response["message"]
+                continue
+            parsed_response = parse_json_response(response["data"].choices[0].message.content,
+                                                  schema=response_schemas[schema_name], schema_name=schema_name)
+            if parsed_response["success"] is True:
+                return parsed_response["data"]
+            message = parsed_response["message"]
+        raise ValueError(message)
+
+    @staticmethod
+    def _attribute_sources(criteria_list: list, documents: list) -> None:
+        """
+        Rewrites each criterion's `source` into a `{nctId: original statement}` mapping.
+
+        With a single document the model returns the statement as a string and it is attributed to that trial.
+        With packed documents the model returns a mapping (or a list of {nctId, statement}); unknown nctIds are dropped and string sources are
+        attributed to the trial whose criteria text contains the statement, to the trials of its nearest criterion in the
+        criterion index, or to the trial that shares the most words with it. A statement sharing no word with any of the
+        trials is left without a source.
+
+        Parameters:
+            criteria_list (list): Criteria returned by the model, updated in place.
+            documents (list): The trial documents sent in the drafting call.
+        """
+        nct_ids = [document["nctId"] for document in documents]
+        document_texts = {
+            document["nctId"]: " ".join(
+                f"{document['document'].get(field, '')}" for field in ("inclusionCriteria", "exclusionCriteria")
+            ).lower()
+            for document in documents
+        }
+
+        unresolved = []
+        for item in criteria_list:
+            source_statement = item.get("source", "")
+            if isinstance(source_statement, list):
+                # Structured outputs return the packed source map as [{"nctId", "statement"}]
+                source_statement = {
+                    entry.get("nctId"): entry.get("statement", "") for entry in source_statement if isinstance(entry, dict)
+                }
+            if isinstance(source_statement, dict):
+                item["source"] = {
+                    nct_id: statement for nct_id, statement in source_statement.items() if nct_id in nct_ids
+                }
+                if item["source"]:
+                    continue
+                source_statement = " ".join(f"{statement}" for statement in source_statement.values())
+
+            if len(nct_ids) == 1:
+                item["source"] = {nct_ids[0]: source_statement}
+                continue
+
+            statement = f"{source_statement}".lower().strip()
+            matching_ids = [nct_id for nct_id in nct_ids if statement and statement in document_texts[nct_id]]
+            if matching_ids:
+                item["source"] = {nct_id: source_statement for nct_id in matching_ids}
+            else:
+                unresolved.append((item, source_statement))
+
+        # Statements the model paraphrased are matched against the individual criteria of the packed trials in one call
+        index_matches = attribute_statements([f"{source_statement}" for _, source_statement in unresolved], nct_ids)
+        for (item, source_statement), matching_ids in zip(unresolved, index_matches):
+            if not matching_ids:
+                statement_words = set(f"{source_statement}".lower().split())
+                overlaps = {nct_id: len(statement_words & set(document_texts[nct_id].split())) for nct_id in nct_ids}
+                best_nct_id = max(nct_ids, key=overlaps.get)
+                matching_ids = [best_nct_id] if overlaps[best_nct_id] > 0 else []
+            item["source"] = {nct_id: source_statement for nct_id in matching_ids}
+
     def categorise_eligibility_criteria(self, eligibility_criteria):
         """
         Categorise comprehensive Inclusion and Exclusion Criteria for a medical trial based on provided inputs.
@@ -190,9 +328,7 @@ class TrialEligibilityAgent:
 
             try:
                 openai_client = OpenAIClient()
-                response = openai_client.generate_text(messages=message_list, response_format={"type": "json_object"})
-
-                json_response = json.loads(response["data"].choices[0].message.content)
+                json_response = self._request_json(openai_client, message_list, "categorise_eligibility_criteria")
                 inclusion_criteria.extend(json_response.get("inclusionCriteria", []))
                 exclusion_criteria.extend(json_response.get("exclusionCriteria", []))
 
@@ -231,9 +367,7 @@ class TrialEligibilityAgent:
             print(message_list)
 
             openai_client = OpenAIClient()
-            response = openai_client.generate_text(messages=message_list, response_format={"type": "json_object"})
-
-            json_response = json.loads(response["data"].choices[0].message.content)
+            json_response = self._request_json(openai_client, message_list, "filter_generated_criteria")
 
             final_response["data"] = json_response
             final_response["success"] = True
@@ -245,7 +379,7 @@ class TrialEligibilityAgent:
             return final_response
 
     def extract_timeframes_and_text(self, text: str) -> list:
-        matches = re.findall(self.pattern, text, re.DOTALL)
+        matches = self.pattern.findall(text)
 
         extracted_data = [match.strip() for match in matches]
 
@@ -0,0 +1,79 @@
+"""
+Offline accuracy and latency benchmark for the nearest-centroid criteria category classifier.
+
+Historical labelled criteria from `similar_trials_criteria_results` are split into a train and a test set.
+Centroids are fitted on the train set and the test set is classified at several confidence margins,
+reporting coverage (criteria answered locally), accuracy on those criteria and the classification latency.
+
+Usage:
+    python -m benchmarks.benchmark_criteria_classifier [--test-fraction 0.2] [--margins 0 0.02 0.05 0.1]
+"""
+import argparse
+import json
+import random
+import time
+
+from database.document_retrieval.fetch_labelled_criteria import fetch_labelled_criteria
+from document_retrieval.utils.criteria_category_classifier import MAX_LABELLED_JOBS, CriteriaCategoryClassifier
+from providers.openai.generate_embeddings import generate_batch_embeddings_from_azure_client
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--test-fraction", type=float, default=0.2)
+    parser.add_argument("--margins", type=float, nargs="*", default=[0.0, 0.02, 0.05, 0.1])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--max-jobs", type=int, default=MAX_LABELLED_JOBS,
+                        help="Most recent criteria jobs to read, defaults to CRITERIA_CLASSIFIER_MAX_JOBS")
+    args = parser.parse_args()
+
+    labelled_criteria_response = fetch_labelled_criteria(limit=args.max_jobs)
+    if labelled_criteria_response["success"] is False:
+        parser.error(labelled_criteria_response["message"])
+
+    # Deduplicate so identical statements cannot appear in both splits
+    labelled_criteria = list({item["criteria"]: item for item in labelled_criteria_response["data"]}.values())
+    random.Random(args.seed).shuffle(labelled_criteria)
+    split = int(len(labelled_criteria) * (1 - args.test_fraction))
+    train, test = labelled_criteria[:split], labelled_criteria[split:]
+
+    classifier = CriteriaCategoryClassifier()
+    start = time.perf_counter()
+    fit_response = classifier.fit(train)
+    fit_seconds = time.perf_counter() - start
+    if fit_response["success"] is False:
+        parser.error(fit_response["message"])
+
+    start = time.perf_counter()
+    embedding_response = generate_batch_embeddings_from_azure_client([item["criteria"] for item in test])
+    embedding_seconds = time.perf_counter() - start
+    if embedding_response["success"] is False:
+        parser.error(embedding_response["message"])
+
+    report = {
+        "trainCriteria": len(train),
+        "testCriteria": len(test),
+        "fitSeconds": round(fit_seconds, 3),
+        "testEmbeddingSeconds": round(embedding_seconds, 3),
+        "margins": []
+    }
+    for margin in args.margins:
+        classifier.min_margin = margin
+        start = time.perf_counter()
+        predictions = classifier.predict_embeddings(embedding_response["data"])
+        classify_seconds = time.perf_counter() - start
+
+        answered = [(prediction, item) for prediction, item in zip(predictions, test) if prediction["class"]]
+        correct = sum(1 for prediction, item in answered if prediction["class"] == item["class"])
+        report["margins"].append({
+            "minMargin": margin,
+            "coverage": round(len(answered) / len(test), 3) if test else 0,
+            "accuracyOnAnswered": round(correct / len(answered), 3) if answered else None,
+            "classifyMillisecondsPerCriterion": round(classify_seconds * 1000 / max(len(test), 1), 4)
+        })
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Latency, memory, payload size and ranking agreement of reduced embedding dimensions.
+
+For every size, the vectors and queries are truncated to their first N dimensions and re-normalised, which is
+what `dimensions=N` returns for text-embedding-3 models (and what `providers.pinecone.reindex_dimensions`
+stores). Reported per size:
+
+    memory       bytes of the vectors as float32 (Pinecone, in-process copies) and float16 (corpus store)
+    search       exact top-k search over all vectors, ms per query
+    payload      JSON size of a Pinecone query and of its response with the match values the service
+                 requests (include_values=True), and the time to encode and decode that response
+    agreement    overlap of the top k with the full-size top k, top-1 agreement, and the mean top-k score,
+                 since `query_pinecone_db_extended` drops matches below a similarity of 0.40
+
+Without --corpus, synthetic vectors are generated whose variance decays along the dimensions, like
+text-embedding-3 embeddings that put the most important information first. Use --corpus for real numbers.
+
+Usage:
+    python -m benchmarks.benchmark_embedding_dimensions --vectors 50000 --dimensions 256 512 1024 1536
+    python -m benchmarks.benchmark_embedding_dimensions --corpus /data/corpus/current.emb --module inclusionCriteria
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from providers.corpus.corpus_store import CorpusEmbeddingStore
+from providers.pinecone.reindex_dimensions import truncate_embeddings
+
+
+def build_synthetic_vectors(count: int, dim: int, seed: int, topics: int = 256) -> np.ndarray:
+    generator = np.random.default_rng(seed)
+    # Leading dimensions carry most of the variance
+    spectrum = (1 + np.arange(dim, dtype=np.float32)) ** -0.5
+    centers = generator.standard_normal((topics, dim)).astype(np.float32)
+    vectors = centers[generator.integers(0, topics, count)] + 1.5 * generator.standard_normal((count, dim)).astype(np.float32)
+    return truncate_embeddings(vectors * spectrum, dim)
+
+
+def make_queries(vectors: np.ndarray, count: int, noise: float, seed: int) -> np.ndarray:
+    generator = np.random.default_rng(seed + 1)
+    rows = generator.integers(0, len(vectors), count)
+    perturbation = noise * generator.standard_normal((count, vectors.shape[1])).astype(np.float32)
+    # The perturbation follows the spread of the vectors in every dimension
+    return truncate_embeddings(vectors[rows] + perturbation * vectors.std(axis=0), vectors.shape[1])
+
+
+def search(vectors: np.ndarray, query: np.ndarray, top_k: int) -> tuple:
+    scores = vectors @ query
+    top = np.argpartition(-scores, top_k - 1)[:top_k]
+    top = top[np.argsort(-scores[top])]
+    return top, scores[top]
+
+
+def pinecone_payloads(vectors: np.ndarray, query: np.ndarray, rows: np.ndarray, scores: np.ndarray) -> tuple:
+    request = json.dumps({"vector": query.tolist(), "topK": len(rows), "includeValues": True,
+                          "includeMetadata": True, "filter": {"module": {"$eq": "eligibilityModule"}}})
+    start = time.perf_counter()
+    response = json.dumps({"matches": [
+        {"id": f"NCT{row:08d}_eligibilityModule", "score": float(score), "values": vectors[row].tolist(),
+         "metadata": {"nctId": f"NCT{row:08d}", "module": "eligibilityModule"}}
+        for row, score in zip(rows, scores)
+    ]})
+    json.loads(response)
+    return len(request), len(response), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="Corpus file or symlink, defaults to synthetic vectors")
+    parser.add_argument("--module", default="inclusionCriteria", help="Corpus module whose vectors are used")
+    parser.add_argument("--vectors", type=int, default=20000, help="Number of synthetic vectors")
+    parser.add_argument("--dim", type=int, default=1536, help="Full size of the synthetic vectors")
+    parser.add_argument("--dimensions", type=int, nargs="+", default=[256, 512, 1024, 1536])
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--query-noise", type=float, default=0.5)
+    parser.add_argument("--top-k", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.corpus:
+        store = CorpusEmbeddingStore(os.path.realpath(args.corpus))
+        vectors = np.asarray(store.module_vectors(args.module), dtype=np.float32)
+        vectors = vectors[np.linalg.norm(vectors, axis=1) > 0]
+    else:
+        vectors = build_synthetic_vectors(args.vectors, args.dim, args.seed)
+    full_dim = vectors.shape[1]
+    queries = make_queries(vectors, args.queries, args.query_noise, args.seed)
+    print(f"{len(vectors)} vectors of {full_dim} dimensions, {len(queries)} queries, top {args.top_k}")
+
+    reference = [set(search(vectors, query, args.top_k)[0].tolist()) for query in queries]
+    reference_top1 = [search(vectors, query, 1)[0][0] for query in queries]
+
+    results = []
+    for size in sorted(size for size in args.dimensions if size <= full_dim):
+        sized_vectors = np.ascontiguousarray(truncate_embeddings(vectors, size))
+        sized_queries = truncate_embeddings(queries, size)
+        search_seconds, overlaps, top1, mean_scores, requests, responses, codec_seconds = [], [], [], [], [], [], []
+        for query, expected, expected_top1 in zip(sized_queries, reference, reference_top1):
+            start = time.perf_counter()
+            rows, scores = search(sized_vectors, query, args.top_k)
+            search_seconds.append(time.perf_counter() - start)
+            overlaps.append(len(expected & set(rows.tolist())) / len(expected))
+            top1.append(rows[0] == expected_top1)
+            mean_scores.append(float(scores.mean()))
+            request_bytes, response_bytes, seconds = pinecone_payloads(sized_vectors, query, rows, scores)
+            requests.append(request_bytes)
+            responses.append(response_bytes)
+            codec_seconds.append(seconds)
+        results.append({
+            "dimensions": size,
+            "float32_mb": round(sized_vectors.nbytes / 2 ** 20, 1),
+            "float16_mb": round(sized_vectors.nbytes / 2 ** 21, 1),
+            "search_ms": round(float(np.mean(search_seconds)) * 1000, 2),
+            "request_kb": round(float(np.mean(requests)) / 1024, 1),
+            "response_kb": round(float(np.mean(responses)) / 1024, 1),
+            "response_codec_ms": round(float(np.mean(codec_seconds)) * 1000, 2),
+            f"overlap@{args.top_k}": round(float(np.mean(overlaps)), 3),
+            "top1_agreement": round(float(np.mean(top1)), 3),
+            "mean_topk_score": round(float(np.mean(mean_scores)), 3),
+        })
+
+    columns = list(results[0])
+    print("  ".join(f"{column:>17}" for column in columns))
+    for result in results:
+        print("  ".join(f"{result[column]:>17}" for column in columns))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"vectors": len(vectors), "queries": len(queries), "top_k": args.top_k, "results": results}, f,
+                      indent=2)
+        print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
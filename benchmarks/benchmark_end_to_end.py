@@ -0,0 +1,224 @@
+"""
+End-to-end latency benchmark of the search and generation endpoints against local fakes of MongoDB,
+Pinecone and OpenAI (see `benchmarks.fakes`), so it runs without credentials or network access.
+
+The FastAPI app is driven in process through httpx's ASGI transport by concurrent workers. Each request asks
+for debug timings, which give the per-stage breakdown of where the time went. The fake services sleep for
+the configured latencies, so results reflect the service's own overhead and concurrency plus the modelled
+network and model time.
+
+Usage:
+    python -m benchmarks.benchmark_end_to_end --corpus-size 2000 --requests 50 --concurrency 8
+    python -m benchmarks.benchmark_end_to_end --endpoint generate --chat-latency-ms 800 --output results.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+import uuid
+
+from benchmarks.fakes import LatencyModel, install_fakes
+
+SEARCH_PATH = "/api/v1/ml/search_documents"
+GENERATE_PATH = "/api/v1/ml/generate_trial_eligibility_criteria"
+
+_SEARCH_INPUTS = [
+    {
+        "rationale": "Evaluate a once-weekly GLP-1 receptor agonist as add-on to metformin",
+        "condition": "type 2 diabetes mellitus",
+        "title": "A Study of Semaglutide in Participants With Type 2 Diabetes Mellitus",
+        "efficacyEndpoints": "Change in HbA1c from baseline to week 26",
+        "inclusionCriteria": "Age 18 years or above. HbA1c between 7.0% and 10.5%. "
+                             "Treated with stable dose of metformin for at least 12 weeks",
+        "exclusionCriteria": "eGFR below 30 mL/min/1.73 m2. Pregnant or breastfeeding women",
+    },
+    {
+        "rationale": "Weight management in obese participants with prediabetes",
+        "condition": "obesity, prediabetes",
+        "title": "A Study of Tirzepatide in Participants With Obesity",
+        "efficacyEndpoints": "Change in body weight from baseline to week 52",
+        "inclusionCriteria": "BMI between 27 and 45 kg/m2. Diagnosed with prediabetes at least 6 months before screening",
+        "exclusionCriteria": "History of heart failure within 6 months before screening",
+    },
+    {
+        "rationale": "Renal outcomes of SGLT2 inhibition in diabetic kidney disease",
+        "condition": "diabetic kidney disease",
+        "title": "A Study of Dapagliflozin in Participants With Diabetic Kidney Disease",
+        "efficacyEndpoints": "Change in eGFR from baseline to week 52",
+        "inclusionCriteria": "Age 30 years or above. Diagnosed with diabetic kidney disease at least 12 months before screening",
+        "exclusionCriteria": "Active malignancy or history of cancer within 5 years",
+    },
+]
+
+
+def build_search_payload(random_generator: random.Random) -> dict:
+    payload = dict(random_generator.choice(_SEARCH_INPUTS))
+    payload.update({
+        "ecid": str(uuid.UUID(int=random_generator.getrandbits(128))),
+        "userName": "benchmark",
+        "objective": "",
+        "interventionType": "",
+        "weights": {"inclusionCriteria": 0.2, "exclusionCriteria": 0.2, "condition": 0.2, "title": 0.2,
+                    "trialOutcomes": 0.2},
+        "phase": [],
+        "country": [],
+    })
+    return payload
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(results: list, wall_seconds: float) -> dict:
+    latencies = [result["seconds"] for result in results if result["ok"]]
+    stages = {}
+    for result in results:
+        for stage, timing in ((result.get("debugTimings") or {}).get("stages") or {}).items():
+            stage_summary = stages.setdefault(stage, {"count": 0, "seconds": []})
+            stage_summary["count"] += timing["count"]
+            stage_summary["seconds"].append(timing["seconds"])
+
+    return {
+        "requests": len(results),
+        "errors": sum(1 for result in results if not result["ok"]),
+        "throughputPerSecond": round(len(results) / wall_seconds, 3) if wall_seconds else 0.0,
+        "latencySeconds": {
+            "mean": round(statistics.mean(latencies), 4) if latencies else 0.0,
+            "p50": round(percentile(latencies, 0.50), 4),
+            "p95": round(percentile(latencies, 0.95), 4),
+            "p99": round(percentile(latencies, 0.99), 4),
+            "max": round(max(latencies), 4) if latencies else 0.0,
+        },
+        # Stage time summed per request, stages running in parallel threads can add up to more than the latency
+        "stages": {
+            stage: {
+                "callsPerRequest": round(stage_summary["count"] / len(results), 2),
+                "meanSecondsPerRequest": round(sum(stage_summary["seconds"]) / len(results), 4),
+                "p95SecondsPerRequest": round(percentile(stage_summary["seconds"], 0.95), 4),
+            }
+            for stage, stage_summary in sorted(stages.items(), key=lambda item: -sum(item[1]["seconds"]))
+        },
+    }
+
+
+async def run_load(client, payloads: list, path: str, concurrency: int) -> tuple:
+    queue = asyncio.Queue()
+    for payload in payloads:
+        queue.put_nowait(payload)
+    results = []
+
+    async def worker():
+        while not queue.empty():
+            payload = queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                response = await client.post(path, json=payload, headers={"X-Debug-Timings": "true"})
+                body = response.json()
+                results.append({"ok": response.status_code == 200 and body.get("success") is True,
+                                "seconds": time.perf_counter() - start, "status": response.status_code,
+                                "payload": payload, "data": body.get("data"),
+                                "debugTimings": body.get("debug_timings")})
+            except Exception as e:
+                print(f"Request to {path} failed: {e}")
+                results.append({"ok": False, "seconds": time.perf_counter() - start, "status": None,
+                                "payload": payload, "data": None, "debugTimings": None})
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results, time.perf_counter() - start
+
+
+async def run_benchmark(args) -> dict:
+    import httpx
+    from main import app
+    from database.write_behind_queue import shutdown_write_behind_queue
+
+    random_generator = random.Random(args.seed)
+    report = {"config": vars(args)}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        search_results = []
+        if args.endpoint in ("search", "both", "generate"):
+            # Generation needs stored searches to draft from, so searches always run first
+            search_payloads = [build_search_payload(random_generator) for _ in range(args.requests)]
+            search_results, wall_seconds = await run_load(client, search_payloads, SEARCH_PATH, args.concurrency)
+            if args.endpoint != "generate":
+                report["search"] = summarize(search_results, wall_seconds)
+
+        if args.endpoint in ("generate", "both"):
+            generate_payloads = [
+                {"ecid": result["payload"]["ecid"],
+                 "trialDocuments": [trial["nctId"] for trial in result["data"][:args.trials_per_generation]]}
+                for result in search_results if result["ok"] and result["data"]
+            ]
+            generate_results, wall_seconds = await run_load(client, generate_payloads, GENERATE_PATH,
+                                                            args.concurrency)
+            report["generate"] = summarize(generate_results, wall_seconds)
+
+    shutdown_write_behind_queue()
+    return report
+
+
+def print_report(report: dict) -> None:
+    for endpoint in ("search", "generate"):
+        if endpoint not in report:
+            continue
+        summary = report[endpoint]
+        latency = summary["latencySeconds"]
+        print(f"\n{endpoint}: {summary['requests']} requests, {summary['errors']} errors, "
+              f"{summary['throughputPerSecond']} req/s")
+        print(f"  latency  mean {latency['mean']}s  p50 {latency['p50']}s  p95 {latency['p95']}s  "
+              f"p99 {latency['p99']}s  max {latency['max']}s")
+        print(f"  {'stage':<24}{'calls/req':>10}{'mean s/req':>12}{'p95 s/req':>12}")
+        for stage, stage_summary in summary["stages"].items():
+            print(f"  {stage:<24}{stage_summary['callsPerRequest']:>10}"
+                  f"{stage_summary['meanSecondsPerRequest']:>12}{stage_summary['p95SecondsPerRequest']:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus-size", type=int, default=1000, help="Number of synthetic trials")
+    parser.add_argument("--requests", type=int, default=20, help="Number of requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--endpoint", choices=["search", "generate", "both"], default="both")
+    parser.add_argument("--trials-per-generation", type=int, default=5,
+                        help="Number of top search results drafted from per generation request")
+    parser.add_argument("--mongo-latency-ms", type=float, default=2)
+    parser.add_argument("--pinecone-latency-ms", type=float, default=40)
+    parser.add_argument("--embedding-latency-ms", type=float, default=60)
+    parser.add_argument("--chat-latency-ms", type=float, default=1500)
+    parser.add_argument("--jitter", type=float, default=0.2, help="Latency standard deviation as a fraction of the mean")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    def latency(mean_ms, offset):
+        return LatencyModel(mean_ms, mean_ms * args.jitter, seed=args.seed + offset)
+
+    start = time.perf_counter()
+    install_fakes(corpus_size=args.corpus_size, seed=args.seed,
+                  mongo_latency=latency(args.mongo_latency_ms, 1),
+                  pinecone_latency=latency(args.pinecone_latency_ms, 2),
+                  embedding_latency=latency(args.embedding_latency_ms, 3),
+                  chat_latency=latency(args.chat_latency_ms, 4))
+    print(f"Loaded {args.corpus_size} synthetic trials in {time.perf_counter() - start:.2f}s")
+
+    report = asyncio.run(run_benchmark(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
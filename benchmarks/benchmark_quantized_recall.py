@@ -0,0 +1,132 @@
+"""
+Recall@k versus latency of the quantized first-pass tiers (int8, binary) against exact weighted scoring.
+
+The ground truth is the exact weighted cosine score over every trial and module, the score
+`calculate_weighted_similarity_score` gives a trial. For each tier and candidate pool size, a quantized pass
+over the whole corpus keeps the candidates, which are re-scored with full precision; recall@k is the share of
+the exact top k that the re-scored top k contains.
+
+Without --corpus a synthetic corpus of clustered unit vectors is generated. Queries are perturbed copies of
+random trials, like a user input that resembles an existing trial.
+
+Usage:
+    python -m benchmarks.benchmark_quantized_recall --trials 50000 --queries 50 --top-k 20
+    python -m benchmarks.benchmark_quantized_recall --corpus /data/corpus/current.emb
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from providers.corpus.corpus_store import CORPUS_MODULES, CorpusEmbeddingStore, CorpusStoreWriter
+from providers.corpus.quantized_index import QUANTIZATION_MODES, QuantizedCorpusIndex, build_quantized_sidecars
+
+
+def build_synthetic_corpus(path: str, trials: int, dim: int, dtype: str, seed: int, topics: int = 256) -> None:
+    generator = np.random.default_rng(seed)
+    centers = generator.standard_normal((topics, dim)).astype(np.float32)
+    trial_topics = generator.integers(0, topics, trials)
+    nct_ids = [f"NCT{index:08d}" for index in range(trials)]
+    with CorpusStoreWriter(path, nct_ids, list(CORPUS_MODULES), dim=dim, dtype=dtype, version="synthetic") as writer:
+        for module in CORPUS_MODULES:
+            for start in range(0, trials, 10000):
+                topics_chunk = trial_topics[start:start + 10000]
+                noise = generator.standard_normal((len(topics_chunk), dim)).astype(np.float32)
+                writer.write(start, module, centers[topics_chunk] + 1.5 * noise)
+
+
+def make_queries(store, count: int, noise: float, seed: int) -> list:
+    generator = np.random.default_rng(seed + 1)
+    queries = []
+    for row in generator.integers(0, len(store), count):
+        queries.append({
+            module: (np.asarray(store.matrix[row, position], dtype=np.float32)
+                     + noise / np.sqrt(store.dim) * generator.standard_normal(store.dim)).astype(np.float32)
+            for position, module in enumerate(store.modules)
+        })
+    return queries
+
+
+def exact_scores(store, query_vectors: dict, weights: dict, chunk_size: int = 65536) -> np.ndarray:
+    """Full-precision weighted cosine scores of every trial."""
+    scores = np.zeros(len(store), dtype=np.float32)
+    for module, query_vector in query_vectors.items():
+        query_vector = query_vector / np.linalg.norm(query_vector)
+        vectors = store.module_vectors(module)
+        for start in range(0, len(store), chunk_size):
+            scores[start:start + chunk_size] += weights[module] * (
+                vectors[start:start + chunk_size].astype(np.float32) @ query_vector)
+    return scores / sum(weights[module] for module in query_vectors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="Corpus file or symlink, defaults to a synthetic corpus")
+    parser.add_argument("--trials", type=int, default=20000, help="Trials of the synthetic corpus")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--dtype", choices=["float16", "float32"], default="float16")
+    parser.add_argument("--queries", type=int, default=30)
+    parser.add_argument("--query-noise", type=float, default=1.0,
+                        help="Perturbation of the queries, relative to a unit vector")
+    parser.add_argument("--top-k", type=int, default=20)
+    parser.add_argument("--candidate-factors", type=int, nargs="*", default=[1, 2, 4, 8, 16],
+                        help="Candidate pool sizes as multiples of top k")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    temporary_directory = None
+    if args.corpus:
+        # Uses the published sidecars, or quantizes in memory when there are none
+        store = CorpusEmbeddingStore(os.path.realpath(args.corpus))
+    else:
+        temporary_directory = tempfile.TemporaryDirectory()
+        corpus_path = os.path.join(temporary_directory.name, "synthetic.emb")
+        start = time.perf_counter()
+        build_synthetic_corpus(corpus_path, args.trials, args.dim, args.dtype, args.seed)
+        store = CorpusEmbeddingStore(corpus_path)
+        build_quantized_sidecars(store)
+        print(f"Generated and quantized {args.trials} synthetic trials in {time.perf_counter() - start:.1f}s")
+    index = QuantizedCorpusIndex(store)
+    print(f"Bytes per vector: {store.matrix.dtype.name} {store.matrix.itemsize * store.dim}, "
+          f"int8 {store.dim + 4}, binary {index.bits.shape[-1]}")
+
+    weights = {module: 1 / len(store.modules) for module in store.modules}
+    queries = make_queries(store, args.queries, args.query_noise, args.seed)
+
+    exact_seconds, truths = [], []
+    for query_vectors in queries:
+        start = time.perf_counter()
+        scores = exact_scores(store, query_vectors, weights)
+        truths.append(set(np.argsort(-scores)[:args.top_k].tolist()))
+        exact_seconds.append(time.perf_counter() - start)
+    print(f"\nexact float scan: {np.mean(exact_seconds) * 1000:.1f} ms per query\n")
+
+    print(f"{'tier':<8}{'candidates':>11}{'recall@' + str(args.top_k):>11}{'first pass ms':>15}{'rescore ms':>12}{'total ms':>10}")
+    for mode in QUANTIZATION_MODES:
+        for factor in args.candidate_factors:
+            candidates = args.top_k * factor
+            recalls, first_pass_seconds, rescore_seconds = [], [], []
+            for query_vectors, truth in zip(queries, truths):
+                unit_queries = {module: vector / np.linalg.norm(vector) for module, vector in query_vectors.items()}
+                start = time.perf_counter()
+                rows = index.first_pass(unit_queries, weights, candidates, mode)
+                first_pass_seconds.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                scores = index.rescore(rows, unit_queries, weights)
+                top = rows[np.argsort(-scores)[:args.top_k]]
+                rescore_seconds.append(time.perf_counter() - start)
+                recalls.append(len(truth & set(top.tolist())) / len(truth))
+            first_pass_ms = np.mean(first_pass_seconds) * 1000
+            rescore_ms = np.mean(rescore_seconds) * 1000
+            print(f"{mode:<8}{candidates:>11}{np.mean(recalls):>11.3f}{first_pass_ms:>15.1f}{rescore_ms:>12.1f}"
+                  f"{first_pass_ms + rescore_ms:>10.1f}")
+
+    if temporary_directory is not None:
+        del index, store
+        temporary_directory.cleanup()
+
+
+if __name__ == "__main__":
+    main()
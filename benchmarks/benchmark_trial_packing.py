@@ -0,0 +1,124 @@
+"""
+Compares single-trial and packed drafting for `generate_trial_eligibility_criteria`.
+
+Reports drafting calls and estimated prompt tokens for both modes. With --live the drafting calls are sent
+to the LLM and the wall-clock latency and per-trial source attribution are reported as well.
+
+Usage:
+    python -m benchmarks.benchmark_trial_packing --ecid <ecid> --nct-ids NCT0001 NCT0002 --budget 12000 [--live]
+    python -m benchmarks.benchmark_trial_packing --documents documents.json --budget 12000
+"""
+import argparse
+import concurrent.futures
+import json
+import time
+
+from agents.TrialEligibilityAgent import TrialEligibilityAgent
+from document_retrieval.utils import prompts
+from document_retrieval.utils.pack_trial_documents import estimate_tokens, pack_trial_documents
+
+
+def load_documents(args) -> list:
+    if args.documents:
+        with open(args.documents) as f:
+            return json.load(f)
+
+    from database.document_retrieval.fetch_processed_trial_document_with_nct_id import \
+        fetch_processed_trial_document_with_nct_id
+
+    documents = []
+    for nct_id in args.nct_ids:
+        doc = fetch_processed_trial_document_with_nct_id(nct_id=nct_id)["data"]
+        if doc is None:
+            print(f"Skipping {nct_id}: document not found")
+            continue
+        documents.append({
+            "nctId": nct_id,
+            "similarity_score": 0,
+            "document": {
+                "title": doc["officialTitle"],
+                "inclusionCriteria": doc["inclusionCriteria"],
+                "exclusionCriteria": doc["exclusionCriteria"],
+                "primaryOutcomes": doc["primaryOutcomes"]
+            }
+        })
+    return documents
+
+
+def load_user_inputs(ecid: str) -> dict:
+    if not ecid:
+        return {}
+    from database.document_retrieval.fetch_similar_trials_inputs_with_ecid import fetch_similar_trials_inputs_with_ecid
+    response = fetch_similar_trials_inputs_with_ecid(ecid=ecid, nct_ids=[])
+    return response["data"]["userInput"] if response["success"] else {}
+
+
+def estimate_plan(batches: list, system_prompt: str, user_inputs: dict) -> dict:
+    base_tokens = estimate_tokens(system_prompt) + estimate_tokens(user_inputs)
+    prompt_tokens = sum(base_tokens + sum(estimate_tokens(document) for document in batch) for batch in batches)
+    return {"draftingCalls": len(batches), "estimatedPromptTokens": prompt_tokens,
+            "repeatedOverheadTokens": base_tokens * len(batches)}
+
+
+def run_plan(batches: list, user_inputs: dict) -> dict:
+    eligibility_agent = TrialEligibilityAgent(azure_client=None, max_tokens=4000)
+
+    def draft(batch):
+        return eligibility_agent.draft_eligibility_criteria(
+            sample_trial_rationale=user_inputs.get("rationale", "No rationale provided"),
+            similar_trial_documents=batch if len(batch) > 1 else batch[0],
+            user_provided_inclusion_criteria=user_inputs.get("inclusionCriteria", "No inclusion criteria provided"),
+            user_provided_exclusion_criteria=user_inputs.get("exclusionCriteria", "No exclusion criteria provided"),
+            user_provided_trial_outcome=user_inputs.get("trialOutcomes", "No trial outcomes provided"),
+            user_provided_trial_conditions=user_inputs.get("condition", "No trial conditions provided"),
+            generated_inclusion_criteria=[],
+            generated_exclusion_criteria=[]
+        )["data"]
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=30) as executor:
+        results = list(executor.map(draft, batches))
+    latency = time.perf_counter() - start
+
+    criteria = [item for result in results for item in result["inclusionCriteria"] + result["exclusionCriteria"]]
+    attributed_trials = {nct_id for item in criteria for nct_id in item.get("source", {})}
+    return {
+        "latencySeconds": round(latency, 2),
+        "criteria": len(criteria),
+        "attributedCriteria": sum(1 for item in criteria if item.get("source")),
+        "trialsWithAttribution": len(attributed_trials)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", help="JSON file with a list of prepared trial documents")
+    parser.add_argument("--nct-ids", nargs="*", default=[], help="Trials to load from MongoDB")
+    parser.add_argument("--ecid", help="Job whose user inputs are used in the prompt")
+    parser.add_argument("--budget", type=int, default=12000, help="Prompt token budget per packed call")
+    parser.add_argument("--live", action="store_true", help="Send the drafting calls to the LLM")
+    args = parser.parse_args()
+
+    documents = load_documents(args)
+    user_inputs = load_user_inputs(args.ecid)
+    if not documents:
+        parser.error("No trial documents to benchmark")
+
+    single_batches = [[document] for document in documents]
+    base_tokens = estimate_tokens(prompts.medical_writer_agent_role_packed) + estimate_tokens(user_inputs)
+    packed_batches = pack_trial_documents(documents, token_budget=args.budget, base_tokens=base_tokens)
+
+    report = {
+        "trials": len(documents),
+        "single": estimate_plan(single_batches, prompts.medical_writer_agent_role, user_inputs),
+        "packed": estimate_plan(packed_batches, prompts.medical_writer_agent_role_packed, user_inputs)
+    }
+    if args.live:
+        report["single"].update(run_plan(single_batches, user_inputs))
+        report["packed"].update(run_plan(packed_batches, user_inputs))
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
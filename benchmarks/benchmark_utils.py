@@ -0,0 +1,240 @@
+"""
+Micro-benchmarks of the pure-Python document_retrieval helpers at production scale, with a stored baseline.
+
+Each case runs on generated fixtures of 100, 1k, 10k and 100k candidates or criteria and reports the best
+of several runs. The results are compared with the baseline file and the run fails (exit code 1) when a case
+is slower than its baseline by more than the tolerance. Baselines are machine specific, so regenerate them
+with --save-baseline on the machine that runs the comparison.
+
+Cases:
+    process_filters             Filtering candidates by phase, country, sponsor, dates and sample size.
+    extract_trial_filters       Parsing the filter fields out of preprocessed trial documents.
+    merge_duplicate_values      Merging extracted metric values with their sources.
+    normalize_bmi_ranges        Rewriting open BMI ranges.
+    group_categorized_criteria  Looking up categorised criteria by criteriaID.
+    score_embedded_documents    Weighted cosine similarity of embedded candidates.
+
+Usage:
+    python -m benchmarks.benchmark_utils
+    python -m benchmarks.benchmark_utils --sizes 100 1000 --cases process_filters --tolerance 0.5
+    python -m benchmarks.benchmark_utils --save-baseline
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+import numpy as np
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines", "benchmark_utils.json")
+DEFAULT_SIZES = [100, 1000, 10000, 100000]
+
+# Generating fixtures is not measured, distinct records are drawn from pools of this size and repeated
+_POOL_SIZE = 2000
+
+
+def _pool(build, size: int, random_generator: random.Random) -> list:
+    pool = [build(index, random_generator) for index in range(min(size, _POOL_SIZE))]
+    return [pool[index % len(pool)] for index in range(size)]
+
+
+def setup_process_filters(size: int, random_generator: random.Random):
+    from document_retrieval.utils.fetch_trial_filters import extract_trial_filters
+    from document_retrieval.utils.process_filters import process_filters
+    from benchmarks.fakes import build_synthetic_trial
+
+    def build(index, generator):
+        processed, preprocessed = build_synthetic_trial(index, generator)
+        return {"nctId": processed["nctId"], **extract_trial_filters(preprocessed)}
+
+    documents = _pool(build, size, random_generator)
+    filters = {"phases": ["PHASE2", "PHASE3"], "locations": ["United States", "India"], "countryLogic": "OR",
+               "startDate": "2008-01", "endDate": "2030-12", "sponsorType": "INDUSTRY",
+               "sampleSizeMin": 100, "sampleSizeMax": 1500}
+    return lambda: process_filters(documents=documents, filters=filters)
+
+
+def setup_extract_trial_filters(size: int, random_generator: random.Random):
+    from document_retrieval.utils.fetch_trial_filters import extract_trial_filters
+    from benchmarks.fakes import build_synthetic_trial
+
+    documents = _pool(lambda index, generator: build_synthetic_trial(index, generator)[1], size, random_generator)
+    return lambda: [extract_trial_filters(document) for document in documents]
+
+
+def _metric_value(index: int, generator: random.Random) -> dict:
+    value = generator.choice([f"HbA1c {generator.choice([6.5, 7, 7.5, 8])} - {generator.choice([9.5, 10, 10.5, 11])}",
+                              f"Age >= {generator.choice([18, 20, 30, 40])}",
+                              f"eGFR < {generator.choice([30, 45, 60])}"])
+    return {"value": value, "count": 1, "source": [f"NCT{generator.randint(0, 99999999):08d}"]}
+
+
+def setup_merge_duplicate_values(size: int, random_generator: random.Random):
+    from document_retrieval.utils.merge_duplicate_values import merge_duplicate_values
+
+    data = _pool(_metric_value, size, random_generator)
+    return lambda: merge_duplicate_values(data)
+
+
+def setup_normalize_bmi_ranges(size: int, random_generator: random.Random):
+    from document_retrieval.utils.merge_duplicate_values import normalize_bmi_ranges
+
+    def build(index, generator):
+        low, high = generator.choice([18.5, 25, 27, 30]), generator.choice([35, 40, 44.5, 45])
+        value = generator.choice([f"BMI X - {high}", f"BMI {low} - X", f"BMI {low} - {high}"])
+        return {"value": value, "count": 1, "source": [f"NCT{index:08d}"]}
+
+    data = _pool(build, size, random_generator)
+    return lambda: normalize_bmi_ranges(data)
+
+
+def setup_group_categorized_criteria(size: int, random_generator: random.Random):
+    from document_retrieval.utils.categorize_eligibility_criteria import group_categorized_criteria
+    from document_retrieval.utils.response_schemas import criteria_categories
+
+    user_provided_criteria = {"inclusionCriteria": [], "exclusionCriteria": []}
+    categorized_criteria = {"inclusionCriteria": [], "exclusionCriteria": []}
+    for index in range(size):
+        # Criteria IDs must be unique, so the records are not pooled
+        criteria_type = "inclusionCriteria" if index % 2 == 0 else "exclusionCriteria"
+        statement = f"Criterion {index}"
+        user_provided_criteria[criteria_type].append({"criteriaID": f"cid_{index}", "criteria": statement,
+                                                      "source": {"User Provided": statement}})
+        categorized_criteria[criteria_type].append({"criteriaID": f"cid_{index}",
+                                                    "class": random_generator.choice(criteria_categories)})
+    for criteria_type in categorized_criteria:
+        random_generator.shuffle(categorized_criteria[criteria_type])
+    return lambda: group_categorized_criteria(categorized_criteria, user_provided_criteria)
+
+
+def setup_score_embedded_documents(size: int, random_generator: random.Random):
+    from document_retrieval.utils.calculate_weighted_similarity_score import score_embedded_documents
+
+    modules = ["inclusionCriteria", "exclusionCriteria", "title", "trialOutcomes", "condition"]
+    weights = {module: 0.2 for module in modules}
+    numpy_generator = np.random.default_rng(random_generator.randint(0, 2 ** 32))
+
+    def embed():
+        # Embeddings are passed around as lists, as returned by `generate_embeddings_from_azure_client`
+        return {module: numpy_generator.standard_normal(1536).tolist() for module in modules}
+
+    user_document = embed()
+    # 1536-dimensional embeddings of 100k candidates do not fit in memory, candidates share a small pool
+    pool = [embed() for _ in range(min(size, 64))]
+    targets = [pool[index % len(pool)] for index in range(size)]
+    return lambda: [score_embedded_documents(user_document, target, weights) for target in targets]
+
+
+CASES = {
+    "process_filters": setup_process_filters,
+    "extract_trial_filters": setup_extract_trial_filters,
+    "merge_duplicate_values": setup_merge_duplicate_values,
+    "normalize_bmi_ranges": setup_normalize_bmi_ranges,
+    "group_categorized_criteria": setup_group_categorized_criteria,
+    "score_embedded_documents": setup_score_embedded_documents,
+}
+
+
+def time_case(run, repeat: int, max_seconds: float) -> float:
+    """Returns the best of `repeat` runs, stopping early once `max_seconds` have been spent on the case."""
+    best = float("inf")
+    spent = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+        spent += elapsed
+        if spent >= max_seconds:
+            break
+    return best
+
+
+def run_benchmarks(cases: list, sizes: list, repeat: int, max_seconds: float, seed: int) -> dict:
+    results = {}
+    for case in cases:
+        results[case] = {}
+        for size in sizes:
+            try:
+                run = CASES[case](size, random.Random(seed))
+            except Exception as e:
+                print(f"{case:<28}{size:>8}  skipped: {e}")
+                continue
+            seconds = time_case(run, repeat, max_seconds)
+            results[case][str(size)] = seconds
+            print(f"{case:<28}{size:>8}{seconds * 1000:>12.3f} ms{seconds / size * 1e6:>12.3f} us/item")
+    return results
+
+
+def compare_with_baseline(results: dict, baseline: dict, tolerance: float, min_seconds: float) -> list:
+    """
+    Returns the regressions: cases that are slower than the baseline by more than `tolerance` (a fraction)
+    and by more than `min_seconds`, which keeps timer noise on the smallest fixtures from failing the run.
+    """
+    regressions = []
+    for case, sizes in results.items():
+        for size, seconds in sizes.items():
+            baseline_seconds = baseline.get("results", {}).get(case, {}).get(size)
+            if baseline_seconds is None:
+                continue
+            if seconds > baseline_seconds * (1 + tolerance) and seconds - baseline_seconds > min_seconds:
+                regressions.append({"case": case, "size": int(size), "seconds": seconds,
+                                    "baselineSeconds": baseline_seconds,
+                                    "slowdown": round(seconds / baseline_seconds, 2)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", nargs="*", choices=sorted(CASES), default=list(CASES))
+    parser.add_argument("--sizes", type=int, nargs="*", default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per case, the best one is reported")
+    parser.add_argument("--max-seconds", type=float, default=10, help="Time limit of the runs of one case and size")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown as a fraction of the baseline")
+    parser.add_argument("--min-seconds", type=float, default=0.002, help="Ignore slowdowns smaller than this")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'case':<28}{'size':>8}{'best':>15}{'per item':>20}")
+    results = run_benchmarks(args.cases, args.sizes, args.repeat, args.max_seconds, args.seed)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        # Cases and sizes that were not run keep their earlier baseline
+        for case, sizes in results.items():
+            baseline.setdefault("results", {}).setdefault(case, {}).update(sizes)
+        baseline["python"] = platform.python_version()
+        baseline["machine"] = f"{platform.system()} {platform.machine()} {platform.processor()}".strip()
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"\nSaved baseline to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}, run with --save-baseline to create one")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    regressions = compare_with_baseline(results, baseline, args.tolerance, args.min_seconds)
+    if not regressions:
+        print(f"\nNo regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+        return
+    print(f"\n{len(regressions)} regression(s) against {args.baseline} (tolerance {args.tolerance:.0%}):")
+    for regression in regressions:
+        print(f"  {regression['case']} at {regression['size']}: {regression['seconds'] * 1000:.3f} ms, "
+              f"baseline {regression['baselineSeconds'] * 1000:.3f} ms ({regression['slowdown']}x)")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Checks the rule-based timeframe parser against cached `timeframe_count_prompt` LLM outputs.
+
+The cache is a JSON lines file with one {"nctId", "timeLine", "llmValues"} record per trial. Build it once
+from processed trials with --build-cache (one LLM call per trial), then re-run the check after every parser change.
+LLM values are canonicalized with the same normalizer, so "Week 26" and "week 26" or "month 6" and "week 26" agree.
+The parser is also checked against KNOWN_CASES, time frames whose parse is known, and the failures are reported.
+
+Usage:
+    python -m benchmarks.check_timeframe_parser_agreement --cache timeframes.jsonl --build-cache --limit 500
+    python -m benchmarks.check_timeframe_parser_agreement --cache timeframes.jsonl
+"""
+import argparse
+import json
+
+from agents.TrialEligibilityAgent import TrialEligibilityAgent
+from document_retrieval.utils import prompts
+from document_retrieval.utils.parse_timeframes import parse_timeframe_text, parse_timeframes
+
+# (time frame, expected values) the rules must parse exactly
+KNOWN_CASES = [
+    ("Week 26", ["week 26"]),
+    ("Weeks 12, 24 and 52", ["week 12", "week 24", "week 52"]),
+    ("Baseline to Week 24", ["week 24"]),
+    ("Weeks 4-12", ["week 4", "week 12"]),
+    ("Baseline, Weeks 4 to 12", ["week 4", "week 12"]),
+    ("Weeks 4 to 12 months", ["week 4", "week 52"]),
+    ("Day 1-Week 4", ["day 1", "week 4"]),
+    ("12/24 weeks", ["week 12", "week 24"]),
+    ("Week 12 and 24 months", ["week 12", "week 104"]),
+    ("Day 1, 26 weeks", ["day 1", "week 26"]),
+]
+
+
+def build_cache(path: str, limit: int) -> None:
+    from database.mongo_db_connection import MongoDBDAO
+    from providers.openai.openai_connection import OpenAIClient
+
+    mongo_dao = MongoDBDAO()
+    eligibility_agent = TrialEligibilityAgent(azure_client=None)
+    openai_client = OpenAIClient()
+    documents = mongo_dao.database["t2dm_final_data_samples_processed"].find(
+        {}, {"_id": 0, "nctId": 1, "primaryOutcomes": 1}
+    ).limit(limit)
+
+    with open(path, "w") as f:
+        for document in documents:
+            time_line = eligibility_agent.extract_timeframes_and_text(document.get("primaryOutcomes") or "")
+            if not time_line:
+                continue
+            messages = [
+                {"role": "system", "content": prompts.timeframe_count_prompt},
+                {"role": "user", "content": f"{[{'nctId': document['nctId'], 'timeLine': time_line}]}"}
+            ]
+            response = openai_client.generate_text(messages=messages, response_format={"type": "json_object"})
+            try:
+                llm_values = [item["value"] for item in
+                              json.loads(response["data"].choices[0].message.content)["response"]]
+            except Exception as e:
+                print(f"Skipping {document['nctId']}: {e}")
+                continue
+            f.write(json.dumps({"nctId": document["nctId"], "timeLine": time_line, "llmValues": llm_values}) + "\n")
+
+
+def canonicalize(value: str) -> set:
+    parsed = parse_timeframe_text(value)
+    return set(parsed) if parsed else {" ".join(value.lower().split())}
+
+
+def check_known_cases() -> list:
+    """Returns the KNOWN_CASES the rules do not parse to the expected values."""
+    failures = []
+    for text, expected in KNOWN_CASES:
+        parsed = parse_timeframe_text(text)
+        if parsed != expected:
+            failures.append({"timeFrame": text, "expected": expected, "parsed": parsed})
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cache", required=True, help="JSON lines file with cached LLM outputs")
+    parser.add_argument("--build-cache", action="store_true", help="Rebuild the cache with LLM calls first")
+    parser.add_argument("--limit", type=int, default=500, help="Trials to cache when building")
+    parser.add_argument("--show", type=int, default=20, help="Disagreements to print")
+    args = parser.parse_args()
+
+    if args.build_cache:
+        build_cache(args.cache, args.limit)
+
+    with open(args.cache) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+
+    exact_matches = 0
+    jaccard_total = 0.0
+    unparsed = 0
+    disagreements = []
+    for record in records:
+        result = parse_timeframes([{"nctId": record["nctId"], "timeLine": record["timeLine"]}])
+        if result["unparsed"]:
+            unparsed += 1
+            continue
+        rule_values = {item["value"] for item in result["response"]}
+        llm_values = set().union(*(canonicalize(value) for value in record["llmValues"])) if record["llmValues"] else set()
+        union = rule_values | llm_values
+        jaccard_total += len(rule_values & llm_values) / len(union) if union else 1.0
+        if rule_values == llm_values:
+            exact_matches += 1
+        else:
+            disagreements.append({"nctId": record["nctId"], "timeLine": record["timeLine"],
+                                  "rules": sorted(rule_values), "llm": sorted(llm_values)})
+
+    parsed = len(records) - unparsed
+    report = {
+        "knownCaseFailures": check_known_cases(),
+        "trials": len(records),
+        "parsedByRules": parsed,
+        "llmFallbackRate": round(unparsed / len(records), 3) if records else 0,
+        "exactAgreement": round(exact_matches / parsed, 3) if parsed else None,
+        "meanJaccard": round(jaccard_total / parsed, 3) if parsed else None,
+        "disagreements": disagreements[:args.show]
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,775 @@
+"""
+Local stand-ins for MongoDB, Pinecone and the OpenAI / Azure OpenAI clients, for benchmarks without live services.
+
+The fakes replace the clients the service creates (`MongoClient`, `Pinecone` and the shared `OpenAI` and
+`AzureOpenAI` clients), so every code path above them runs unchanged. Each fake sleeps for a configurable
+latency with jitter per call. Embeddings are deterministic feature hashes of the words of a text, so similar
+texts get similar vectors and vector search over the synthetic corpus returns meaningful neighbours.
+
+Call `install_fakes` before importing `main` or any service module.
+"""
+import os
+import re
+import copy
+import json
+import time
+import zlib
+import random
+import threading
+from itertools import count
+from types import SimpleNamespace
+
+import numpy as np
+
+# Embeddings and Pinecone indexes have the configured size, like the service's (EMBEDDING_DIMENSIONS)
+from providers.openai.generate_embeddings import EMBEDDING_DIMENSIONS
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+_NCT_ID_PATTERN = re.compile(r"NCT\d{8}")
+_CRITERIA_ID_PATTERN = re.compile(r"""['"]criteriaID['"]\s*:\s*['"]([^'"]+)['"]""")
+
+_CONDITIONS = ["type 2 diabetes mellitus", "obesity", "diabetic kidney disease", "hypertension",
+               "dyslipidemia", "non-alcoholic steatohepatitis", "prediabetes", "heart failure"]
+_DRUGS = ["metformin", "semaglutide", "tirzepatide", "dapagliflozin", "empagliflozin", "insulin glargine",
+          "sitagliptin", "liraglutide", "pioglitazone", "dulaglutide"]
+_INCLUSION_TEMPLATES = [
+    "Age {age} years or above at the time of signing informed consent",
+    "HbA1c between {low}% and {high}% at screening",
+    "BMI between {bmi_low} and {bmi_high} kg/m2",
+    "Diagnosed with {condition} at least {months} months before screening",
+    "Treated with stable dose of {drug} for at least {weeks} weeks",
+    "Able and willing to comply with study procedures",
+    "Women of childbearing potential must use adequate contraception",
+]
+_EXCLUSION_TEMPLATES = [
+    "History of {condition2} within {months} months before screening",
+    "Treatment with {drug} within {weeks} weeks before screening",
+    "eGFR below {egfr} mL/min/1.73 m2",
+    "Pregnant or breastfeeding women",
+    "Participation in another clinical trial within {days} days",
+    "Known hypersensitivity to {drug} or any excipients",
+    "Active malignancy or history of cancer within 5 years",
+]
+_COUNTRIES = ["United States", "India", "Germany", "Japan", "China", "Canada", "Brazil", "Spain"]
+_PHASES = ["PHASE1", "PHASE2", "PHASE3", "PHASE4"]
+_SPONSOR_CLASSES = ["INDUSTRY", "OTHER", "NIH"]
+_CATEGORIES = ["Age", "Clinical and Laboratory Parameters", "Medication Status", "Health Condition/Status",
+               "Reproductive Status", "Co-morbid Conditions", "Ability to Comply with Study Procedures"]
+
+
+class LatencyModel:
+    """Normally distributed per-call latency in milliseconds, never negative."""
+
+    def __init__(self, mean_ms: float = 0, jitter_ms: float = 0, seed: int = None):
+        self.mean_ms = mean_ms
+        self.jitter_ms = jitter_ms
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        with self._lock:
+            return max(0.0, self._random.gauss(self.mean_ms, self.jitter_ms) if self.jitter_ms else self.mean_ms) / 1000
+
+    def wait(self) -> None:
+        delay = self.sample()
+        if delay:
+            time.sleep(delay)
+
+
+def embed_text(text: str, dimensions: int = EMBEDDING_DIMENSIONS) -> np.ndarray:
+    """Deterministic unit-length bag-of-words embedding built with feature hashing."""
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word in _WORD_PATTERN.findall(str(text).lower()):
+        hashed = zlib.crc32(word.encode())
+        vector[hashed % dimensions] += 1.0 if (hashed >> 16) & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[zlib.crc32(str(text).encode()) % dimensions] = 1.0
+        return vector
+    return vector / norm
+
+
+# ---------------------------------------------------------------------------------------------------------------
+# MongoDB
+# ---------------------------------------------------------------------------------------------------------------
+
+def _get_path(document, path: str):
+    value = document
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None, False
+        value = value[part]
+    return value, True
+
+
+def _set_path(document: dict, path: str, value) -> None:
+    parts = path.split(".")
+    for part in parts[:-1]:
+        document = document.setdefault(part, {})
+    document[parts[-1]] = value
+
+
+def _unset_path(document: dict, path: str) -> None:
+    parts = path.split(".")
+    for part in parts[:-1]:
+        document = document.get(part)
+        if not isinstance(document, dict):
+            return
+    document.pop(parts[-1], None)
+
+
+def _matches_condition(value, exists: bool, condition) -> bool:
+    if not isinstance(condition, dict) or not any(key.startswith("$") for key in condition):
+        return exists and (value == condition or (isinstance(value, list) and condition in value))
+
+    for operator, operand in condition.items():
+        if operator == "$eq" and not (exists and value == operand):
+            return False
+        if operator == "$ne" and exists and value == operand:
+            return False
+        if operator == "$in" and not (exists and value in operand):
+            return False
+        if operator == "$nin" and exists and value in operand:
+            return False
+        if operator == "$exists" and exists != bool(operand):
+            return False
+        if operator in ("$gt", "$gte", "$lt", "$lte"):
+            if not exists or value is None:
+                return False
+            if operator == "$gt" and not value > operand:
+                return False
+            if operator == "$gte" and not value >= operand:
+                return False
+            if operator == "$lt" and not value < operand:
+                return False
+            if operator == "$lte" and not value <= operand:
+                return False
+    return True
+
+
+def _matches(document: dict, query: dict) -> bool:
+    for path, condition in (query or {}).items():
+        value, exists = _get_path(document, path)
+        if not _matches_condition(value, exists, condition):
+            return False
+    return True
+
+
+def _project(document: dict, projection) -> dict:
+    document = copy.deepcopy(document)
+    if not projection:
+        return document
+    included = [key for key, flag in projection.items() if flag and key != "_id"]
+    if included:
+        projected = {}
+        for path in included:
+            value, exists = _get_path(document, path)
+            if exists:
+                _set_path(projected, path, value)
+        if projection.get("_id", 1):
+            projected["_id"] = document.get("_id")
+        return projected
+    for path, flag in projection.items():
+        if not flag:
+            _unset_path(document, path)
+    return document
+
+
+class FakeCursor:
+    def __init__(self, collection, query, projection):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list, direction=1):
+        self._sort = [(key_or_list, direction)] if isinstance(key_or_list, str) else list(key_or_list)
+        return self
+
+    def skip(self, skip):
+        self._skip = skip
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    def batch_size(self, batch_size):
+        return self
+
+    def explain(self):
+        return {"queryPlanner": {"winningPlan": {"stage": "COLLSCAN"}}}
+
+    def __iter__(self):
+        documents = self._collection._select(self._query)
+        for key, direction in reversed(self._sort):
+            documents.sort(key=lambda document: (_get_path(document, key)[0] is None, _get_path(document, key)[0]),
+                           reverse=direction == -1)
+        documents = documents[self._skip:]
+        if self._limit:
+            documents = documents[:self._limit]
+        return iter([_project(document, self._projection) for document in documents])
+
+
+class FakeCollection:
+    def __init__(self, server, name):
+        self._server = server
+        self.name = name
+        self._documents = []
+        self._lock = threading.RLock()
+
+    def _select(self, query) -> list:
+        self._server.latency.wait()
+        with self._lock:
+            return [document for document in self._documents if _matches(document, query)]
+
+    def _apply_update(self, document: dict, update: dict, inserted: bool) -> None:
+        for path, value in update.get("$set", {}).items():
+            _set_path(document, path, copy.deepcopy(value))
+        if inserted:
+            for path, value in update.get("$setOnInsert", {}).items():
+                _set_path(document, path, copy.deepcopy(value))
+        for path in update.get("$unset", {}):
+            _unset_path(document, path)
+
+    def _update(self, query, update, upsert, many=False):
+        with self._lock:
+            matched = [document for document in self._documents if _matches(document, query)]
+            if not many:
+                matched = matched[:1]
+            for document in matched:
+                self._apply_update(document, update, inserted=False)
+            if matched or not upsert:
+                return matched, None
+            document = {key: copy.deepcopy(value) for key, value in query.items() if not isinstance(value, dict)}
+            document.setdefault("_id", next(self._server.ids))
+            self._apply_update(document, update, inserted=True)
+            self._documents.append(document)
+            return [], document
+
+    def find(self, query=None, projection=None):
+        return FakeCursor(self, query or {}, projection)
+
+    def find_one(self, query=None, projection=None):
+        documents = self._select(query or {})
+        return _project(documents[0], projection) if documents else None
+
+    def distinct(self, key, query=None):
+        values = []
+        for document in self._select(query or {}):
+            value, exists = _get_path(document, key)
+            if exists and value not in values:
+                values.append(value)
+        return values
+
+    def count_documents(self, query=None):
+        return len(self._select(query or {}))
+
+    def insert_one(self, document):
+        self._server.latency.wait()
+        document = copy.deepcopy(document)
+        document.setdefault("_id", next(self._server.ids))
+        with self._lock:
+            self._documents.append(document)
+        return SimpleNamespace(inserted_id=document["_id"], acknowledged=True)
+
+    def insert_many(self, documents):
+        self._server.latency.wait()
+        documents = [copy.deepcopy(document) for document in documents]
+        with self._lock:
+            for document in documents:
+                document.setdefault("_id", next(self._server.ids))
+                self._documents.append(document)
+        return SimpleNamespace(inserted_ids=[document["_id"] for document in documents], acknowledged=True)
+
+    def update_one(self, query, update, upsert=False):
+        self._server.latency.wait()
+        matched, inserted = self._update(query, update, upsert)
+        return SimpleNamespace(matched_count=len(matched), modified_count=len(matched),
+                               upserted_id=inserted["_id"] if inserted else None, acknowledged=True)
+
+    def find_one_and_update(self, query, update, upsert=False, return_document=False, projection=None):
+        self._server.latency.wait()
+        with self._lock:
+            before = next((copy.deepcopy(document) for document in self._documents if _matches(document, query)), None)
+            matched, inserted = self._update(query, update, upsert)
+            after = matched[0] if matched else inserted
+        # pymongo's ReturnDocument.AFTER is True
+        return _project(after, projection) if return_document and after else before
+
+    def delete_many(self, query):
+        self._server.latency.wait()
+        with self._lock:
+            kept = [document for document in self._documents if not _matches(document, query)]
+            deleted = len(self._documents) - len(kept)
+            self._documents = kept
+        return SimpleNamespace(deleted_count=deleted, acknowledged=True)
+
+    def bulk_write(self, operations, ordered=True):
+        self._server.latency.wait()
+        counts = {"inserted": 0, "matched": 0, "upserted": 0, "deleted": 0}
+        with self._lock:
+            for operation in operations:
+                kind = type(operation).__name__
+                if kind == "InsertOne":
+                    document = copy.deepcopy(operation._doc)
+                    document.setdefault("_id", next(self._server.ids))
+                    self._documents.append(document)
+                    counts["inserted"] += 1
+                elif kind in ("UpdateOne", "UpdateMany"):
+                    matched, inserted = self._update(operation._filter, operation._doc, operation._upsert,
+                                                     many=kind == "UpdateMany")
+                    counts["matched"] += len(matched)
+                    counts["upserted"] += 1 if inserted else 0
+                elif kind in ("DeleteOne", "DeleteMany"):
+                    matching = [document for document in self._documents if _matches(document, operation._filter)]
+                    if kind == "DeleteOne":
+                        matching = matching[:1]
+                    ids = {id(document) for document in matching}
+                    self._documents = [document for document in self._documents if id(document) not in ids]
+                    counts["deleted"] += len(matching)
+                else:
+                    raise NotImplementedError(f"Unsupported bulk operation: {kind}")
+        return SimpleNamespace(acknowledged=True, bulk_api_result=counts, **{f"{key}_count": value
+                                                                               for key, value in counts.items()})
+
+    def create_indexes(self, indexes):
+        return [index.document["name"] for index in indexes]
+
+    def create_index(self, keys, **kwargs):
+        return kwargs.get("name", "_".join(f"{key}_{direction}" for key, direction in keys))
+
+
+class FakeDatabase:
+    def __init__(self, server):
+        self._server = server
+
+    def __getitem__(self, collection_name) -> FakeCollection:
+        with self._server.lock:
+            if collection_name not in self._server.collections:
+                self._server.collections[collection_name] = FakeCollection(self._server, collection_name)
+            return self._server.collections[collection_name]
+
+
+class FakeMongoServer:
+    """In-memory database shared by every `FakeMongoClient`, like one MongoDB deployment."""
+
+    def __init__(self, latency: LatencyModel = None):
+        self.latency = latency or LatencyModel()
+        self.collections = {}
+        self.lock = threading.Lock()
+        self.ids = count(1)
+        self.database = FakeDatabase(self)
+
+    def client_class(self):
+        server = self
+
+        class FakeMongoClient:
+            def __init__(self, *args, **kwargs):
+                self.admin = SimpleNamespace(command=lambda *args, **kwargs: {"ok": 1.0})
+
+            def __getitem__(self, database_name):
+                return server.database
+
+        return FakeMongoClient
+
+
+# ---------------------------------------------------------------------------------------------------------------
+# Pinecone
+# ---------------------------------------------------------------------------------------------------------------
+
+class FakePineconeIndex:
+    def __init__(self, dimension: int, latency: LatencyModel):
+        self.dimension = dimension
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._namespaces = {}
+
+    def upsert(self, vectors, namespace: str = ""):
+        self.latency.wait()
+        with self._lock:
+            records = self._namespaces.setdefault(namespace or "", {})
+            for vector in vectors:
+                if isinstance(vector, dict):
+                    vector_id, values, metadata = vector["id"], vector["values"], vector.get("metadata", {})
+                else:
+                    vector_id, values, metadata = (tuple(vector) + ({},))[:3]
+                records[vector_id] = (np.asarray(values, dtype=np.float32), dict(metadata))
+        return {"upserted_count": len(vectors)}
+
+    def delete(self, ids=None, namespace: str = "", delete_all: bool = False, **kwargs):
+        self.latency.wait()
+        with self._lock:
+            records = self._namespaces.get(namespace or "", {})
+            if delete_all:
+                records.clear()
+            for vector_id in ids or []:
+                records.pop(vector_id, None)
+        return {}
+
+    def list(self, prefix: str = None, limit: int = 100, namespace: str = ""):
+        """Yields pages of vector ids, like the serverless index listing."""
+        with self._lock:
+            vector_ids = [vector_id for vector_id in self._namespaces.get(namespace or "", {})
+                          if prefix is None or vector_id.startswith(prefix)]
+        for start in range(0, len(vector_ids), limit):
+            yield vector_ids[start:start + limit]
+
+    def fetch(self, ids, namespace: str = ""):
+        self.latency.wait()
+        with self._lock:
+            records = self._namespaces.get(namespace or "", {})
+            vectors = {vector_id: {"id": vector_id, "values": records[vector_id][0].tolist(),
+                                   "metadata": dict(records[vector_id][1])}
+                       for vector_id in ids if vector_id in records}
+        return {"vectors": vectors, "namespace": namespace or ""}
+
+    def describe_index_stats(self):
+        with self._lock:
+            namespaces = {name: {"vector_count": len(records)} for name, records in self._namespaces.items()}
+        return {"dimension": self.dimension, "namespaces": namespaces,
+                "total_vector_count": sum(namespace["vector_count"] for namespace in namespaces.values())}
+
+    def query(self, vector, top_k=10, include_values=False, include_metadata=False, filter=None, namespace="", **kwargs):
+        self.latency.wait()
+        with self._lock:
+            records = list(self._namespaces.get(namespace or "", {}).items())
+        records = [(vector_id, values, metadata) for vector_id, (values, metadata) in records
+                   if _matches(metadata, filter or {})]
+        if not records:
+            return {"matches": [], "namespace": namespace or ""}
+
+        matrix = np.stack([values for _, values, _ in records])
+        query_vector = np.asarray(vector, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query_vector) or 1.0)
+        scores = matrix @ query_vector / np.where(norms == 0, 1.0, norms)
+        top = np.argsort(-scores)[:top_k]
+
+        matches = []
+        for position in top:
+            vector_id, values, metadata = records[position]
+            match = {"id": vector_id, "score": float(scores[position])}
+            if include_values:
+                match["values"] = values.tolist()
+            if include_metadata:
+                match["metadata"] = dict(metadata)
+            matches.append(match)
+        return {"matches": matches, "namespace": namespace or ""}
+
+
+class FakePineconeService:
+    """Shared state of all `FakePinecone` clients: the indexes by name."""
+
+    def __init__(self, latency: LatencyModel = None):
+        self.latency = latency or LatencyModel()
+        self.indexes = {}
+        self.lock = threading.Lock()
+
+    def client_class(self):
+        service = self
+
+        class FakePinecone:
+            def __init__(self, *args, **kwargs):
+                pass
+
+            def list_indexes(self):
+                return [{"name": name} for name in service.indexes]
+
+            def create_index(self, name, dimension, **kwargs):
+                with service.lock:
+                    service.indexes.setdefault(name, FakePineconeIndex(dimension, service.latency))
+
+            def describe_index(self, name):
+                return SimpleNamespace(status={"ready": True}, dimension=service.indexes[name].dimension)
+
+            def delete_index(self, name):
+                with service.lock:
+                    service.indexes.pop(name, None)
+
+            def Index(self, name):
+                with service.lock:
+                    return service.indexes.setdefault(name, FakePineconeIndex(EMBEDDING_DIMENSIONS, service.latency))
+
+        return FakePinecone
+
+
+# ---------------------------------------------------------------------------------------------------------------
+# OpenAI / Azure OpenAI
+# ---------------------------------------------------------------------------------------------------------------
+
+class _EmbeddingsResponse:
+    def __init__(self, embeddings: list):
+        self.data = [SimpleNamespace(embedding=embedding, index=index) for index, embedding in enumerate(embeddings)]
+
+    def model_dump_json(self, indent=None):
+        return json.dumps({"data": [{"embedding": item.embedding, "index": item.index} for item in self.data]})
+
+
+class FakeEmbeddings:
+    def __init__(self, latency: LatencyModel, dimensions: int = EMBEDDING_DIMENSIONS):
+        self.latency = latency
+        self.dimensions = dimensions
+        self.calls = 0
+
+    def create(self, input, model=None, dimensions=None, **kwargs):
+        self.latency.wait()
+        self.calls += 1
+        texts = input if isinstance(input, list) else [input]
+        return _EmbeddingsResponse([embed_text(text, dimensions or self.dimensions).tolist() for text in texts])
+
+
+class FakeChatCompletions:
+    """
+    Returns schema-valid JSON for structured output requests. Merge and categorisation requests are answered
+    from their input (identical statements are merged, every criterion gets a category) so the pipeline behaves
+    like it would with a model.
+    """
+
+    def __init__(self, latency: LatencyModel, seed: int = 0):
+        self.latency = latency
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def create(self, model=None, messages=None, response_format=None, stream=False, **kwargs):
+        with self._lock:
+            self.calls += 1
+            content = json.dumps(self._respond(messages or [], response_format or {}))
+
+        if not stream:
+            self.latency.wait()
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+        return self._stream(content)
+
+    def _stream(self, content: str):
+        pieces = [content[start:start + 24] for start in range(0, len(content), 24)]
+        delay = self.latency.sample() / max(len(pieces), 1)
+        for piece in pieces:
+            if delay:
+                time.sleep(delay)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+
+    def _respond(self, messages: list, response_format: dict):
+        user_content = " ".join(str(message.get("content", "")) for message in messages if message.get("role") == "user")
+        json_schema = response_format.get("json_schema", {})
+        name = json_schema.get("name")
+
+        if name == "merge_criteria":
+            groups = {}
+            for item in json.loads(user_content):
+                groups.setdefault(item["criteria"].lower().rstrip(". "), (item["criteria"], []))[1].append(item["criteriaID"])
+            return {"response": [{"criteria": criteria, "criteriaID": ids} for criteria, ids in groups.values()]}
+
+        if name == "categorise_eligibility_criteria":
+            exclusion_start = user_content.find("exclusionCriteria")
+            response = {"inclusionCriteria": [], "exclusionCriteria": []}
+            for match in _CRITERIA_ID_PATTERN.finditer(user_content):
+                criteria_type = "exclusionCriteria" if 0 <= exclusion_start < match.start() else "inclusionCriteria"
+                response[criteria_type].append({"criteriaID": match.group(1), "class": self._random.choice(_CATEGORIES)})
+            return response
+
+        if name in ("draft_eligibility_criteria", "draft_eligibility_criteria_packed"):
+            nct_ids = sorted(set(_NCT_ID_PATTERN.findall(user_content))) or ["NCT00000000"]
+            return {
+                criteria_type: [self._drafted_criterion(templates, nct_ids, name.endswith("packed"))
+                                for _ in range(self._random.randint(4, 8))]
+                for criteria_type, templates in (("inclusionCriteria", _INCLUSION_TEMPLATES),
+                                                 ("exclusionCriteria", _EXCLUSION_TEMPLATES))
+            }
+
+        if json_schema.get("schema"):
+            return self._instance(json_schema["schema"])
+        return {"response": []}
+
+    def _drafted_criterion(self, templates: list, nct_ids: list, packed: bool) -> dict:
+        statement = _fill_template(self._random, self._random.choice(templates))
+        source = ([{"nctId": nct_id, "statement": statement}
+                   for nct_id in self._random.sample(nct_ids, self._random.randint(1, len(nct_ids)))]
+                  if packed else statement)
+        return {"criteria": statement, "source": source, "class": self._random.choice(_CATEGORIES)}
+
+    def _instance(self, schema: dict):
+        # Minimal instance generator for the subset of JSON schema used by the response schemas
+        if "enum" in schema:
+            return self._random.choice(schema["enum"])
+        schema_type = schema.get("type")
+        if schema_type == "object":
+            return {key: self._instance(value) for key, value in schema.get("properties", {}).items()}
+        if schema_type == "array":
+            return [self._instance(schema.get("items", {})) for _ in range(self._random.randint(1, 3))]
+        if schema_type in ("integer", "number"):
+            return self._random.randint(1, 5)
+        if schema_type == "boolean":
+            return self._random.random() < 0.5
+        return _fill_template(self._random, self._random.choice(_INCLUSION_TEMPLATES))
+
+
+def _fill_template(random_generator: random.Random, template: str) -> str:
+    low = random_generator.choice([6.5, 7.0, 7.5, 8.0])
+    bmi_low = random_generator.choice([18.5, 22, 25, 27])
+    return template.format(
+        age=random_generator.choice([18, 20, 30, 40]),
+        low=low, high=random_generator.choice([9.5, 10.0, 10.5, 11.0]),
+        bmi_low=bmi_low, bmi_high=random_generator.choice([35, 40, 45]),
+        condition=random_generator.choice(_CONDITIONS), condition2=random_generator.choice(_CONDITIONS),
+        drug=random_generator.choice(_DRUGS),
+        months=random_generator.choice([3, 6, 12]), weeks=random_generator.choice([4, 8, 12, 24]),
+        days=random_generator.choice([30, 60, 90]), egfr=random_generator.choice([30, 45, 60])
+    )
+
+
+class FakeOpenAIService:
+    """Chat and embedding endpoints shared by the fake OpenAI and Azure OpenAI clients."""
+
+    def __init__(self, chat_latency: LatencyModel = None, embedding_latency: LatencyModel = None, seed: int = 0):
+        self.embeddings = FakeEmbeddings(embedding_latency or LatencyModel())
+        self.chat = SimpleNamespace(completions=FakeChatCompletions(chat_latency or LatencyModel(), seed))
+
+    def client_class(self):
+        service = self
+
+        class FakeOpenAI:
+            def __init__(self, *args, **kwargs):
+                self.embeddings = service.embeddings
+                self.chat = service.chat
+
+        return FakeOpenAI
+
+
+# ---------------------------------------------------------------------------------------------------------------
+# Synthetic corpus
+# ---------------------------------------------------------------------------------------------------------------
+
+def build_synthetic_trial(index: int, random_generator: random.Random) -> tuple:
+    """Returns the processed and the preprocessed document of one synthetic T2DM trial."""
+    nct_id = f"NCT{index:08d}"
+    condition = random_generator.choice(_CONDITIONS)
+    drug = random_generator.choice(_DRUGS)
+    inclusion = [_fill_template(random_generator, template)
+                 for template in random_generator.sample(_INCLUSION_TEMPLATES, 4)]
+    exclusion = [_fill_template(random_generator, template)
+                 for template in random_generator.sample(_EXCLUSION_TEMPLATES, 4)]
+    weeks = random_generator.choice([12, 24, 26, 52])
+    start_year = random_generator.randint(2005, 2022)
+
+    processed = {
+        "nctId": nct_id,
+        "officialTitle": f"A Study of {drug.title()} in Participants With {condition.title()} ({index})",
+        "conditions": f"{condition}, type 2 diabetes",
+        "inclusionCriteria": "\n".join(f"{number}. {line}" for number, line in enumerate(inclusion, start=1)),
+        "exclusionCriteria": "\n".join(f"{number}. {line}" for number, line in enumerate(exclusion, start=1)),
+        "primaryOutcomes": f"Change in HbA1c from baseline to week {weeks} (Time Frame: Baseline, Week {weeks})",
+        "secondaryOutcomes": f"Change in body weight from baseline to week {weeks}",
+        "designModule": {"phases": [random_generator.choice(_PHASES)]},
+        "keywords": [condition, drug]
+    }
+    preprocessed = {
+        "protocolSection": {
+            "identificationModule": {"nctId": nct_id, "officialTitle": processed["officialTitle"]},
+            "contactsLocationsModule": {
+                "locations": [{"country": country} for country in random_generator.sample(_COUNTRIES, 2)]
+            },
+            "designModule": {
+                "phases": processed["designModule"]["phases"],
+                "enrollmentInfo": {"count": random_generator.randint(40, 2000)}
+            },
+            "statusModule": {
+                "startDateStruct": {"date": f"{start_year}-0{random_generator.randint(1, 9)}"},
+                "completionDateStruct": {"date": f"{start_year + random_generator.randint(1, 4)}-0{random_generator.randint(1, 9)}"}
+            },
+            "sponsorCollaboratorsModule": {"leadSponsor": {"class": random_generator.choice(_SPONSOR_CLASSES)}}
+        }
+    }
+    return processed, preprocessed
+
+
+# Pinecone modules and the processed document fields their vectors are built from
+_VECTOR_MODULES = {
+    "eligibilityModule": ("inclusionCriteria", "exclusionCriteria"),
+    "conditionsModule": ("conditions",),
+    "outcomesModule": ("primaryOutcomes", "secondaryOutcomes"),
+    "identificationModule": ("officialTitle",),
+}
+
+
+def load_synthetic_corpus(mongo_server: FakeMongoServer, pinecone_service: FakePineconeService, size: int,
+                          seed: int = 0, index_name: str = None) -> list:
+    """
+    Loads `size` synthetic trials into the fake Mongo collections and the fake Pinecone index, by default the
+    index the service queries for EMBEDDING_DIMENSIONS. With PINECONE_MODULE_NAMESPACES the vectors are also
+    copied into the module namespaces, like `providers.pinecone.partition_namespaces` does.
+
+    Returns:
+        list: The NCT IDs of the trials.
+    """
+    from providers.pinecone.pinecone_connection import PINECONE_MODULE_NAMESPACES, pinecone_index_name
+    index_name = index_name or pinecone_index_name()
+    random_generator = random.Random(seed)
+    processed_documents, preprocessed_documents, vectors = [], [], []
+    for index in range(size):
+        processed, preprocessed = build_synthetic_trial(index, random_generator)
+        processed_documents.append(processed)
+        preprocessed_documents.append(preprocessed)
+        for module, fields in _VECTOR_MODULES.items():
+            text = " ".join(str(processed[field]) for field in fields)
+            vectors.append({"id": f"{processed['nctId']}_{module}", "values": embed_text(text),
+                            "metadata": {"nctId": processed["nctId"], "module": module}})
+
+    mongo_server.database["t2dm_final_data_samples_processed"].insert_many(processed_documents)
+    mongo_server.database["t2dm_data_preprocessed"].insert_many(preprocessed_documents)
+
+    with pinecone_service.lock:
+        index = pinecone_service.indexes.setdefault(index_name, FakePineconeIndex(EMBEDDING_DIMENSIONS,
+                                                                                  pinecone_service.latency))
+    # Loading is not part of the measured latency
+    latency, index.latency = index.latency, LatencyModel()
+    for start in range(0, len(vectors), 1000):
+        index.upsert(vectors[start:start + 1000])
+    if PINECONE_MODULE_NAMESPACES:
+        for module in _VECTOR_MODULES:
+            index.upsert([vector for vector in vectors if vector["metadata"]["module"] == module], namespace=module)
+    index.latency = latency
+    return [document["nctId"] for document in processed_documents]
+
+
+def install_fakes(corpus_size: int = 1000, seed: int = 0, mongo_latency: LatencyModel = None,
+                  pinecone_latency: LatencyModel = None, embedding_latency: LatencyModel = None,
+                  chat_latency: LatencyModel = None) -> SimpleNamespace:
+    """
+    Replaces the MongoDB, Pinecone and OpenAI clients with the fakes and loads a synthetic corpus.
+
+    Must be called before `main` or any module that connects at import time is imported.
+
+    Returns:
+        SimpleNamespace: The fake services (`mongo`, `pinecone`, `openai`) and the corpus `nct_ids`.
+    """
+    os.environ.setdefault("DATABASE_URL", "mongodb://benchmark")
+    os.environ.setdefault("DATABASE_NAME", "benchmark")
+    os.environ.setdefault("PINECONE_API_KEY", "benchmark")
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    # The fake chat model answers from the response schema
+    os.environ["STRUCTURED_OUTPUTS"] = "true"
+    os.environ.setdefault("ENSURE_INDEXES_ON_STARTUP", "false")
+
+    mongo_server = FakeMongoServer(mongo_latency)
+    # Loading the corpus is not part of the measured latency
+    mongo_latency_model, mongo_server.latency = mongo_server.latency, LatencyModel()
+    pinecone_service = FakePineconeService(pinecone_latency)
+    openai_service = FakeOpenAIService(chat_latency, embedding_latency, seed)
+
+    import database.mongo_db_connection as mongo_db_connection
+    import providers.pinecone.pinecone_connection as pinecone_connection
+    import providers.openai.openai_connection as openai_connection
+    import providers.openai.generate_embeddings as generate_embeddings
+
+    mongo_db_connection.MongoClient = mongo_server.client_class()
+    pinecone_connection.Pinecone = pinecone_service.client_class()
+    # The OpenAI clients are created lazily from the openai package, the shared instances are set up front
+    openai_connection._openai_client = openai_service.client_class()()
+    generate_embeddings._azure_client = openai_service.client_class()()
+
+    nct_ids = load_synthetic_corpus(mongo_server, pinecone_service, corpus_size, seed)
+    mongo_server.latency = mongo_latency_model
+    return SimpleNamespace(mongo=mongo_server, pinecone=pinecone_service, openai=openai_service, nct_ids=nct_ids)
@@ -0,0 +1,86 @@
+"""
+Measures how long importing the service takes, as a proxy for container cold start.
+
+Runs `python -X importtime -c "import main"` in fresh interpreters without any service configuration, so it
+also checks that importing the service does not create clients or connect to MongoDB, Pinecone or OpenAI.
+Reports the best total of several runs and the slowest modules it imports directly, and exits with code 1 when the
+import fails or takes longer than --max-seconds.
+
+Usage:
+    python -m benchmarks.measure_import_time [--module main] [--runs 3] [--max-seconds 3] [--top 15]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+# Service configuration that must not be needed at import time
+_SERVICE_VARIABLES = ("DATABASE_URL", "DATABASE_NAME", "PINECONE_API_KEY", "OPENAI_API_KEY")
+
+
+def measure(module: str) -> tuple:
+    """
+    Imports `module` in a fresh interpreter.
+
+    Returns:
+        tuple: The total import time in seconds and the cumulative seconds of each module it imports directly.
+    """
+    environment = {key: value for key, value in os.environ.items() if key not in _SERVICE_VARIABLES}
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                               capture_output=True, text=True, env=environment,
+                               cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    if completed.returncode != 0:
+        error = "\n".join(line for line in completed.stderr.splitlines() if not line.startswith("import time:"))
+        raise RuntimeError(f"Importing {module} failed:\n{error}")
+
+    # Lines read "import time: self [us] | cumulative | imported package", nested imports are indented by
+    # two spaces per level and printed before the module that imported them
+    children = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        name = name[1:].rstrip()
+        seconds = int(cumulative) / 1e6
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        if depth == 1:
+            children[name.strip()] = seconds
+        elif depth == 0:
+            if name == module:
+                return seconds, children
+            children = {}
+    raise RuntimeError(f"No import time reported for {module}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--runs", type=int, default=3, help="Fresh interpreters to import in, the best is reported")
+    parser.add_argument("--max-seconds", type=float, help="Fail when the import takes longer than this")
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest direct imports to list")
+    args = parser.parse_args()
+
+    best = None
+    for _ in range(args.runs):
+        try:
+            total, children = measure(args.module)
+        except RuntimeError as e:
+            print(e)
+            sys.exit(1)
+        if best is None or total < best[0]:
+            best = (total, children)
+
+    total, children = best
+    print(f"import {args.module}: {total:.3f}s (best of {args.runs})")
+    for name, seconds in sorted(children.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {name:<50}{seconds:>8.3f}s")
+
+    if args.max_seconds is not None and total > args.max_seconds:
+        print(f"Import time {total:.3f}s exceeds the budget of {args.max_seconds}s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
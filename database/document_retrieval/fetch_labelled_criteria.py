@@ -0,0 +1,53 @@
+from database.mongo_db_connection import get_mongo_dao
+from utils.metrics import timed_stage
+
+
+@timed_stage("mongo_read", module="similar_trials_criteria_results")
+def fetch_labelled_criteria(limit: int = None) -> dict:
+    """
+    Fetches historical categorized criteria from past eligibility criteria jobs as (criteria, class) pairs.
+
+    Both the categorized generated criteria and the categorized user criteria are used as labels.
+
+    Args:
+        limit (int, optional): Maximum number of jobs to read, the most recently updated first. Defaults to all jobs.
+
+    Returns:
+        dict: A response dictionary whose data is a list of {"criteria": str, "class": str} dictionaries.
+    """
+    final_response = {
+        "success": False,
+        "message": "No labelled criteria found",
+        "data": None
+    }
+
+    try:
+        # Initialize MongoDBDAO
+        mongo_dao = get_mongo_dao()
+
+        jobs = mongo_dao.database["similar_trials_criteria_results"].find(
+            {}, {"_id": 0, "categorizedData": 1, "userCategorizedData": 1}
+        )
+        if limit is not None:
+            # Limited on the server, sorted so the same jobs are read every time
+            jobs = jobs.sort([("updatedAt", -1), ("_id", -1)]).limit(limit)
+
+        labelled_criteria = []
+        for job in jobs:
+            for field in ("categorizedData", "userCategorizedData"):
+                for category, criteria_types in (job.get(field) or {}).items():
+                    for criteria_type in ("Inclusion", "Exclusion"):
+                        for item in criteria_types.get(criteria_type, []):
+                            criteria = item.get("criteria") if isinstance(item, dict) else None
+                            if isinstance(criteria, str) and criteria.strip():
+                                labelled_criteria.append({"criteria": criteria, "class": category})
+
+        if labelled_criteria:
+            final_response["data"] = labelled_criteria
+            final_response["success"] = True
+            final_response["message"] = f"Found {len(labelled_criteria)} labelled criteria"
+
+    except Exception as e:
+        final_response["message"] = f"Error fetching labelled criteria: {str(e)}"
+
+    return final_response
@@ -1,5 +1,7 @@
-from database.mongo_db_connection import MongoDBDAO
+from database.mongo_db_connection import get_mongo_dao
+from utils.metrics import timed_stage
 
+@timed_stage("mongo_read", module="t2dm_data_preprocessed")
 def fetch_preprocessed_trial_document_with_nct_id(nct_id: str) -> dict:
     """
     Fetches a preprocessed medical trial document from MongoDB using the provided nct_id.
@@ -17,7 +19,7 @@ def fetch_preprocessed_trial_document_with_nct_id(nct_id: str) -> dict:
     }
     try:
         # Initialize MongoDBDAO
-        mongo_dao = MongoDBDAO()
+        mongo_dao = get_mongo_dao()
 
         # Perform a search for the document using MongoDBDAO
         preprocessed_trial_document_response = mongo_dao.find_one(
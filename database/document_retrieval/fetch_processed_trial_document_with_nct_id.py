@@ -1,5 +1,7 @@
-from database.mongo_db_connection import MongoDBDAO
+from database.mongo_db_connection import get_mongo_dao
+from utils.metrics import timed_stage
 
+@timed_stage("mongo_read", module="t2dm_final_data_samples_processed")
 def fetch_processed_trial_document_with_nct_id(nct_id: str, module: str = None) -> dict:
     """
     Fetches a processed medical trial document from MongoDB using the provided nct_id.
@@ -20,7 +22,7 @@ def fetch_processed_trial_document_with_nct_id(nct_id: str, module: str = None)
 
     try:
         # Initialize MongoDBDAO
-        mongo_dao = MongoDBDAO()
+        mongo_dao = get_mongo_dao()
 
         # Mapping of module names to their corresponding fields in the database
         mapping = {
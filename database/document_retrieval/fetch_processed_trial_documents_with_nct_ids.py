@@ -0,0 +1,40 @@
+from database.mongo_db_connection import get_mongo_dao
+from utils.metrics import timed_stage
+
+
+@timed_stage("mongo_read", module="t2dm_final_data_samples_processed")
+def fetch_processed_trial_documents_with_nct_ids(nct_ids: list) -> dict:
+    """
+    Fetches the processed trial documents of several NCT IDs in one query.
+
+    Args:
+        nct_ids (list): The NCT IDs of the trial documents.
+
+    Returns:
+        dict: A response dictionary whose data maps every NCT ID found to its document.
+    """
+    final_response = {
+        "success": False,
+        "message": "Failed to fetch documents",
+        "data": None
+    }
+
+    try:
+        # Initialize MongoDBDAO
+        mongo_dao = get_mongo_dao()
+
+        # Same projection as fetch_processed_trial_document_with_nct_id
+        documents = mongo_dao.find(
+            collection_name="t2dm_final_data_samples_processed",
+            query={"nctId": {"$in": list(dict.fromkeys(nct_ids))}},
+            projection={"_id": 0, "keywords": 0}
+        )
+
+        final_response["data"] = {document["nctId"]: document for document in documents}
+        final_response["success"] = True
+        final_response["message"] = f"Fetched {len(documents)} of {len(set(nct_ids))} processed trial documents"
+
+    except Exception as e:
+        final_response["message"] = f"Unexpected error while fetching MongoDB documents: {e}"
+
+    return final_response
@@ -0,0 +1,41 @@
+from database.mongo_db_connection import get_mongo_dao
+from utils.metrics import timed_stage
+
+
+@timed_stage("mongo_read", module="t2dm_final_data_samples_processed")
+def fetch_processed_trial_sections(fields: list) -> dict:
+    """
+    Fetches the given text sections of every processed trial document, for building the lexical index.
+
+    Args:
+        fields (list): The processed document fields to read, e.g. "inclusionCriteria".
+
+    Returns:
+        dict: A response dictionary whose data is a list of {"nctId", <field>: text} dictionaries.
+    """
+    final_response = {
+        "success": False,
+        "message": "No processed trial documents found",
+        "data": None
+    }
+
+    try:
+        # Initialize MongoDBDAO
+        mongo_dao = get_mongo_dao()
+
+        documents = mongo_dao.find(
+            collection_name="t2dm_final_data_samples_processed",
+            query={},
+            projection={"_id": 0, "nctId": 1, **{field: 1 for field in fields}}
+        )
+        documents = [document for document in documents if document.get("nctId")]
+
+        if documents:
+            final_response["data"] = documents
+            final_response["success"] = True
+            final_response["message"] = f"Fetched {len(documents)} processed trial documents"
+
+    except Exception as e:
+        final_response["message"] = f"Error fetching processed trial documents: {str(e)}"
+
+    return final_response
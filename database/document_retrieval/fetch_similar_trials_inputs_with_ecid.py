@@ -1,19 +1,29 @@
-from database.mongo_db_connection import MongoDBDAO
+from database.mongo_db_connection import get_mongo_dao
+from utils.metrics import timed_stage
 
 
-def fetch_similar_trials_inputs_with_ecid(ecid: str) -> dict:
+@timed_stage("mongo_read", module="similar_trials_results")
+def fetch_similar_trials_inputs_with_ecid(ecid: str, nct_ids: list = None, skip: int = 0, limit: int = None) -> dict:
     """
     Fetches user inputs related to similar trial searches from the MongoDB collection
-    using the provided `ecid` Job ID.
+    using the provided `ecid` Job ID, together with the requested result rows.
+
+    Only the rows that are needed are read from `similar_trials_result_rows`, in rank order.
+    Searches stored before the rows layout still carry a `similarTrials` array, which is filtered the same way.
 
     Args:
         ecid (str): The unique identifier for the Job.
+        nct_ids (list, optional): Only return the results of these trials. Defaults to all results,
+            an empty list returns the inputs without results.
+        skip (int, optional): Number of ranked results to skip, for pagination. Defaults to 0.
+        limit (int, optional): Maximum number of results to return. Defaults to all.
 
     Returns:
         dict: A response dictionary containing:
             - "success" (bool): Indicates whether the document was found successfully.
             - "message" (str): A descriptive message about the operation result.
-            - "data" (dict | None): The fetched document data if found, otherwise None.
+            - "data" (dict | None): The fetched header with the selected results in `similarTrials`,
+              otherwise None.
     """
     # Initialize the default response structure
     final_response = {
@@ -24,7 +34,7 @@ def fetch_similar_trials_inputs_with_ecid(ecid: str) -> dict:
 
     try:
         # Initialize MongoDB Data Access Object (DAO)
-        mongo_dao = MongoDBDAO()
+        mongo_dao = get_mongo_dao()
 
         # Query the MongoDB collection for a document matching the given ecid
         db_response = mongo_dao.find_one(
@@ -33,8 +43,27 @@ def fetch_similar_trials_inputs_with_ecid(ecid: str) -> dict:
             projection={"_id": 0}  # Exclude the MongoDB default `_id` field from the result
         )
 
-        # If a document is found, update the response
+        # If a document is found, attach the requested results and update the response
         if db_response:
+            if "similarTrials" in db_response:
+                # Search stored in the old layout with all results embedded
+                similar_trials = [
+                    trial for trial in db_response["similarTrials"] if nct_ids is None or trial["nctId"] in nct_ids
+                ]
+                db_response["similarTrials"] = similar_trials[skip:None if limit is None else skip + limit]
+            elif nct_ids is not None and len(nct_ids) == 0:
+                db_response["similarTrials"] = []
+            else:
+                query = {"ecid": ecid}
+                if nct_ids is not None:
+                    query["nctId"] = {"$in": list(nct_ids)}
+                cursor = mongo_dao.database["similar_trials_result_rows"].find(
+                    query, {"_id": 0, "trial": 1}
+                ).sort("rank", 1).skip(skip)
+                if limit is not None:
+                    cursor = cursor.limit(limit)
+                db_response["similarTrials"] = [row["trial"] for row in cursor]
+
             final_response["data"] = db_response
             final_response["success"] = True
             final_response["message"] = "Similar Trials Input Found"
@@ -1,22 +1,26 @@
-from database.mongo_db_connection import MongoDBDAO
+from pymongo import UpdateOne
+from database.mongo_db_connection import get_mongo_dao
+from utils.metrics import timed_stage
+from database.write_behind_queue import get_write_behind_queue
 from datetime import datetime
 from document_retrieval.models.db_models import StoreEligibilityCriteria
 
-# Initialize MongoDBDAO
-mongo_dao = MongoDBDAO()
 
+@timed_stage("mongo_write", module="similar_trials_criteria_results")
 def record_eligibility_criteria_job(job_id: str,
                                     categorized_data: dict,
-                                    categorized_data_user: dict) -> dict:
+                                    categorized_data_user: dict,
+                                    background: bool = False) -> dict:
     """
     Stores the generated eligibility criteria (inclusion and exclusion) as a job in MongoDB.
 
-    If the document already exists, retains the original created_at date.
+    The document is upserted atomically; if it already exists, the original created_at date is retained.
 
     Args:
         job_id (str): The unique identifier for the job (ECID).
         categorized_data (dict): Categorized eligibility criteria in 14 categories.
         categorized_data_user (dict): Categorized user-provided eligibility criteria in 14 categories.
+        background (bool, optional): Queue the write on the write-behind queue instead of waiting for it.
 
     Returns:
         dict: A response dictionary containing:
@@ -31,32 +35,33 @@ def record_eligibility_criteria_job(job_id: str,
     }
 
     try:
-        # Check if the document already exists
-        existing_doc = mongo_dao.find_one("similar_trials_criteria_results", {"ecid": job_id})
-
-        created_at = existing_doc["createdAt"] if existing_doc else datetime.now()
-
         # Create a document using the StoreEligibilityCriteria model
         document = StoreEligibilityCriteria(
             ecid=job_id,
             categorizedData=categorized_data,
             userCategorizedData=categorized_data_user,
-            createdAt=created_at,
+            createdAt=datetime.now(),
             updatedAt=datetime.now(),
         ).dict()
 
+        # The creation date is only written when the document is inserted
+        created_at = document.pop("createdAt")
+        query = {"ecid": job_id}
+        update = {"$set": document, "$setOnInsert": {"createdAt": created_at}}
+
+        if background:
+            get_write_behind_queue().submit("similar_trials_criteria_results", UpdateOne(query, update, upsert=True))
+            final_response["success"] = True
+            final_response["message"] = f"Queued similar trials criteria results for ECID: {job_id}"
+            return final_response
+
         # Insert or update the document using MongoDBDAO
-        db_response = mongo_dao.update(
-            collection_name="similar_trials_criteria_results",
-            update_values=document,
-            query={"ecid": job_id},
-            upsert=True
-        )
+        db_response = get_mongo_dao().bulk_write("similar_trials_criteria_results", [UpdateOne(query, update, upsert=True)])
 
         # Check if the document was successfully inserted or updated
-        if db_response:
+        if db_response.acknowledged:
             final_response["success"] = True
-            final_response["message"] = f"Successfully stored similar trials criteria results: {db_response}"
+            final_response["message"] = f"Successfully stored similar trials criteria results: {db_response.bulk_api_result}"
 
     except Exception as e:
         final_response["message"] = f"Error storing similar trials criteria results: {e}"
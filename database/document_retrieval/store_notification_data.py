@@ -1,12 +1,13 @@
-from database.mongo_db_connection import MongoDBDAO
+from database.mongo_db_connection import get_mongo_dao
+from utils.metrics import timed_stage
+from database.write_behind_queue import get_write_behind_queue
 from datetime import datetime
 from document_retrieval.models.db_models import NotificationData
 from typing import Dict, Any
 
-# Initialize MongoDB Data Access Object (DAO)
-mongo_dao = MongoDBDAO()
 
-def store_notification_data(ecid: str) -> Dict[str, Any]:
+@timed_stage("mongo_write", module="notifications")
+def store_notification_data(ecid: str, background: bool = False) -> Dict[str, Any]:
     """
     Stores notification data in the MongoDB database.
 
@@ -15,6 +16,8 @@ def store_notification_data(ecid: str) -> Dict[str, Any]:
 
     Args:
         ecid (str): The Job ID associated with the Job Run
+        background (bool, optional): Queue the notification on the write-behind queue instead of waiting for it.
+            It is written after the writes queued before it, so the user name of a queued search is found.
 
     Returns:
         Dict[str, Any]: A dictionary containing the following keys:
@@ -37,7 +40,16 @@ def store_notification_data(ecid: str) -> Dict[str, Any]:
         "data": None
     }
 
+    if background:
+        get_write_behind_queue().submit_call(store_notification_data, ecid)
+        final_response["success"] = True
+        final_response["message"] = f"Queued notification data for ECID: {ecid}"
+        return final_response
+
     try:
+        # Initialize MongoDB Data Access Object (DAO)
+        mongo_dao = get_mongo_dao()
+
         # Fetch User Name
         user_name_response =  mongo_dao.find_one(collection_name="similar_trials_results", query={"ecid": ecid}, projection={"userName": 1})
         user_name = user_name_response["userName"] if user_name_response else "Unknown User"
@@ -1,19 +1,91 @@
-from database.mongo_db_connection import MongoDBDAO
+from pymongo import DeleteMany, UpdateOne
+from database.mongo_db_connection import get_mongo_dao
+from utils.metrics import timed_stage
+from database.write_behind_queue import get_write_behind_queue
 from datetime import datetime
-from document_retrieval.models.db_models import StoreSimilarTrials
+from document_retrieval.models.db_models import SimilarTrialResultRow, StoreSimilarTrials
 
-# Initialize MongoDB Data Access Object (DAO)
-mongo_dao = MongoDBDAO()
+# One header document per ECID, one row per (ECID, nctId)
+RESULTS_COLLECTION = "similar_trials_results"
+RESULT_ROWS_COLLECTION = "similar_trials_result_rows"
 
-def store_similar_trials(user_name: str, ecid: str, user_input: dict, similar_trials: list) -> dict:
+
+def build_similar_trials_writes(user_name: str, ecid: str, user_input: dict, similar_trials: list) -> list:
+    """
+    Builds the writes that store the results of a similar trials search in the header / rows layout.
+
+    Rows are upserted by (ecid, nctId) with their rank in `similar_trials`, rows of trials that are no longer
+    in the results are deleted, and the header is written last so that it only refers to complete rows.
+    Documents of the ECID still in the old layout are deleted before the header is upserted, so that the
+    header is the only document of the ECID even before `database.migrations.split_similar_trials_results`
+    has been run.
+
+    Args:
+        user_name (str): The name of the user performing the operation.
+        ecid (str): The ECID (Electronic Case Identifier) for the trial.
+        user_input (dict): The user-provided input details.
+        similar_trials (list): The similar trial results, in ranked order.
+
+    Returns:
+        list: (collection_name, operation) tuples in the order they must be applied.
+    """
+    now = datetime.now()
+    writes = []
+    nct_ids = [trial["nctId"] for trial in similar_trials]
+    writes.append((RESULT_ROWS_COLLECTION, DeleteMany({"ecid": ecid, "nctId": {"$nin": nct_ids}})))
+
+    for rank, trial in enumerate(similar_trials):
+        row = SimilarTrialResultRow(
+            ecid=ecid,
+            nctId=trial["nctId"],
+            rank=rank,
+            score=trial.get("weighted_similarity_score", trial.get("similarity_score", 0)),
+            trial=trial,
+            createdAt=now,
+            updatedAt=now
+        ).dict()
+        created_at = row.pop("createdAt")
+        writes.append((RESULT_ROWS_COLLECTION, UpdateOne(
+            {"ecid": ecid, "nctId": trial["nctId"]},
+            {"$set": row, "$setOnInsert": {"createdAt": created_at}},
+            upsert=True
+        )))
+
+    header = StoreSimilarTrials(
+        userName=user_name,
+        ecid=ecid,
+        userInput=user_input,
+        resultCount=len(similar_trials),
+        createdAt=now,  # Timestamp for record creation
+        updatedAt=now   # Timestamp for record update
+    ).dict()
+    created_at = header.pop("createdAt")
+    # Unmigrated databases can hold several old layout documents per ECID, the rows replace all of them
+    writes.append((RESULTS_COLLECTION, DeleteMany({"ecid": ecid, "similarTrials": {"$exists": True}})))
+    writes.append((RESULTS_COLLECTION, UpdateOne(
+        {"ecid": ecid},
+        {"$set": header, "$setOnInsert": {"createdAt": created_at}},
+        upsert=True
+    )))
+    return writes
+
+
+@timed_stage("mongo_write", module="similar_trials_results")
+def store_similar_trials(user_name: str, ecid: str, user_input: dict, similar_trials: list,
+                         background: bool = False) -> dict:
     """
     Stores the results of similar trials in the MongoDB database.
 
+    The search is stored as a compact header document in `similar_trials_results` and one row per trial in
+    `similar_trials_result_rows`, both upserted by ECID, so a retried or repeated search replaces the earlier
+    results and keeps their creation date. Earlier results stored in the old layout are deleted.
+
     Args:
         user_name (str): The name of the user performing the operation.
         ecid (str): The ECID (Electronic Case Identifier) for the trial.
         user_input (dict): The user-provided input details.
         similar_trials (list): A list of similar trial results to be stored.
+        background (bool, optional): Queue the writes on the write-behind queue instead of waiting for them.
 
     Returns:
         dict: A dictionary containing the status of the operation, message, and stored data if successful.
@@ -25,23 +97,29 @@ def store_similar_trials(user_name: str, ecid: str, user_input: dict, similar_tr
     }
 
     try:
-        # Create a document instance using the StoreSimilarTrials model
-        document = StoreSimilarTrials(
-            userName=user_name,
-            ecid=ecid,
-            userInput=user_input,
-            similarTrials=similar_trials,
-            createdAt=datetime.now(),  # Timestamp for record creation
-            updatedAt=datetime.now()   # Timestamp for record update
-        ).dict()
+        writes = build_similar_trials_writes(user_name, ecid, user_input, similar_trials)
+
+        if background:
+            write_behind_queue = get_write_behind_queue()
+            for collection_name, operation in writes:
+                write_behind_queue.submit(collection_name, operation)
+            final_response["success"] = True
+            final_response["message"] = f"Queued similar trials results for ECID: {ecid}"
+            return final_response
 
-        # Insert the document into the MongoDB collection using DAO
-        db_response = mongo_dao.insert("similar_trials_results", document)
+        # Write the rows, then the header, using DAO
+        row_operations = [operation for collection_name, operation in writes if collection_name == RESULT_ROWS_COLLECTION]
+        header_operations = [operation for collection_name, operation in writes if collection_name == RESULTS_COLLECTION]
+        mongo_dao = get_mongo_dao()
+        mongo_dao.bulk_write(RESULT_ROWS_COLLECTION, row_operations)
+        db_response = mongo_dao.bulk_write(RESULTS_COLLECTION, header_operations)
 
-        # Check if the document was successfully inserted
-        if db_response:
+        # Check if the header was successfully written
+        if db_response.acknowledged:
             final_response["success"] = True
-            final_response["message"] = f"Successfully stored similar trials results: {db_response.inserted_id}"
+            final_response["message"] = (
+                f"Successfully stored {len(similar_trials)} similar trials results for ECID: {ecid}"
+            )
             final_response["data"] = db_response
 
     except Exception as e:
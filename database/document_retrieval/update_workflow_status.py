@@ -1,34 +1,35 @@
 from datetime import datetime
-from database.mongo_db_connection import MongoDBDAO
-from document_retrieval.models.db_models import WorkflowStates
+from pymongo import UpdateOne
+from database.mongo_db_connection import get_mongo_dao
+from utils.metrics import timed_stage
+from database.write_behind_queue import get_write_behind_queue
 
-# Initialize MongoDB Data Access Object (DAO)
-mongo_dao = MongoDBDAO()
 
-
-def update_workflow_status(ecid: str, step: str) -> dict:
+@timed_stage("mongo_write", module="workflow-states")
+def update_workflow_status(ecid: str, step: str, background: bool = False) -> dict:
     """
     Updates the workflow status document in the MongoDB database.
 
-    This function retrieves an existing workflow status document for the given ECID and step,
-    updates its status to "completed," and records the update timestamp.
+    This function atomically sets the status of the existing workflow status document for the given ECID
+    and step to "completed" and records the update timestamp.
 
     Args:
         ecid (str): The External Case ID associated with the workflow.
         step (str): The specific step in the workflow to update.
+        background (bool, optional): Queue the update on the write-behind queue instead of waiting for it.
 
     Returns:
         Dict[str, Any]: A dictionary containing the following keys:
             - success (bool): Indicates whether the operation was successful.
             - message (str): A message describing the outcome of the operation.
-            - data (Any): The database update response or None if the operation failed.
+            - data (Any): The updated workflow status document or None if the operation failed.
 
     Example:
         >>> update_workflow_status("68809b22-3372-45f5-b0fb-b44346bb8efb", "trial-services")
         {
             "success": True,
             "message": "Successfully updated workflow status document for ECID: 68809b22-3372-45f5-b0fb-b44346bb8efb and step: trial-services",
-            "data": <UpdateResult object>
+            "data": {"ecid": "68809b22-3372-45f5-b0fb-b44346bb8efb", "step": "trial-services", "status": "completed", ...}
         }
     """
     final_response = {
@@ -38,10 +39,22 @@ def update_workflow_status(ecid: str, step: str) -> dict:
     }
 
     try:
-        # Fetch the workflow status document
-        status_document = mongo_dao.find_one(
+        query = {"ecid": ecid, "step": step}
+        update = {"$set": {"status": "completed", "updatedAt": datetime.now()}}
+
+        if background:
+            get_write_behind_queue().submit("workflow-states", UpdateOne(query, update))
+            final_response.update({
+                "success": True,
+                "message": f"Queued workflow status update for ECID: {ecid} and step: {step}"
+            })
+            return final_response
+
+        # Update the document in MongoDB, the existing document keeps its creation date
+        status_document = get_mongo_dao().find_one_and_update(
             collection_name="workflow-states",
-            query={"ecid": ecid, "step": step}
+            query=query,
+            update=update
         )
 
         if status_document is None:
@@ -50,37 +63,13 @@ def update_workflow_status(ecid: str, step: str) -> dict:
             )
             return final_response
 
-        created_at = status_document["createdAt"]
-
-        # Create an updated document instance
-        document = WorkflowStates(
-            ecid=ecid,
-            step=step,
-            status="completed",
-            createdAt=created_at,
-            updatedAt=datetime.now()
-        ).dict()
-
-        # Update the document in MongoDB
-        db_response = mongo_dao.update(
-            collection_name="workflow-states",
-            update_values=document,
-            query={"ecid": ecid, "step": step}
-        )
-
-        # Check if the document was successfully updated
-        if db_response.matched_count > 0:
-            final_response.update({
-                "success": True,
-                "message": (
-                    f"Successfully updated workflow status document for ECID: {ecid} and step: {step}"
-                ),
-                "data": db_response
-            })
-        else:
-            final_response["message"] = (
-                f"Failed to update workflow status document for ECID: {ecid} and step: {step}"
-            )
+        final_response.update({
+            "success": True,
+            "message": (
+                f"Successfully updated workflow status document for ECID: {ecid} and step: {step}"
+            ),
+            "data": status_document
+        })
 
         return final_response
 
@@ -0,0 +1,204 @@
+"""
+Index definitions for the MongoDB collections used by the service, and a query plan checker.
+
+`ensure_indexes` creates the indexes at startup; creating an index that already exists is a no-op.
+The checker runs `explain()` for every query shape of the `database/document_retrieval` helpers and
+flags the ones that fall back to a collection scan.
+
+Usage:
+    python -m database.indexes            # create the indexes
+    python -m database.indexes --explain  # check the query plans, exits with 1 if a query scans a collection
+"""
+import os
+import sys
+import argparse
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import ConnectionFailure, PyMongoError
+
+from database.mongo_db_connection import MongoDBDAO, get_mongo_dao
+
+ENSURE_INDEXES_ON_STARTUP = os.getenv("ENSURE_INDEXES_ON_STARTUP", "true").lower() == "true"
+
+INDEXES = {
+    "t2dm_final_data_samples_processed": [
+        IndexModel([("nctId", ASCENDING)], name="nctId")
+    ],
+    "t2dm_data_preprocessed": [
+        IndexModel([("protocolSection.identificationModule.nctId", ASCENDING)], name="nctId")
+    ],
+    "similar_trials_results": [
+        # Unique once old searches are migrated, see database.migrations.split_similar_trials_results
+        IndexModel([("ecid", ASCENDING)], unique=True, name="ecid")
+    ],
+    "similar_trials_result_rows": [
+        IndexModel([("ecid", ASCENDING), ("nctId", ASCENDING)], unique=True, name="ecid_nctId"),
+        IndexModel([("ecid", ASCENDING), ("rank", ASCENDING)], name="ecid_rank")
+    ],
+    "similar_trials_criteria_results": [
+        IndexModel([("ecid", ASCENDING)], unique=True, name="ecid"),
+        # Most recent jobs first, for the labelled criteria of the criteria classifier
+        IndexModel([("updatedAt", DESCENDING), ("_id", DESCENDING)], name="updatedAt__id")
+    ],
+    "workflow-states": [
+        IndexModel([("ecid", ASCENDING), ("step", ASCENDING)], name="ecid_step")
+    ],
+    # Content hashes of ingested trials, see providers.corpus.ingest_trials
+    "trial_ingestion_state": [
+        IndexModel([("nctId", ASCENDING)], unique=True, name="nctId")
+    ]
+}
+
+# (helper, collection, filter, sort) for every query issued by the database/document_retrieval helpers
+QUERY_SHAPES = [
+    ("fetch_processed_trial_document_with_nct_id", "t2dm_final_data_samples_processed",
+     {"nctId": "NCT00000000"}, None),
+    ("fetch_processed_trial_documents_with_nct_ids", "t2dm_final_data_samples_processed",
+     {"nctId": {"$in": ["NCT00000000", "NCT00000001"]}}, None),
+    ("fetch_preprocessed_trial_document_with_nct_id", "t2dm_data_preprocessed",
+     {"protocolSection.identificationModule.nctId": "NCT00000000"}, None),
+    ("fetch_similar_trials_inputs_with_ecid (header)", "similar_trials_results",
+     {"ecid": "ecid"}, None),
+    ("fetch_similar_trials_inputs_with_ecid (selected rows)", "similar_trials_result_rows",
+     {"ecid": "ecid", "nctId": {"$in": ["NCT00000000", "NCT00000001"]}}, [("rank", ASCENDING)]),
+    ("fetch_similar_trials_inputs_with_ecid (ranked rows)", "similar_trials_result_rows",
+     {"ecid": "ecid"}, [("rank", ASCENDING)]),
+    ("store_similar_trials (header)", "similar_trials_results",
+     {"ecid": "ecid"}, None),
+    ("store_similar_trials (rows)", "similar_trials_result_rows",
+     {"ecid": "ecid", "nctId": "NCT00000000"}, None),
+    ("store_notification_data", "similar_trials_results",
+     {"ecid": "ecid"}, None),
+    ("record_eligibility_criteria_job", "similar_trials_criteria_results",
+     {"ecid": "ecid"}, None),
+    ("fetch_labelled_criteria", "similar_trials_criteria_results",
+     {}, [("updatedAt", DESCENDING), ("_id", DESCENDING)]),
+    ("update_workflow_status", "workflow-states",
+     {"ecid": "ecid", "step": "trial-services"}, None)
+]
+
+
+def ensure_indexes(mongo_dao: MongoDBDAO = None, collections: list = None) -> dict:
+    """
+    Creates the indexes in `INDEXES` that do not exist yet.
+
+    Args:
+        mongo_dao (MongoDBDAO, optional): The DAO to use. The shared DAO is used by default.
+        collections (list, optional): Only create the indexes of these collections. Defaults to all.
+
+    Returns:
+        dict: A response dictionary whose data maps each collection to its index names or the error.
+    """
+    final_response = {
+        "success": False,
+        "message": "Failed to ensure indexes",
+        "data": None
+    }
+
+    try:
+        mongo_dao = mongo_dao or get_mongo_dao()
+        results = {}
+        failed = []
+        for collection_name, indexes in INDEXES.items():
+            if collections is not None and collection_name not in collections:
+                continue
+            try:
+                results[collection_name] = mongo_dao.database[collection_name].create_indexes(indexes)
+            except ConnectionFailure:
+                # The database is unreachable, the remaining collections would each wait for the same timeout
+                raise
+            except PyMongoError as e:
+                # e.g. duplicate ECIDs left over from before the unique index, the other collections still get theirs
+                results[collection_name] = f"{e}"
+                failed.append(collection_name)
+                print(f"Failed to create indexes for {collection_name}: {e}")
+
+        final_response["data"] = results
+        final_response["success"] = not failed
+        final_response["message"] = (
+            f"Ensured indexes for {len(results) - len(failed)} collections"
+            + (f", failed for: {', '.join(failed)}" if failed else "")
+        )
+
+    except Exception as e:
+        final_response["message"] = f"Error ensuring indexes: {e}"
+
+    return final_response
+
+
+def _plan_stages(plan) -> list:
+    # Collects the stage names of a (possibly nested or sharded) explain plan
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(_plan_stages(item))
+    return stages
+
+
+def check_query_plans(mongo_dao: MongoDBDAO = None) -> dict:
+    """
+    Explains every query in `QUERY_SHAPES` and reports the winning plan's stages.
+
+    Returns:
+        dict: A response dictionary whose data is a list of {"helper", "collection", "stages", "collectionScan"}.
+              `success` is False if any query scans a whole collection.
+    """
+    final_response = {
+        "success": False,
+        "message": "Failed to check query plans",
+        "data": None
+    }
+
+    try:
+        mongo_dao = mongo_dao or get_mongo_dao()
+        plans = []
+        for helper, collection_name, query, sort in QUERY_SHAPES:
+            cursor = mongo_dao.database[collection_name].find(query).limit(1)
+            if sort:
+                cursor = cursor.sort(sort)
+            explanation = cursor.explain()
+            stages = _plan_stages(explanation.get("queryPlanner", {}).get("winningPlan", {}))
+            plans.append({
+                "helper": helper,
+                "collection": collection_name,
+                "stages": stages,
+                "collectionScan": "COLLSCAN" in stages
+            })
+
+        scans = [plan["helper"] for plan in plans if plan["collectionScan"]]
+        final_response["data"] = plans
+        final_response["success"] = not scans
+        final_response["message"] = (
+            f"Collection scans in: {', '.join(scans)}" if scans else f"All {len(plans)} queries use an index"
+        )
+
+    except Exception as e:
+        final_response["message"] = f"Error checking query plans: {e}"
+
+    return final_response
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create the MongoDB indexes or check the query plans.")
+    parser.add_argument("--explain", action="store_true", help="Check the query plans instead of creating indexes")
+    args = parser.parse_args()
+
+    if args.explain:
+        response = check_query_plans()
+        for plan in response["data"] or []:
+            flag = "COLLSCAN" if plan["collectionScan"] else "ok"
+            print(f"{flag:8} {plan['collection']:35} {plan['helper']:55} {' <- '.join(plan['stages'])}")
+    else:
+        response = ensure_indexes()
+        for collection_name, result in (response["data"] or {}).items():
+            print(f"{collection_name}: {result}")
+    print(response["message"])
+    sys.exit(0 if response["success"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Migrates `similar_trials_results` from one document with an embedded `similarTrials` array per search to a
+compact header per ECID plus one `similar_trials_result_rows` document per (ecid, nctId).
+
+Searches stored more than once for the same ECID are reduced to the newest one, which is also the one the
+rows layout keeps. The migration is idempotent: already migrated headers have no `similarTrials` field and
+are skipped, so it can be re-run after an interruption.
+
+Usage:
+    python -m database.migrations.split_similar_trials_results --dry-run
+    python -m database.migrations.split_similar_trials_results
+"""
+import argparse
+from pymongo import DeleteMany, DeleteOne, UpdateOne
+
+from database.indexes import ensure_indexes
+from database.mongo_db_connection import MongoDBDAO
+from database.document_retrieval.store_similar_trials import (
+    RESULTS_COLLECTION, RESULT_ROWS_COLLECTION, build_similar_trials_writes
+)
+
+
+def migrate(dry_run: bool = False, limit: int = None) -> dict:
+    mongo_dao = MongoDBDAO()
+    results = mongo_dao.database[RESULTS_COLLECTION]
+    stats = {"searches": 0, "rows": 0, "duplicatesRemoved": 0}
+
+    if not dry_run:
+        ensure_indexes(mongo_dao, collections=[RESULT_ROWS_COLLECTION])
+
+    ecids = results.distinct("ecid", {"similarTrials": {"$exists": True}})
+    for ecid in ecids[:limit]:
+        documents = list(results.find({"ecid": ecid}).sort([("createdAt", -1), ("_id", -1)]))
+        latest, older = documents[0], documents[1:]
+        if "similarTrials" not in latest:
+            # Already migrated by a later search, only the old documents are left over
+            latest_trials = None
+        else:
+            latest_trials = latest["similarTrials"]
+
+        stats["duplicatesRemoved"] += len(older)
+        if latest_trials is not None:
+            stats["searches"] += 1
+            stats["rows"] += len(latest_trials)
+        if dry_run:
+            continue
+
+        if latest_trials is not None:
+            writes = build_similar_trials_writes(latest.get("userName", "Unknown User"), ecid,
+                                                 latest.get("userInput", {}), latest_trials)
+            row_operations = [operation for collection_name, operation in writes
+                              if collection_name == RESULT_ROWS_COLLECTION]
+            mongo_dao.bulk_write(RESULT_ROWS_COLLECTION, row_operations)
+            # Keep the original creation date of the search
+            results.bulk_write([UpdateOne(
+                {"_id": latest["_id"]},
+                {"$set": {"resultCount": len(latest_trials)}, "$unset": {"similarTrials": ""}}
+            )] + [DeleteOne({"_id": document["_id"]}) for document in older])
+        elif older:
+            results.bulk_write([DeleteMany({"_id": {"$in": [document["_id"] for document in older]}})])
+
+    # The unique header index can only be created once every ECID has a single document
+    if not dry_run and (limit is None or limit >= len(ecids)):
+        ensure_indexes(mongo_dao, collections=[RESULTS_COLLECTION])
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Split similar trials results into header and row documents.")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the searches and rows to migrate")
+    parser.add_argument("--limit", type=int, default=None, help="Migrate at most this many ECIDs")
+    args = parser.parse_args()
+
+    stats = migrate(dry_run=args.dry_run, limit=args.limit)
+    prefix = "Would migrate" if args.dry_run else "Migrated"
+    print(f"{prefix} {stats['searches']} searches into {stats['rows']} result rows, "
+          f"removing {stats['duplicatesRemoved']} older duplicate documents")
+
+
+if __name__ == "__main__":
+    main()
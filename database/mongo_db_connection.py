@@ -1,6 +1,7 @@
 import os
+import threading
 from dotenv import load_dotenv
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
 
 
 class MongoDBDAO:
@@ -25,4 +26,31 @@ class MongoDBDAO:
         return self.database[collection_name].insert_one(document)
 
     def update(self, collection_name, query, update_values, upsert=False):
-        return self.database[collection_name].update_one(query, {'$set': update_values}, upsert=upsert)
\ No newline at end of file
+        return self.database[collection_name].update_one(query, {'$set': update_values}, upsert=upsert)
+
+    def find_one_and_update(self, collection_name, query, update, upsert=False, return_document=ReturnDocument.AFTER):
+        return self.database[collection_name].find_one_and_update(
+            query, update, upsert=upsert, return_document=return_document
+        )
+
+    def bulk_write(self, collection_name, operations, ordered=True):
+        return self.database[collection_name].bulk_write(operations, ordered=ordered)
+
+
+_mongo_dao = None
+_mongo_dao_lock = threading.Lock()
+
+
+def get_mongo_dao() -> MongoDBDAO:
+    """
+    Returns the DAO shared by the whole process, creating it on first use.
+
+    MongoClient is thread-safe and keeps a connection pool, so one client serves every request. Creating it
+    lazily keeps importing the service independent of the database configuration and reachability.
+    """
+    global _mongo_dao
+    if _mongo_dao is None:
+        with _mongo_dao_lock:
+            if _mongo_dao is None:
+                _mongo_dao = MongoDBDAO()
+    return _mongo_dao
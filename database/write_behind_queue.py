@@ -0,0 +1,190 @@
+import os
+import time
+import queue
+import atexit
+import threading
+from database.mongo_db_connection import MongoDBDAO, get_mongo_dao
+from utils.metrics import track_stage
+
+# Persist results in the background instead of on the request's critical path, writes are applied inline otherwise
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "true").lower() == "true"
+# Maximum number of pending writes held in memory, producers wait (and then write inline) when it is reached
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "1000"))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "100"))
+# How long the worker waits for more writes to batch with the first one
+WRITE_BEHIND_LINGER_SECONDS = float(os.getenv("WRITE_BEHIND_LINGER_SECONDS", "0.05"))
+WRITE_BEHIND_MAX_RETRIES = int(os.getenv("WRITE_BEHIND_MAX_RETRIES", "3"))
+WRITE_BEHIND_PUT_TIMEOUT_SECONDS = float(os.getenv("WRITE_BEHIND_PUT_TIMEOUT_SECONDS", "5"))
+
+
+class WriteBehindQueue:
+    """
+    Bounded FIFO queue of MongoDB writes that a background thread applies in batches.
+
+    Consecutive writes to the same collection are sent as one ordered `bulk_write`, so the writes of a
+    collection are applied in the order they were submitted. Callables can be queued for writes that depend
+    on an earlier write (such as a read-then-insert); they run in order with the other writes.
+    Failed batches are retried with exponential backoff, pending writes are flushed on shutdown.
+    """
+
+    def __init__(self, mongo_dao: MongoDBDAO = None, max_pending: int = WRITE_BEHIND_MAX_PENDING,
+                 batch_size: int = WRITE_BEHIND_BATCH_SIZE, linger_seconds: float = WRITE_BEHIND_LINGER_SECONDS,
+                 max_retries: int = WRITE_BEHIND_MAX_RETRIES):
+        self.mongo_dao = mongo_dao or get_mongo_dao()
+        self.batch_size = batch_size
+        self.linger_seconds = linger_seconds
+        self.max_retries = max_retries
+        self.written = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._stopped = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="write-behind-queue", daemon=True)
+        self._worker.start()
+
+    def submit(self, collection_name: str, operation) -> bool:
+        """
+        Queues a pymongo write operation (InsertOne, UpdateOne, ...) for a collection.
+
+        Returns:
+            bool: True if the write was queued, False if the queue stayed full and it was written inline.
+        """
+        return self._put(("write", collection_name, operation))
+
+    def submit_call(self, function, *args, **kwargs) -> bool:
+        """
+        Queues a callable that performs its own writes, in order with the other queued writes.
+
+        The call fails, and is retried, when it raises or returns a response dictionary whose success is False.
+        """
+        return self._put(("call", None, (function, args, kwargs)))
+
+    def _put(self, item) -> bool:
+        if WRITE_BEHIND_ENABLED and not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=WRITE_BEHIND_PUT_TIMEOUT_SECONDS)
+                return True
+            except queue.Full:
+                print("Write-behind queue is full, writing inline")
+        self._apply([item])
+        return False
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Waits until every write queued so far has been applied.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait. Waits indefinitely by default.
+
+        Returns:
+            bool: True if the queue was drained within the timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def shutdown(self, timeout: float = 30) -> bool:
+        """Flushes the pending writes and stops the worker thread. Later writes are applied inline."""
+        flushed = self.flush(timeout)
+        self._stopped.set()
+        self._worker.join(timeout=1)
+        if not flushed:
+            print(f"Write-behind queue shut down with {self._queue.unfinished_tasks} unwritten operations")
+        return flushed
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                batch = [self._queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+
+            # Collect more writes for the same batch until it is full or the linger time has passed
+            deadline = time.monotonic() + self.linger_seconds
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self._apply(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _apply(self, batch: list):
+        # Split the batch into runs of consecutive writes to one collection, keeping the submit order
+        runs = []
+        for kind, collection_name, operation in batch:
+            if kind == "write" and runs and runs[-1][0] == "write" and runs[-1][1] == collection_name:
+                runs[-1][2].append(operation)
+            else:
+                runs.append((kind, collection_name, [operation]))
+
+        for kind, collection_name, operations in runs:
+            if kind == "call":
+                function, args, kwargs = operations[0]
+                self._with_retries(f"{getattr(function, '__name__', 'call')}",
+                                   lambda: _raise_on_failure(function(*args, **kwargs)), 1)
+            else:
+                self._with_retries(
+                    collection_name,
+                    lambda: self.mongo_dao.bulk_write(collection_name, operations, ordered=True),
+                    len(operations)
+                )
+
+    def _with_retries(self, name: str, write, count: int):
+        for attempt in range(self.max_retries + 1):
+            try:
+                with track_stage("mongo_write_behind", name):
+                    write()
+                self.written += count
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self.failed += count
+                    print(f"Write-behind failed for {name} ({count} operations) after {attempt + 1} attempts: {e}")
+                    return
+                time.sleep(min(0.2 * 2 ** attempt, 5))
+
+
+def _raise_on_failure(response):
+    # Queued helpers report failures in their response instead of raising, the retries need an exception
+    if isinstance(response, dict) and response.get("success") is False:
+        raise RuntimeError(response.get("message", "Queued call failed"))
+    return response
+
+
+_write_behind_queue = None
+_write_behind_queue_lock = threading.Lock()
+
+
+def get_write_behind_queue() -> WriteBehindQueue:
+    """Returns the process-wide write-behind queue, starting it on first use."""
+    global _write_behind_queue
+    if _write_behind_queue is None:
+        with _write_behind_queue_lock:
+            if _write_behind_queue is None:
+                _write_behind_queue = WriteBehindQueue()
+                atexit.register(_write_behind_queue.shutdown)
+    return _write_behind_queue
+
+
+def flush_write_behind_queue(timeout: float = 10) -> bool:
+    """Waits for pending background writes, if the queue was ever started. Use before reading written data."""
+    if _write_behind_queue is None:
+        return True
+    return _write_behind_queue.flush(timeout)
+
+
+def shutdown_write_behind_queue(timeout: float = 30) -> bool:
+    """Flushes and stops the write-behind queue, if it was ever started."""
+    if _write_behind_queue is None:
+        return True
+    return _write_behind_queue.shutdown(timeout)
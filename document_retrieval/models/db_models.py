@@ -12,7 +12,16 @@ class StoreSimilarTrials(BaseModel):
     ecid: str
     userName: str
     userInput: dict
-    similarTrials: list
+    resultCount: int
+    createdAt: datetime
+    updatedAt: datetime
+
+class SimilarTrialResultRow(BaseModel):
+    ecid: str
+    nctId: str
+    rank: int
+    score: float
+    trial: dict
     createdAt: datetime
     updatedAt: datetime
 
@@ -6,6 +6,10 @@ class BaseResponse(BaseModel):
     data: Any
     message: str
     status_code: int
+    # Per-stage timings of this request, only set when requested with `debug_timings=true`
+    debug_timings: Optional[dict] = None
+    # Top_k, candidates and filter-passing trials of every retrieval stage, only set for `targetResultCount`
+    retrieval_stages: Optional[list] = None
 
 class WeightsModel(BaseModel):
     inclusionCriteria: float = Field(0, ge=0, le=1)
@@ -30,6 +34,7 @@ class DocumentSearch(BaseModel):
 class GenerateEligibilityCriteria(BaseModel):
     ecid: str
     trialDocuments: list
+    packTokenBudget: Optional[int] = Field(None, ge=0)
 
 class DocumentFilters(DocumentSearch):
     phase: List[str]
@@ -41,4 +46,11 @@ class DocumentFilters(DocumentSearch):
     sampleSizeMax: Optional[str] = ""
     countryLogic: Literal["AND", "OR"] = "OR"
     safetyAssessment: Optional[str] = ""
+    # Widen the retrieval until this many trials pass the filters, within the time budget
+    targetResultCount: Optional[int] = Field(None, ge=1, le=500)
 
+class MatchCriteria(BaseModel):
+    lines: List[str] = Field(..., min_length=1, max_length=200)
+    topK: int = Field(5, ge=1, le=50)
+    criteriaType: Optional[Literal["inclusion", "exclusion"]] = None
+    nctIds: Optional[List[str]] = None
@@ -1,8 +1,13 @@
 from fastapi import APIRouter,Response, status
-from document_retrieval.models.routes_models import BaseResponse, GenerateEligibilityCriteria, DocumentFilters
+from fastapi.responses import StreamingResponse
+from document_retrieval.models.routes_models import BaseResponse, GenerateEligibilityCriteria, DocumentFilters, \
+    MatchCriteria
 from document_retrieval.services.fetch_similar_documents_extended import fetch_similar_documents_extended
-from document_retrieval.services.generate_trial_eligibility_certeria import generate_trial_eligibility_criteria
+from document_retrieval.services.generate_trial_eligibility_certeria import generate_trial_eligibility_criteria, \
+    stream_trial_eligibility_criteria
+from providers.corpus.criteria_index import match_criteria_lines
 from datetime import datetime
+from utils.tracing import get_debug_timings
 
 router = APIRouter()
 
@@ -86,13 +91,16 @@ async def search_routes_new(request: DocumentFilters, response: Response):
         similar_documents_response = await fetch_similar_documents_extended(documents_search_keys=input_document,
                                                                             custom_weights=weights.dict(),
                                                                             document_filters=document_filters,
-                                                                            user_data=user_data)
+                                                                            user_data=user_data,
+                                                                            target_result_count=request.targetResultCount)
 
         # Handle the response from the fetch function
         if similar_documents_response["success"] is False:
             base_response.success = False
             base_response.message = similar_documents_response["message"]
             response.status_code = status.HTTP_400_BAD_REQUEST
+            base_response.debug_timings = get_debug_timings()
+            base_response.retrieval_stages = similar_documents_response.get("retrieval_stages")
             return base_response
         else:
             base_response.success = True
@@ -100,6 +108,8 @@ async def search_routes_new(request: DocumentFilters, response: Response):
             base_response.status_code = status.HTTP_200_OK
             base_response.data = similar_documents_response["data"]
             response.status_code = status.HTTP_200_OK
+            base_response.debug_timings = get_debug_timings()
+            base_response.retrieval_stages = similar_documents_response.get("retrieval_stages")
             return base_response
 
     except Exception as e:
@@ -108,6 +118,7 @@ async def search_routes_new(request: DocumentFilters, response: Response):
         base_response.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
         base_response.message = f"Unexpected error: {e}"
         response.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+        base_response.debug_timings = get_debug_timings()
         return base_response
 
 
@@ -130,7 +141,8 @@ async def generate_trial_eligibility_criteria_route(request: GenerateEligibility
         ecid = request.ecid
         trial_documents = request.trialDocuments
         eligibility_criteria_response = await generate_trial_eligibility_criteria(ecid=ecid,
-                                                                                  trail_documents_ids=trial_documents)
+                                                                                  trail_documents_ids=trial_documents,
+                                                                                  pack_token_budget=request.packTokenBudget)
 
         # Handle the response from the eligibility criteria generation function
         if eligibility_criteria_response["success"] is False:
@@ -138,6 +150,7 @@ async def generate_trial_eligibility_criteria_route(request: GenerateEligibility
             base_response.success = False
             base_response.message = eligibility_criteria_response["message"]
             response.status_code = status.HTTP_400_BAD_REQUEST
+            base_response.debug_timings = get_debug_timings()
             return base_response
         else:
             # If the operation succeeds, update the base response with the generated criteria
@@ -146,6 +159,7 @@ async def generate_trial_eligibility_criteria_route(request: GenerateEligibility
             base_response.status_code = status.HTTP_200_OK
             base_response.data = eligibility_criteria_response["data"]
             response.status_code = status.HTTP_200_OK
+            base_response.debug_timings = get_debug_timings()
             return base_response
 
     except Exception as e:
@@ -154,4 +168,64 @@ async def generate_trial_eligibility_criteria_route(request: GenerateEligibility
         base_response.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
         base_response.message = f"Unexpected error: {e}"
         response.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+        base_response.debug_timings = get_debug_timings()
+        return base_response
+
+
+@router.post("/generate_trial_eligibility_criteria_stream")
+async def generate_trial_eligibility_criteria_stream_route(request: GenerateEligibilityCriteria):
+    """
+    API endpoint to generate trial eligibility criteria, streaming each drafted criterion as it is generated.
+
+    The response is newline-delimited JSON: one {"event": "criterion", "type": ..., "data": ...} line per
+    drafted criterion, followed by a {"event": "completed", "success": ..., "message": ..., "data": ...} line
+    with the same data as `/generate_trial_eligibility_criteria`.
+    """
+    return StreamingResponse(
+        stream_trial_eligibility_criteria(ecid=request.ecid,
+                                          trail_documents_ids=request.trialDocuments,
+                                          pack_token_budget=request.packTokenBudget),
+        media_type="application/x-ndjson"
+    )
+
+
+@router.post("/match_criteria", response_model=BaseResponse)
+async def match_criteria_route(request: MatchCriteria, response: Response):
+    """
+    Endpoint to match a batch of criterion lines against the individual criteria of every indexed trial.
+
+    Args:
+        request (MatchCriteria): The criterion lines, the number of matches per line and optional filters.
+        response (Response): The FastAPI Response object.
+
+    Returns:
+        BaseResponse: One {"line", "matches"} entry per line, each match with its nctId, criteria text and score.
+    """
+    base_response = BaseResponse(
+        success=False,
+        status_code=status.HTTP_400_BAD_REQUEST,
+        data=None,
+        message="Internal Server Error"
+    )
+
+    try:
+        match_response = match_criteria_lines(lines=request.lines,
+                                              top_k=request.topK,
+                                              criteria_type=request.criteriaType,
+                                              nct_ids=request.nctIds)
+        base_response.success = match_response["success"]
+        base_response.message = match_response["message"]
+        base_response.data = match_response["data"]
+        base_response.status_code = status.HTTP_200_OK if match_response["success"] else status.HTTP_400_BAD_REQUEST
+        response.status_code = base_response.status_code
+        base_response.debug_timings = get_debug_timings()
+        return base_response
+
+    except Exception as e:
+        # Handle unexpected errors and log them
+        print(f"Unexpected error: {e}")
+        base_response.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+        base_response.message = f"Unexpected error: {e}"
+        response.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+        base_response.debug_timings = get_debug_timings()
         return base_response
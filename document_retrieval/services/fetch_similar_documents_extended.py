@@ -1,4 +1,7 @@
+import os
+import time
 from document_retrieval.utils.process_criteria import process_criteria
+from providers.pinecone.similarity_search_service import PINECONE_TOP_K, query_pinecone_db_modules
 from document_retrieval.utils.fetch_trial_filters import fetch_trial_filters
 from document_retrieval.utils.process_filters import process_filters
 from document_retrieval.utils.calculate_weighted_similarity_score import process_similarity_scores
@@ -6,10 +9,134 @@ from database.document_retrieval.store_similar_trials import store_similar_trial
 from database.document_retrieval.update_workflow_status import update_workflow_status
 
 
-async def fetch_similar_documents_extended(documents_search_keys: dict, custom_weights: dict, document_filters: dict, user_data: dict) -> dict:
+# Largest Pinecone top_k an adaptive search widens to
+ADAPTIVE_MAX_TOP_K = int(os.getenv("ADAPTIVE_MAX_TOP_K", "320"))
+# Time an adaptive search may spend on retrieval and filtering before it stops widening
+ADAPTIVE_TIME_BUDGET_SECONDS = float(os.getenv("ADAPTIVE_TIME_BUDGET_SECONDS", "5"))
+
+# Search criteria and the Pinecone module they are matched against, None for all modules
+SEARCH_MODULES = {
+    "inclusionCriteria": "eligibilityModule",
+    "exclusionCriteria": "eligibilityModule",
+    "rationale": None,
+    "condition": "conditionsModule",
+    "trialOutcomes": "outcomesModule",
+    "title": "identificationModule"
+}
+
+
+def retrieve_candidates(documents_search_keys: dict, top_k: int = PINECONE_TOP_K) -> dict:
+    """
+    Retrieves the candidate trials of all search criteria, keeping the entry with the highest similarity
+    score per trial.
+
+    Returns:
+        dict: The candidate trials by NCT ID.
+    """
+    # Query Pinecone for all criteria at once
+    queries = {key: (documents_search_keys.get(key), module) for key, module in SEARCH_MODULES.items()
+               if documents_search_keys.get(key)}
+    print(f"Pinecone DB Started")
+    pinecone_response = query_pinecone_db_modules(queries, k=top_k)
+    print(f"Pinecone DB Finished")
+
+    # Process each criteria and store the results, a failed query is reported by each of them
+    criteria_documents = {}
+    for key, module in SEARCH_MODULES.items():
+        criteria_documents[key] = process_criteria(
+            documents_search_keys.get(key),
+            module=module,
+            document_search_data=documents_search_keys,
+            pinecone_response={**pinecone_response, "data": (pinecone_response["data"] or {}).get(key)},
+            depth=max(1, top_k // PINECONE_TOP_K)
+        )
+    for item in criteria_documents["rationale"]:
+        item["module"] = "trialRationale"
+
+    # Combine all documents and ensure uniqueness by retaining the highest similarity score
+    combined_documents = [doc for documents in criteria_documents.values() for doc in documents]
+    unique_documents = {}
+    for doc in combined_documents:
+        nctId = doc["nctId"]
+        if nctId not in unique_documents or doc["similarity_score"] > unique_documents[nctId]["similarity_score"]:
+            unique_documents[nctId] = doc
+    return unique_documents
+
+
+def retrieve_filtered_candidates(documents_search_keys: dict, document_filters: dict,
+                                 target_result_count: int = None) -> tuple:
+    """
+    Retrieves the candidate trials and applies the document filters.
+
+    Without a target the candidates of the default top_k are filtered once. With `target_result_count` the
+    search is widened by doubling top_k until that many candidates pass the filters, top_k reaches
+    ADAPTIVE_MAX_TOP_K, a wider search finds no new candidates or the next stage would exceed
+    ADAPTIVE_TIME_BUDGET_SECONDS. The filter fields of a trial are only fetched by the first stage finding it,
+    and wider stages only add trials passing the filters, so the others are those of the default top_k. If the
+    filter fields of a wider stage could not be fetched, the result of the previous stage is returned.
+
+    Returns:
+        tuple: The candidates passing the filters, the other candidates and one {"topK", "candidates",
+            "passingFilters", "seconds"} dictionary per stage. If the filter fields of the first stage could not
+            be fetched, all its candidates are returned unfiltered and the other candidates are None.
+    """
+    filter_fields = {}
+    first_stage_ids = None
+    stages = []
+    top_k = PINECONE_TOP_K
+    start = time.perf_counter()
+    while True:
+        stage_start = time.perf_counter()
+        unique_documents = retrieve_candidates(documents_search_keys, top_k)
+
+        # filter documents
+        new_documents = [doc for nctId, doc in unique_documents.items() if nctId not in filter_fields]
+        fetch_add_documents_filter_response = fetch_trial_filters(trial_documents=new_documents)
+        if fetch_add_documents_filter_response["success"] is False:
+            if not stages:
+                return list(unique_documents.values()), None, stages
+            # keep the candidates of the last stage whose filter fields could be fetched
+            print(f"Filter fields of top_k {top_k} could not be fetched, keeping top_k {stages[-1]['topK']}")
+            break
+        for doc in new_documents:
+            filter_fields[doc["nctId"]] = {field: doc[field] for field in
+                                           ("locations", "phases", "enrollmentCount", "startDate", "endDate",
+                                            "sponsorType")}
+        trial_documents_with_filters = list(unique_documents.values())
+        if first_stage_ids is None:
+            first_stage_ids = set(unique_documents)
+        for doc in trial_documents_with_filters:
+            doc.update(filter_fields[doc["nctId"]])
+        print(f"Documents length: {len(trial_documents_with_filters)}")
+        trial_documents = process_filters(documents=trial_documents_with_filters, filters=document_filters)
+        print(f"Documents length: {len(trial_documents)}")
+
+        stage_seconds = time.perf_counter() - stage_start
+        stages.append({"topK": top_k, "candidates": len(trial_documents_with_filters),
+                       "passingFilters": len(trial_documents), "seconds": round(stage_seconds, 3)})
+        if (target_result_count is None or len(trial_documents) >= target_result_count
+                or top_k >= ADAPTIVE_MAX_TOP_K
+                or (len(stages) > 1 and stages[-1]["candidates"] <= stages[-2]["candidates"])
+                or time.perf_counter() - start + 2 * stage_seconds > ADAPTIVE_TIME_BUDGET_SECONDS):
+            break
+        top_k = min(top_k * 2, ADAPTIVE_MAX_TOP_K)
+
+    if target_result_count is not None:
+        print(f"Adaptive retrieval stages: {stages}")
+    passing_ids = {item["nctId"] for item in trial_documents}
+    other_documents = [item for item in trial_documents_with_filters
+                       if item["nctId"] not in passing_ids and item["nctId"] in first_stage_ids]
+    return trial_documents, other_documents, stages
+
+
+async def fetch_similar_documents_extended(documents_search_keys: dict, custom_weights: dict, document_filters: dict,
+                                           user_data: dict, target_result_count: int = None) -> dict:
     """
     Fetch similar documents based on inclusion criteria, exclusion criteria, and trial rationale,
     ensuring unique values in the final list by retaining the entry with the highest similarity score.
+
+    With `target_result_count` the retrieval is widened until that many trials pass the document filters,
+    see `retrieve_filtered_candidates`, and its stages are returned as "retrieval_stages".
     """
     final_response = {
         "success": False,
@@ -20,66 +147,14 @@ async def fetch_similar_documents_extended(documents_search_keys: dict, custom_w
     try:
         user_inputs = documents_search_keys | document_filters
 
-        # Process each criteria and store the results
-        inclusion_criteria_documents = process_criteria(
-            documents_search_keys.get("inclusionCriteria"),
-            module="eligibilityModule",
-            document_search_data=documents_search_keys
-        )
-        exclusion_criteria_documents = process_criteria(
-            documents_search_keys.get("exclusionCriteria"),
-            module="eligibilityModule",
-            document_search_data=documents_search_keys
-        )
-        trial_rationale_documents = process_criteria(
-            documents_search_keys.get("rationale"),
-            document_search_data=documents_search_keys
-        )
-        for item in trial_rationale_documents:
-            item["module"] = "trialRationale"
-
-        trial_conditions_documents = process_criteria(
-            documents_search_keys.get("condition"),
-            module="conditionsModule",
-            document_search_data=documents_search_keys
-        )
-
-        trial_outcomes_documents = process_criteria(
-            documents_search_keys.get("trialOutcomes"),
-            module="outcomesModule",
-            document_search_data=documents_search_keys
-        )
-
-        trial_title_documents = process_criteria(
-            documents_search_keys.get("title"),
-            module="identificationModule",
-            document_search_data=documents_search_keys
-        )
-        # Combine all documents and ensure uniqueness by retaining the highest similarity score
-        combined_documents = (
-            inclusion_criteria_documents +
-            exclusion_criteria_documents +
-            trial_rationale_documents +
-            trial_conditions_documents +
-            trial_outcomes_documents +
-            trial_title_documents
+        trial_documents, other_documents, stages = retrieve_filtered_candidates(
+            documents_search_keys, document_filters, target_result_count
         )
-        unique_documents = {}
-        for doc in combined_documents:
-            nctId = doc["nctId"]
-            if nctId not in unique_documents or doc["similarity_score"] > unique_documents[nctId]["similarity_score"]:
-                unique_documents[nctId] = doc
-
-        print(len(unique_documents))
-        # filter documents
-        fetch_add_documents_filter_response = fetch_trial_filters(trial_documents=list(unique_documents.values()))
-        if fetch_add_documents_filter_response["success"] is True:
-            trial_documents_with_filters = fetch_add_documents_filter_response["data"]
-            print(f"Documents length: {len(trial_documents_with_filters)}")
-            trial_documents = process_filters(documents=trial_documents_with_filters, filters=document_filters)
-            print(f"Documents length: {len(trial_documents)}")
-            elements_to_append = [item for item in trial_documents_with_filters if item not in trial_documents]
-            trial_documents.extend(elements_to_append)
+        if target_result_count is not None:
+            final_response["retrieval_stages"] = stages
+        # Without filter fields the candidates are returned unfiltered
+        if other_documents is not None:
+            trial_documents.extend(other_documents)
             if len(trial_documents) == 0:
                 db_response = store_similar_trials(user_name=user_data["userName"],
                                                    ecid=user_data["ecid"],
@@ -90,8 +165,6 @@ async def fetch_similar_documents_extended(documents_search_keys: dict, custom_w
                 final_response["success"] = True
                 final_response["data"] = []
                 return final_response
-        else:
-            trial_documents = list(unique_documents.values())
 
         # Calculate weighted average for similarity score
         nctIds = [item["nctId"] for item in trial_documents]
@@ -110,14 +183,14 @@ async def fetch_similar_documents_extended(documents_search_keys: dict, custom_w
         # Sort trial based on score
         trial_documents = sorted(trial_documents, key=lambda trial_item: trial_item["weighted_similarity_score"], reverse=True)
 
-        # Store Similar trials
+        # Store Similar trials before responding, generation requests read them back and may reach another worker
         db_response = store_similar_trials(user_name=user_data["userName"],
                                            ecid=user_data["ecid"],
                                            user_input=user_inputs,
                                            similar_trials=trial_documents)
 
         # Update Job Status
-        status_response = update_workflow_status(ecid=user_data["ecid"], step="trial-services")
+        status_response = update_workflow_status(ecid=user_data["ecid"], step="trial-services", background=True)
         print(status_response)
         print(db_response)
 
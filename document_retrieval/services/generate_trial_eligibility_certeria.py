@@ -1,7 +1,10 @@
+import os
+import json
+import asyncio
 import concurrent.futures
 from collections import defaultdict
 from agents.TrialEligibilityAgent import TrialEligibilityAgent
-from providers.openai.generate_embeddings import azure_client
+from providers.openai.generate_embeddings import get_azure_client
 from database.document_retrieval.fetch_processed_trial_document_with_nct_id import fetch_processed_trial_document_with_nct_id
 from database.document_retrieval.record_eligibility_criteria_job import record_eligibility_criteria_job
 from database.document_retrieval.fetch_similar_trials_inputs_with_ecid import fetch_similar_trials_inputs_with_ecid
@@ -10,12 +13,25 @@ from utils.generate_object_id import generate_object_id
 from database.document_retrieval.store_notification_data import store_notification_data
 from database.document_retrieval.update_workflow_status import update_workflow_status
 from document_retrieval.utils.categorize_generated_criteria import categorize_generated_criteria
-from document_retrieval.utils.merge_duplicate_values import merge_duplicate_values, normalize_bmi_ranges
+from document_retrieval.utils.merge_duplicate_values import merge_duplicate_values
+from document_retrieval.utils.extract_metric_ranges import merge_metric_ranges
+from document_retrieval.utils.pack_trial_documents import estimate_tokens, pack_trial_documents
+from document_retrieval.utils import prompts
+from utils.tracing import with_current_context
 
+# Prompt token budget per drafting call when packing several trials together (0 drafts one trial per call)
+DRAFTING_PACK_TOKEN_BUDGET = int(os.getenv("DRAFTING_PACK_TOKEN_BUDGET", "0"))
 
-async def generate_trial_eligibility_criteria(ecid: str, trail_documents_ids: list) -> dict:
+
+async def generate_trial_eligibility_criteria(ecid: str, trail_documents_ids: list, pack_token_budget: int = None,
+                                              on_criterion=None) -> dict:
     """
-    Generate trial eligibility criteria in batches of 2 documents.
+    Generate trial eligibility criteria from the selected similar trials.
+
+    By default every trial is drafted in its own LLM call. With a pack token budget, trials are grouped
+    into as few drafting calls as fit the budget, so the system prompt and user criteria are sent once per group.
+    With `on_criterion`, drafting calls are streamed and every drafted criterion is passed to
+    `on_criterion(criteria_type, criterion)` as soon as it is complete (called from worker threads).
     """
     final_response = {
         "success": False,
@@ -24,8 +40,8 @@ async def generate_trial_eligibility_criteria(ecid: str, trail_documents_ids: li
     }
 
     try:
-        # Fetch User Inputs from DB
-        similar_trials_input_response = fetch_similar_trials_inputs_with_ecid(ecid=ecid)
+        # Fetch User Inputs and the selected trials from DB
+        similar_trials_input_response = fetch_similar_trials_inputs_with_ecid(ecid=ecid, nct_ids=trail_documents_ids)
         if similar_trials_input_response["success"] is False:
             final_response["message"] = similar_trials_input_response["message"]
             return final_response
@@ -58,7 +74,7 @@ async def generate_trial_eligibility_criteria(ecid: str, trail_documents_ids: li
         similar_documents.sort(key=lambda x: x["similarity_score"], reverse=True)
 
         # Initialize the TrialEligibilityAgent
-        eligibility_agent = TrialEligibilityAgent(azure_client, max_tokens=4000)
+        eligibility_agent = TrialEligibilityAgent(get_azure_client(), max_tokens=4000)
 
         print("Started generating criteria")
         # Initialize lists to store generated criteria
@@ -77,19 +93,35 @@ async def generate_trial_eligibility_criteria(ecid: str, trail_documents_ids: li
                 user_provided_trial_outcome=user_inputs.get("trialOutcomes", "No trial outcomes provided"),
                 user_provided_trial_conditions=user_inputs.get("condition", "No trial conditions provided"),
                 generated_inclusion_criteria=generated_inclusion_criteria,
-                generated_exclusion_criteria=generated_exclusion_criteria
+                generated_exclusion_criteria=generated_exclusion_criteria,
+                on_criterion=on_criterion
             )
             if not response["success"]:
-                return {"error": response["message"]}
+                print(response["message"])
+                # A call that failed part way keeps the criteria it completed, they may have been streamed already
+                if not (response["data"]["inclusionCriteria"] or response["data"]["exclusionCriteria"]):
+                    return {"error": response["message"]}
 
             return response["data"]
 
-        # Process documents in batches of 1
-        batches = [similar_documents[i] for i in range(0, len(similar_documents))]
+        pack_token_budget = DRAFTING_PACK_TOKEN_BUDGET if pack_token_budget is None else pack_token_budget
+        if pack_token_budget > 0:
+            # Pack several trials per call, the prompt overhead is repeated once per batch instead of per trial
+            base_tokens = estimate_tokens(prompts.medical_writer_agent_role_packed) + estimate_tokens(user_inputs)
+            batches = [
+                batch if len(batch) > 1 else batch[0]
+                for batch in pack_trial_documents(similar_documents, token_budget=pack_token_budget,
+                                                  base_tokens=base_tokens)
+            ]
+            print(f"Packed {len(similar_documents)} trials into {len(batches)} drafting calls")
+        else:
+            # Process documents in batches of 1
+            batches = [similar_documents[i] for i in range(0, len(similar_documents))]
 
         # Run batches in parallel (10 at a time)
         with concurrent.futures.ThreadPoolExecutor(max_workers=30) as executor:
-            future_to_batch = {executor.submit(process_batch, batch): batch for batch in batches}
+            process_batch_in_context = with_current_context(process_batch)
+            future_to_batch = {executor.submit(process_batch_in_context, batch): batch for batch in batches}
 
             for future in concurrent.futures.as_completed(future_to_batch):
                 result = future.result()
@@ -105,11 +137,13 @@ async def generate_trial_eligibility_criteria(ecid: str, trail_documents_ids: li
 
         print("Finished generating criteria")
 
-        # Assign unique IDs
+        # Assign unique IDs, streamed criteria already received theirs
         for item in generated_inclusion_criteria:
-            item["criteriaID"] = f"cid_{generate_object_id()}"
+            if "criteriaID" not in item:
+                item["criteriaID"] = f"cid_{generate_object_id()}"
         for item in generated_exclusion_criteria:
-            item["criteriaID"] = f"cid_{generate_object_id()}"
+            if "criteriaID" not in item:
+                item["criteriaID"] = f"cid_{generate_object_id()}"
 
 
         categorizedGeneratedData = categorize_generated_criteria(generated_inclusion_criteria=generated_inclusion_criteria,
@@ -122,18 +156,18 @@ async def generate_trial_eligibility_criteria(ecid: str, trail_documents_ids: li
         else:
             categorizedUserData = categorizedUserDataResponse["data"]
 
-        # Store job in DB
-        db_response = record_eligibility_criteria_job(ecid, categorizedGeneratedData, categorizedUserData)
-        notification_response = store_notification_data(ecid=ecid)
-        workflow_status_response = update_workflow_status(ecid=ecid, step="similar-criteria")
+        # Store job in DB, the writes are applied in the background in this order
+        db_response = record_eligibility_criteria_job(ecid, categorizedGeneratedData, categorizedUserData,
+                                                      background=True)
+        notification_response = store_notification_data(ecid=ecid, background=True)
+        workflow_status_response = update_workflow_status(ecid=ecid, step="similar-criteria", background=True)
 
         print(workflow_status_response["message"])
         print(notification_response["message"])
         final_response["message"] = db_response.get("message", "Successfully generated trial eligibility criteria.")
 
         # Merge Duplicates Values
-        drug_ranges = normalize_bmi_ranges(drug_ranges)
-        drug_ranges = merge_duplicate_values(drug_ranges)
+        drug_ranges = merge_metric_ranges(drug_ranges)
         time_line = merge_duplicate_values(time_line)
 
         # Initialize the default dictionary
@@ -164,4 +198,42 @@ async def generate_trial_eligibility_criteria(ecid: str, trail_documents_ids: li
 
     except Exception as e:
         final_response['message'] = f"Failed to generate trial eligibility criteria. Error: {e}"
-        return final_response
\ No newline at end of file
+        return final_response
+
+
+async def stream_trial_eligibility_criteria(ecid: str, trail_documents_ids: list, pack_token_budget: int = None):
+    """
+    Streams trial eligibility criteria generation as newline-delimited JSON events.
+
+    A "criterion" event is emitted for every drafted criterion as soon as the LLM has written it, followed by a
+    single "completed" event carrying the same response as `generate_trial_eligibility_criteria`.
+    """
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def on_criterion(criteria_type, criterion):
+        criterion["criteriaID"] = f"cid_{generate_object_id()}"
+        event = {"event": "criterion", "type": criteria_type, "data": dict(criterion)}
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    def run_generation():
+        # The generation pipeline blocks, so it runs on its own event loop in a worker thread
+        return asyncio.run(generate_trial_eligibility_criteria(ecid=ecid,
+                                                               trail_documents_ids=trail_documents_ids,
+                                                               pack_token_budget=pack_token_budget,
+                                                               on_criterion=on_criterion))
+
+    generation = loop.run_in_executor(None, with_current_context(run_generation))
+    generation.add_done_callback(lambda _: loop.call_soon_threadsafe(events.put_nowait, None))
+
+    while True:
+        event = await events.get()
+        if event is None:
+            break
+        yield json.dumps(event, default=str) + "\n"
+
+    try:
+        result = generation.result()
+    except Exception as e:
+        result = {"success": False, "message": f"Failed to generate trial eligibility criteria. Error: {e}", "data": None}
+    yield json.dumps({"event": "completed", **result}, default=str) + "\n"
@@ -1,8 +1,46 @@
 from database.document_retrieval.fetch_processed_trial_document_with_nct_id import \
     fetch_processed_trial_document_with_nct_id
-from providers.openai.generate_embeddings import generate_embeddings_from_azure_client
-from sklearn.metrics.pairwise import cosine_similarity
+from providers.openai.generate_embeddings import generate_embeddings_from_azure_client, \
+    generate_batch_embeddings_from_azure_client
+from providers.corpus.corpus_store import get_corpus_store
 import numpy as np
+from utils.metrics import timed_stage, track_stage
+
+
+def cosine_similarity(first_embedding, second_embedding) -> float:
+    """Cosine similarity of two embeddings, 0 if either of them is all zeros."""
+    first_embedding = np.asarray(first_embedding, dtype=np.float64).ravel()
+    second_embedding = np.asarray(second_embedding, dtype=np.float64).ravel()
+    norm = np.linalg.norm(first_embedding) * np.linalg.norm(second_embedding)
+    return float(first_embedding @ second_embedding / norm) if norm else 0.0
+
+
+def score_embedded_documents(embedded_user_input_document: dict, embedded_target_document: dict,
+                             weights: dict) -> tuple:
+    """
+    Computes the per-module cosine similarities of two embedded documents and their weighted average.
+
+    Args:
+        embedded_user_input_document (dict): Module name to embedding of the user input document.
+        embedded_target_document (dict): Module name to embedding of the target document.
+        weights (dict): Module name to weight.
+
+    Returns:
+        tuple: The weighted similarity score and the similarity score of each module.
+    """
+    # Compute cosine similarity for each section (excluding 'rationale')
+    similarity_scores = {}
+    for module in embedded_target_document.keys():  # Only iterate over target's modules
+        similarity_scores[module] = cosine_similarity(embedded_user_input_document[module],
+                                                      embedded_target_document[module])
+
+    # Compute weighted similarity score
+    weighted_similarity_score = sum(similarity_scores[module] * weights[module] for module in similarity_scores)
+
+    # Normalize by the sum of weights
+    sum_weights = sum(weights[module] for module in similarity_scores.keys())
+    weighted_similarity_score /= sum_weights
+    return weighted_similarity_score, similarity_scores
 
 
 def calculate_weighted_similarity_score(user_input_document: dict, target_document: dict, weights: dict) -> dict:
@@ -42,19 +80,9 @@ def calculate_weighted_similarity_score(user_input_document: dict, target_docume
             if module not in excluded_modules
         }
 
-        # Compute cosine similarity for each section (excluding 'rationale')
-        similarity_scores = {}
-        for module in embedded_target_document.keys():  # Only iterate over target's modules
-            user_embedding = np.array(embedded_user_input_document[module]).reshape(1, -1)
-            target_embedding = np.array(embedded_target_document[module]).reshape(1, -1)
-            similarity_scores[module] = cosine_similarity(user_embedding, target_embedding)[0][0]
-
-        # Compute weighted similarity score
-        weighted_similarity_score = sum(similarity_scores[module] * weights[module] for module in similarity_scores)
-
-        # Normalize by the sum of weights
-        sum_weights = sum(weights[module] for module in similarity_scores.keys())
-        weighted_similarity_score /= sum_weights
+        weighted_similarity_score, similarity_scores = score_embedded_documents(embedded_user_input_document,
+                                                                                embedded_target_document,
+                                                                                weights)
 
         final_response["success"] = True
         final_response["message"] = "Weighted similarity score calculated successfully"
@@ -69,6 +97,58 @@ def calculate_weighted_similarity_score(user_input_document: dict, target_docume
     return final_response
 
 
+def score_with_corpus_store(corpus_store, target_documents_ids: list, user_input_document: dict,
+                            weights: dict) -> tuple:
+    """
+    Scores the target trials that are in the memory-mapped corpus, reading their module vectors in place
+    instead of fetching and embedding every trial document. The user input modules are embedded in one request.
+
+    Args:
+        corpus_store (CorpusEmbeddingStore): The published corpus.
+        target_documents_ids (list): List of target document NCT IDs.
+        user_input_document (dict): Dictionary containing different sections of the user input document.
+        weights (dict): Dictionary containing different sections of the similarity weights.
+
+    Returns:
+        tuple: The scored trials, in the format of `process_similarity_scores`, and the NCT IDs that are not
+            in the corpus.
+    """
+    rows, missing = corpus_store.rows(target_documents_ids)
+    # Modules without user input are excluded, like in `calculate_weighted_similarity_score`
+    modules = [module for module in corpus_store.modules
+               if module in weights and user_input_document.get(module) is not None]
+    sum_weights = sum(weights[module] for module in modules)
+    if len(rows) == 0 or not sum_weights:
+        return [], list(target_documents_ids)
+
+    with track_stage("corpus_score", corpus_store.version):
+        embedding_response = generate_batch_embeddings_from_azure_client(
+            [user_input_document[module] for module in modules]
+        )
+        if embedding_response["success"] is False:
+            return [], list(target_documents_ids)
+        similarity_scores = {
+            module: corpus_store.similarities(rows, module, embedding_response["data"][position])
+            for position, module in enumerate(modules)
+        }
+
+        weighted_similarity_scores = sum(similarity_scores[module] * weights[module] for module in modules) / sum_weights
+
+    missing_ids = set(missing)
+    found_ids = [nct_id for nct_id in target_documents_ids if nct_id not in missing_ids]
+    scored = [
+        {
+            "nctId": nct_id,
+            "weighted_similarity_score": float(weighted_similarity_scores[position]),
+            "similarity_scores": {module: weights[module] * float(similarity_scores[module][position])
+                                  for module in modules}
+        }
+        for position, nct_id in enumerate(found_ids)
+    ]
+    return scored, missing
+
+
+@timed_stage("weighted_scoring")
 def process_similarity_scores(target_documents_ids: list, user_input_document: dict, weights: dict) -> dict:
     """
     Process similarity scores for a list of target documents against a user input document.
@@ -90,6 +170,12 @@ def process_similarity_scores(target_documents_ids: list, user_input_document: d
         print(weights)
         trial_target_document = []  # Store similarity scores for each document
 
+        # Trials in the shared corpus embeddings are scored in one pass, the others one by one below
+        corpus_store = get_corpus_store()
+        if corpus_store is not None:
+            trial_target_document, target_documents_ids = score_with_corpus_store(corpus_store, target_documents_ids,
+                                                                                  user_input_document, weights)
+
         for nctId in target_documents_ids:
             # Fetch target document using its NCT ID
             target_document_response = fetch_processed_trial_document_with_nct_id(nct_id=nctId)
@@ -1,4 +1,73 @@
 from utils.generate_object_id import generate_object_id
+from document_retrieval.utils.criteria_category_classifier import get_criteria_category_classifier
+
+
+def _categorise_criteria(eligibility_agent, eligibility_criteria: dict) -> dict:
+    """
+    Assigns a class to every criterion, answering high-confidence criteria with the local nearest-centroid
+    classifier and sending only the low-margin ones to the LLM.
+    """
+    criteria_types = ("inclusionCriteria", "exclusionCriteria")
+    categorized_data = {criteria_type: [] for criteria_type in criteria_types}
+    remaining_criteria = {criteria_type: [] for criteria_type in criteria_types}
+
+    items = [(criteria_type, item) for criteria_type in criteria_types for item in eligibility_criteria.get(criteria_type, [])]
+    predictions = None
+    try:
+        classifier = get_criteria_category_classifier()
+        if classifier is not None:
+            prediction_response = classifier.predict([f"{item['criteria']}" for _, item in items])
+            if prediction_response["success"] is True:
+                predictions = prediction_response["data"]
+            else:
+                print(prediction_response["message"])
+    except Exception as e:
+        print(f"Local criteria classification failed: {e}")
+
+    for index, (criteria_type, item) in enumerate(items):
+        if predictions and predictions[index]["class"]:
+            categorized_data[criteria_type].append({"criteriaID": item["criteriaID"], "class": predictions[index]["class"]})
+        else:
+            remaining_criteria[criteria_type].append(item)
+
+    remaining_count = sum(len(remaining_criteria[criteria_type]) for criteria_type in criteria_types)
+    print(f"Locally classified {len(items) - remaining_count} of {len(items)} user criteria")
+    if remaining_count:
+        categorized_response = eligibility_agent.categorise_eligibility_criteria(eligibility_criteria=remaining_criteria)
+        if not categorized_response["success"]:
+            return categorized_response
+        for criteria_type in criteria_types:
+            categorized_data[criteria_type].extend(categorized_response["data"][criteria_type])
+
+    return {"success": True, "message": "Successfully categorised eligibility criteria", "data": categorized_data}
+
+
+def group_categorized_criteria(categorized_criteria: dict, user_provided_criteria: dict) -> dict:
+    """
+    Groups the user provided criteria by the class assigned to each criteriaID.
+
+    Args:
+        categorized_criteria (dict): {"inclusionCriteria": [{"criteriaID", "class"}], "exclusionCriteria": [...]}.
+        user_provided_criteria (dict): The criteria that were categorised, with criteriaID, criteria and source.
+
+    Returns:
+        dict: {class: {"Inclusion": [{"criteria_id", "criteria", "source"}], "Exclusion": [...]}}.
+    """
+    categorized_data = {}
+    for criteria_type, group in (("inclusionCriteria", "Inclusion"), ("exclusionCriteria", "Exclusion")):
+        # Index the criteria once instead of scanning them for every categorised item
+        criteria_by_id = {criteria_item["criteriaID"]: criteria_item
+                          for criteria_item in user_provided_criteria.get(criteria_type, [])}
+        for item in categorized_criteria[criteria_type]:
+            criteria_item = criteria_by_id.get(item["criteriaID"])
+            value = {}
+            if criteria_item is not None:
+                value["criteria_id"] = criteria_item["criteriaID"]
+                value["criteria"] = criteria_item["criteria"]
+                value["source"] = criteria_item["source"]
+            categorized_data.setdefault(item["class"], {"Inclusion": [], "Exclusion": []})[group].append(value)
+    return categorized_data
+
 
 def categorize_eligibility_criteria(eligibility_agent, inclusion_criteria, exclusion_criteria ) -> dict:
     """Categorize the eligibility criteria into inclusion and exclusion classes."""
@@ -55,33 +124,11 @@ def categorize_eligibility_criteria(eligibility_agent, inclusion_criteria, exclu
                     "exclusionCriteria": provided_exclusion_criteria
                 }
 
-        categorized_response = eligibility_agent.categorise_eligibility_criteria(eligibility_criteria=user_provided_criteria)
+        categorized_response = _categorise_criteria(eligibility_agent, user_provided_criteria)
         if not categorized_response["success"]:
             return {"success": False, "message": categorized_response["message"], "data": None}
 
-        categorized_data = {}
-        for item in categorized_response["data"]["inclusionCriteria"]:
-            item_class = item["class"]
-            criteriaID = item["criteriaID"]
-            value = {}
-            for criteria_item in user_provided_criteria["inclusionCriteria"]:
-                if criteria_item["criteriaID"] == criteriaID:
-                    value["criteria_id"] = criteria_item["criteriaID"]
-                    value["criteria"] = criteria_item["criteria"]
-                    value["source"] = criteria_item["source"]
-            categorized_data.setdefault(item_class, {"Inclusion": [], "Exclusion": []})["Inclusion"].append(value)
-
-        for item in categorized_response["data"]["exclusionCriteria"]:
-            item_class = item["class"]
-            criteriaID = item["criteriaID"]
-            value = {}
-            for criteria_item in user_provided_criteria["exclusionCriteria"]:
-                if criteria_item["criteriaID"] == criteriaID:
-                    value["criteria_id"] = criteria_item["criteriaID"]
-                    value["criteria"] = criteria_item["criteria"]
-                    value["source"] = criteria_item["source"]
-            categorized_data.setdefault(item_class, {"Inclusion": [], "Exclusion": []})["Exclusion"].append(value)
-            
+        categorized_data = group_categorized_criteria(categorized_response["data"], user_provided_criteria)
         return {"success": True, "message": "Successfully categorized eligibility criteria.", "data": categorized_data}
     except Exception as e:
         print(f"Error occurred while categorizing eligibility criteria: {str(e)}")
@@ -1,19 +1,137 @@
+import os
 import json
 from utils.generate_object_id import generate_object_id
 from document_retrieval.utils.prompts import merge_prompt
+from document_retrieval.utils.cluster_criteria import cluster_criteria
+from document_retrieval.utils.pack_trial_documents import estimate_tokens
+from document_retrieval.utils.parse_json_response import parse_json_response
+from document_retrieval.utils.response_schemas import criteria_categories, get_response_format, response_schemas
 from providers.openai.openai_connection import OpenAIClient
+from utils.metrics import timed_stage, track_stage
+from utils.tracing import with_current_context
 import concurrent.futures
 
 
-criteria_categories = [
-    "Gender", "Health Condition/Status", "Clinical and Laboratory Parameters",
-    "Medication Status", "Informed Consent", "Ability to Comply with Study Procedures",
-    "Lifestyle Requirements", "Reproductive Status", "Co-morbid Conditions",
-    "Recent Participation in Other Clinical Trials", "Allergies and Drug Reactions",
-    "Mental Health Disorders", "Infectious Diseases", "Other", "Age"
-]
+# Merge calls are split into chunks of at most this many prompt tokens / criteria
+MERGE_CHUNK_TOKEN_BUDGET = int(os.getenv("MERGE_CHUNK_TOKEN_BUDGET", "2500"))
+MERGE_CHUNK_MAX_ITEMS = int(os.getenv("MERGE_CHUNK_MAX_ITEMS", "25"))
+MERGE_MAX_WORKERS = int(os.getenv("MERGE_MAX_WORKERS", "4"))
+MERGE_MAX_ROUNDS = int(os.getenv("MERGE_MAX_ROUNDS", "6"))
+
+# Tokens taken by the criteriaID, class and JSON punctuation of one prompt item
+_CRITERION_OVERHEAD_TOKENS = 30
+
+
+def _chunk_criteria(criteria_list, token_budget=MERGE_CHUNK_TOKEN_BUDGET, max_items=MERGE_CHUNK_MAX_ITEMS):
+    """Splits criteria into consecutive chunks that fit the merge prompt token budget."""
+    chunks = []
+    current_chunk = []
+    current_tokens = 0
+    for item in criteria_list:
+        item_tokens = estimate_tokens(item["criteria"]) + _CRITERION_OVERHEAD_TOKENS
+        if current_chunk and (current_tokens + item_tokens > token_budget or len(current_chunk) >= max_items):
+            chunks.append(current_chunk)
+            current_chunk = []
+            current_tokens = 0
+        current_chunk.append(item)
+        current_tokens += item_tokens
+    if current_chunk:
+        chunks.append(current_chunk)
+    return chunks
+
+
+def _merge_chunk(criteria_list, category):
+    """Merges one chunk of criteria with a single LLM call. Returns the chunk unchanged if the call fails."""
+    # The merge only needs the statements, the source maps are re-attached from the criteriaIDs below
+    prompt_criteria = [
+        {"criteria": item["criteria"], "criteriaID": item["criteriaID"], "class": category}
+        for item in criteria_list
+    ]
+    messages = [
+        {"role": "system", "content": merge_prompt},
+        {"role": "user", "content": json.dumps(prompt_criteria)}
+    ]
+
+    openai_client = OpenAIClient()
+    with track_stage("llm", "merge_criteria") as timer:
+        response = openai_client.generate_text(messages=messages, response_format=get_response_format("merge_criteria"))
+        timer.set_outcome_from(response)
+    if response["success"] is False:
+        print(f"Failed to merge criteria:{category} {response['message']}")
+        return criteria_list
+    parsed_response = parse_json_response(response["data"].choices[0].message.content,
+                                          response_schemas["merge_criteria"], "merge_criteria")
+    if parsed_response["success"] is False:
+        print(f"Failed to parse merged response:{category} {parsed_response['message']}")
+        return criteria_list
+
+    criteria_by_id = {item["criteriaID"]: item for item in criteria_list}
+    merged_ids = set()
+    merged_response = []
+    for res in parsed_response["data"]["response"]:
+        criteria_ids = [
+            criteria_id for criteria_id in res["criteriaID"]
+            if criteria_id in criteria_by_id and criteria_id not in merged_ids
+        ]
+        if not criteria_ids:
+            continue
+        merged_ids.update(criteria_ids)
+        source = {}
+        for criteria_id in criteria_ids:
+            source.update(criteria_by_id[criteria_id]["source"])
+        merged_response.append({"criteria": res["criteria"], "criteriaID": generate_object_id(), "source": source})
+
+    # Criteria the model left out are kept as they are instead of being lost
+    merged_response.extend(item for item in criteria_list if item["criteriaID"] not in merged_ids)
+    return merged_response
+
+
+def _merge_criteria(criteria_list, category):
+    """
+    Merges similar criteria of one category with a map-reduce over token-bounded chunks.
 
+    The chunks of each round are merged in parallel and their outputs are merged again in the next round,
+    so duplicates across chunks are merged as well and large categories need about log(n) rounds.
+    Criteria are ordered by text so that similar statements tend to land in the same chunk.
 
+    Args:
+        criteria_list (list): Criteria with `criteria`, `criteriaID` and `source`.
+        category (str): The category of the criteria.
+
+    Returns:
+        list: The merged criteria with new criteriaIDs and combined source mappings.
+    """
+    current_criteria = list(criteria_list)
+    llm_calls = 0
+    for depth in range(1, MERGE_MAX_ROUNDS + 1):
+        current_criteria.sort(key=lambda item: item["criteria"].lower())
+        chunks = _chunk_criteria(current_criteria)
+        llm_calls += len(chunks)
+
+        if len(chunks) == 1:
+            merged_criteria = _merge_chunk(chunks[0], category)
+            print(f"{category}: merged {len(criteria_list)} criteria into {len(merged_criteria)} "
+                  f"in {depth} rounds ({llm_calls} LLM calls)")
+            return merged_criteria
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(MERGE_MAX_WORKERS, len(chunks))) as executor:
+            merge_chunk = with_current_context(_merge_chunk)
+            merged_chunks = list(executor.map(lambda chunk: merge_chunk(chunk, category), chunks))
+        merged_criteria = [item for merged_chunk in merged_chunks for item in merged_chunk]
+        print(f"{category}: merge round {depth} reduced {len(current_criteria)} criteria "
+              f"in {len(chunks)} chunks to {len(merged_criteria)}")
+
+        # Another round over the same chunks would not merge anything more
+        if len(merged_criteria) >= len(current_criteria):
+            print(f"{category}: merge stopped after {depth} rounds ({llm_calls} LLM calls) without progress")
+            return merged_criteria
+        current_criteria = merged_criteria
+
+    print(f"{category}: merge stopped at the maximum depth of {MERGE_MAX_ROUNDS} rounds ({llm_calls} LLM calls)")
+    return current_criteria
+
+
+@timed_stage("category_merge", module_arg="category")
 def _process_criteria(criteria_list, category):
     try:
         print(f"Processing criteria for {category}")
@@ -22,38 +140,24 @@ def _process_criteria(criteria_list, category):
         if not filtered_criteria:
             return []
 
-        # If the filtered list is greater than 25, split it into two
-        if len(filtered_criteria) > 25:
-            mid = len(filtered_criteria) // 2
-            first_half = filtered_criteria[:mid]
-            second_half = filtered_criteria[mid:]
-
-            return _process_criteria(first_half, category) + _process_criteria(second_half, category)
-
         print(f"Found {len(filtered_criteria)} criteria for {category}.")
 
-        messages = [
-            {"role": "system", "content": merge_prompt},
-            {"role": "user", "content": json.dumps(filtered_criteria)}
+        # Merge near-identical criteria locally and only send the ambiguous ones to the LLM
+        clustering_response = cluster_criteria(filtered_criteria)
+        if clustering_response["success"] is False:
+            print(f"Failed to pre-merge criteria for {category}: {clustering_response['message']}")
+            return _merge_criteria(filtered_criteria, category)
+
+        print(f"{category}: {clustering_response['message']}")
+        merged_criteria = [
+            {"criteria": item["criteria"], "criteriaID": generate_object_id(), "source": item["source"]}
+            for item in clustering_response["data"]["merged"]
         ]
+        ambiguous_criteria = clustering_response["data"]["ambiguous"]
+        if ambiguous_criteria:
+            merged_criteria.extend(_merge_criteria(ambiguous_criteria, category))
 
-        openai_client = OpenAIClient()
-        response = openai_client.generate_text(messages=messages, response_format={"type": "json_object"})
-        try:
-            merged_response = json.loads(response["data"].choices[0].message.content).get("response", [])
-        except Exception as e:
-            print(f"Failed to parse merged response:{category} {e}")
-            return filtered_criteria
-
-        for res in merged_response:
-            res["source"] = {}
-            for criteria_id in res["criteriaID"]:
-                for entry in filtered_criteria:
-                    if entry["criteriaID"] == criteria_id:
-                        res["source"].update(entry["source"])
-            res["criteriaID"] = generate_object_id()
-
-        return merged_response
+        return merged_criteria
     except Exception as e:
         print(f"Error processing criteria {category}: {e}")
         return []
@@ -66,12 +170,13 @@ def categorize_generated_criteria(generated_inclusion_criteria, generated_exclus
     """
     categorized_data = {}
 
-    # Use ThreadPoolExecutor for parallel processing
+    # Use ThreadPoolExecutor for parallel processing, with the caller's trace context in every task
+    process_criteria = with_current_context(_process_criteria)
     with concurrent.futures.ThreadPoolExecutor(max_workers=len(criteria_categories)) as executor:
         # Submit tasks for inclusion criteria
         inclusion_futures = {
             executor.submit(
-                _process_criteria, generated_inclusion_criteria, criteria_category
+                process_criteria, generated_inclusion_criteria, criteria_category
             ): (criteria_category, "Inclusion")
             for criteria_category in criteria_categories
         }
@@ -79,7 +184,7 @@ def categorize_generated_criteria(generated_inclusion_criteria, generated_exclus
         # Submit tasks for exclusion criteria
         exclusion_futures = {
             executor.submit(
-                _process_criteria, generated_exclusion_criteria, criteria_category
+                process_criteria, generated_exclusion_criteria, criteria_category
             ): (criteria_category, "Exclusion")
             for criteria_category in criteria_categories
         }
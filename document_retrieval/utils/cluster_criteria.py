@@ -0,0 +1,121 @@
+import re
+import numpy as np
+from providers.openai.generate_embeddings import generate_batch_embeddings_from_azure_client
+
+# Criteria at or above this cosine similarity (with identical numeric values) are merged locally
+MERGE_SIMILARITY_THRESHOLD = 0.95
+# Criteria between the two thresholds may or may not be the same and are left to the LLM merge
+AMBIGUOUS_SIMILARITY_THRESHOLD = 0.85
+
+_number_pattern = re.compile(r"\d+(?:\.\d+)?")
+_non_word_pattern = re.compile(r"[^\w\s]")
+
+
+def _normalize_text(text: str) -> str:
+    return " ".join(_non_word_pattern.sub(" ", text.lower()).split())
+
+
+def _numeric_values(text: str) -> tuple:
+    # "Age 18 years or above" and "Age 20 years or above" embed almost identically but are different criteria
+    return tuple(sorted(float(value) for value in _number_pattern.findall(text)))
+
+
+def _merge_cluster(members: list) -> dict:
+    """Collapses a cluster into its first member, combining the source maps of all members in order."""
+    representative = dict(members[0])
+    representative["source"] = {}
+    for member in members:
+        representative["source"].update(member["source"])
+    return representative
+
+
+def cluster_criteria(criteria_list: list, merge_threshold: float = MERGE_SIMILARITY_THRESHOLD,
+                     ambiguous_threshold: float = AMBIGUOUS_SIMILARITY_THRESHOLD) -> dict:
+    """
+    Pre-merges near-identical criteria with embeddings before the LLM merge.
+
+    Criteria are embedded in one batch and clustered greedily in a deterministic order: each criterion joins
+    the first cluster whose leader has a cosine similarity of at least `merge_threshold` and the same numeric
+    values, otherwise it starts a new cluster. Clusters whose leaders are only moderately similar to another
+    leader are returned as ambiguous so that the LLM can decide whether they should be merged.
+
+    Args:
+        criteria_list (list): Criteria with `criteria`, `criteriaID`, `class` and `source` keys.
+        merge_threshold (float): Cosine similarity above which criteria are merged locally.
+        ambiguous_threshold (float): Cosine similarity above which merged criteria still need the LLM.
+
+    Returns:
+        dict: A response dictionary whose data contains:
+            - merged (list): Final criteria that need no LLM merge.
+            - ambiguous (list): Pre-merged criteria that should still go through the LLM merge.
+    """
+    final_response = {
+        "success": False,
+        "message": "Failed to cluster criteria",
+        "data": None
+    }
+    try:
+        if len(criteria_list) < 2:
+            final_response["success"] = True
+            final_response["message"] = "Nothing to cluster"
+            final_response["data"] = {"merged": list(criteria_list), "ambiguous": []}
+            return final_response
+
+        # Sort so that the clustering and the merged source maps do not depend on the drafting completion order
+        ordered_criteria = sorted(
+            criteria_list,
+            key=lambda item: (_normalize_text(item["criteria"]), sorted(item["source"]))
+        )
+
+        embedding_response = generate_batch_embeddings_from_azure_client(
+            [item["criteria"] for item in ordered_criteria]
+        )
+        if embedding_response["success"] is False:
+            final_response["message"] = embedding_response["message"]
+            return final_response
+
+        embeddings = embedding_response["data"]
+        embeddings = embeddings / np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        similarity_matrix = embeddings @ embeddings.T
+        numeric_values = [_numeric_values(item["criteria"]) for item in ordered_criteria]
+
+        # Greedy leader clustering
+        leaders = []
+        clusters = []
+        for index in range(len(ordered_criteria)):
+            for cluster_index, leader in enumerate(leaders):
+                if (similarity_matrix[index, leader] >= merge_threshold
+                        and numeric_values[index] == numeric_values[leader]):
+                    clusters[cluster_index].append(index)
+                    break
+            else:
+                leaders.append(index)
+                clusters.append([index])
+
+        # Leaders that are close to another leader are left to the LLM
+        leader_similarity = similarity_matrix[np.ix_(leaders, leaders)]
+        ambiguous_clusters = set()
+        for i in range(len(leaders)):
+            for j in range(i + 1, len(leaders)):
+                if (leader_similarity[i, j] >= ambiguous_threshold
+                        and numeric_values[leaders[i]] == numeric_values[leaders[j]]):
+                    ambiguous_clusters.update((i, j))
+
+        merged = []
+        ambiguous = []
+        for cluster_index, members in enumerate(clusters):
+            representative = _merge_cluster([ordered_criteria[index] for index in members])
+            if cluster_index in ambiguous_clusters:
+                ambiguous.append(representative)
+            else:
+                merged.append(representative)
+
+        final_response["success"] = True
+        final_response["message"] = (
+            f"Clustered {len(criteria_list)} criteria into {len(clusters)}, {len(ambiguous)} ambiguous"
+        )
+        final_response["data"] = {"merged": merged, "ambiguous": ambiguous}
+    except Exception as e:
+        final_response["message"] = f"Failed to cluster criteria: {e}"
+
+    return final_response
@@ -0,0 +1,228 @@
+import os
+import time
+import threading
+import numpy as np
+from providers.openai.generate_embeddings import EMBEDDING_DIMENSIONS, generate_batch_embeddings_from_azure_client
+from database.document_retrieval.fetch_labelled_criteria import fetch_labelled_criteria
+from document_retrieval.utils.categorize_generated_criteria import criteria_categories
+
+# A prediction is only trusted when the best centroid beats the runner-up by this cosine margin
+MIN_CONFIDENCE_MARGIN = float(os.getenv("CRITERIA_CLASSIFIER_MIN_MARGIN", "0.05"))
+# ... and is at least this similar to the criterion
+MIN_CONFIDENCE_SIMILARITY = float(os.getenv("CRITERIA_CLASSIFIER_MIN_SIMILARITY", "0.45"))
+# Optional .npz file the centroids are loaded from and saved to, so they are not rebuilt on every start
+CENTROIDS_PATH = os.getenv("CRITERIA_CENTROIDS_PATH")
+# Labelled criteria used per category, more barely moves a centroid but costs embedding calls
+MAX_EXAMPLES_PER_CATEGORY = 300
+# Most recent criteria jobs the labelled criteria are read from
+MAX_LABELLED_JOBS = int(os.getenv("CRITERIA_CLASSIFIER_MAX_JOBS", "500"))
+# Seconds before the centroids are built again after building them failed, doubled on every further failure
+CLASSIFIER_RETRY_SECONDS = float(os.getenv("CRITERIA_CLASSIFIER_RETRY_SECONDS", "60"))
+CLASSIFIER_MAX_RETRY_SECONDS = 3600
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    return matrix / np.clip(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12, None)
+
+
+class CriteriaCategoryClassifier:
+    """
+    Nearest-centroid classifier that assigns eligibility criteria to the `criteria_categories`.
+
+    Each category is represented by the normalized mean embedding of historical criteria labelled with it.
+    Criteria whose best and second best centroid are too close are left unclassified for the LLM.
+    """
+
+    def __init__(self, min_margin: float = MIN_CONFIDENCE_MARGIN, min_similarity: float = MIN_CONFIDENCE_SIMILARITY):
+        self.min_margin = min_margin
+        self.min_similarity = min_similarity
+        self.categories = []
+        self.centroids = None
+
+    @property
+    def is_fitted(self) -> bool:
+        return self.centroids is not None
+
+    def fit(self, labelled_criteria: list) -> dict:
+        """
+        Builds the category centroids from labelled criteria.
+
+        Args:
+            labelled_criteria (list): {"criteria": str, "class": str} dictionaries.
+
+        Returns:
+            dict: A response dictionary with the number of examples used per category.
+        """
+        final_response = {
+            "success": False,
+            "message": "Failed to fit criteria classifier",
+            "data": None
+        }
+        try:
+            examples = {}
+            for item in labelled_criteria:
+                if item["class"] not in criteria_categories:
+                    continue
+                category_examples = examples.setdefault(item["class"], [])
+                if len(category_examples) < MAX_EXAMPLES_PER_CATEGORY and item["criteria"] not in category_examples:
+                    category_examples.append(item["criteria"])
+
+            if len(examples) < 2:
+                final_response["message"] = "At least two labelled categories are required"
+                return final_response
+
+            categories = sorted(examples)
+            texts = [text for category in categories for text in examples[category]]
+            embedding_response = generate_batch_embeddings_from_azure_client(texts)
+            if embedding_response["success"] is False:
+                final_response["message"] = embedding_response["message"]
+                return final_response
+
+            embeddings = _normalize_rows(embedding_response["data"])
+            centroids = []
+            offset = 0
+            for category in categories:
+                count = len(examples[category])
+                centroids.append(embeddings[offset:offset + count].mean(axis=0))
+                offset += count
+
+            self.categories = categories
+            self.centroids = _normalize_rows(np.array(centroids, dtype=np.float32))
+
+            final_response["success"] = True
+            final_response["message"] = f"Fitted criteria classifier on {len(texts)} criteria"
+            final_response["data"] = {category: len(examples[category]) for category in categories}
+        except Exception as e:
+            final_response["message"] = f"Failed to fit criteria classifier: {e}"
+
+        return final_response
+
+    def predict_embeddings(self, embeddings: np.ndarray) -> list:
+        """
+        Classifies already embedded criteria.
+
+        Returns:
+            list: One {"class", "similarity", "margin"} dictionary per row. "class" is None for low-confidence rows.
+        """
+        similarities = _normalize_rows(embeddings) @ self.centroids.T
+        if similarities.shape[1] > 1:
+            top_two = np.argsort(-similarities, axis=1)[:, :2]
+        else:
+            top_two = np.zeros((similarities.shape[0], 2), dtype=int)
+        rows = np.arange(similarities.shape[0])
+        best = similarities[rows, top_two[:, 0]]
+        margin = best - similarities[rows, top_two[:, 1]]
+
+        predictions = []
+        for row in rows:
+            confident = margin[row] >= self.min_margin and best[row] >= self.min_similarity
+            predictions.append({
+                "class": self.categories[top_two[row, 0]] if confident else None,
+                "similarity": float(best[row]),
+                "margin": float(margin[row])
+            })
+        return predictions
+
+    def predict(self, texts: list) -> dict:
+        """
+        Classifies criteria texts, embedding them in one batch.
+
+        Args:
+            texts (list): The criteria to classify.
+
+        Returns:
+            dict: A response dictionary whose data is the list returned by `predict_embeddings`.
+        """
+        final_response = {
+            "success": False,
+            "message": "Failed to classify criteria",
+            "data": None
+        }
+        try:
+            if not self.is_fitted:
+                final_response["message"] = "Criteria classifier is not fitted"
+                return final_response
+            if not texts:
+                final_response.update({"success": True, "message": "No criteria to classify", "data": []})
+                return final_response
+
+            embedding_response = generate_batch_embeddings_from_azure_client(texts)
+            if embedding_response["success"] is False:
+                final_response["message"] = embedding_response["message"]
+                return final_response
+
+            final_response["data"] = self.predict_embeddings(embedding_response["data"])
+            final_response["success"] = True
+            final_response["message"] = "Successfully classified criteria"
+        except Exception as e:
+            final_response["message"] = f"Failed to classify criteria: {e}"
+
+        return final_response
+
+    def save(self, path: str) -> None:
+        # Written through the file, np.savez would append .npz to a path without it
+        with open(path, "wb") as f:
+            np.savez(f, centroids=self.centroids, categories=np.array(self.categories))
+
+    def load(self, path: str) -> None:
+        with np.load(path) as data:
+            self.centroids = data["centroids"]
+            self.categories = [str(category) for category in data["categories"]]
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+_classifier_failures = 0
+_classifier_retry_at = 0.0
+
+
+def _record_classifier_failure() -> None:
+    global _classifier_failures, _classifier_retry_at
+    _classifier_failures += 1
+    retry_seconds = min(CLASSIFIER_RETRY_SECONDS * 2 ** (_classifier_failures - 1), CLASSIFIER_MAX_RETRY_SECONDS)
+    _classifier_retry_at = time.monotonic() + retry_seconds
+    print(f"Criteria classifier unavailable, retrying in {retry_seconds:g}s")
+
+
+def get_criteria_category_classifier():
+    """
+    Returns the shared classifier, loading the centroids from CRITERIA_CENTROIDS_PATH or building them
+    from historical jobs on first use. Returns None if no centroids can be built, without trying again
+    until CRITERIA_CLASSIFIER_RETRY_SECONDS (doubled after every further failure) have passed.
+    """
+    global _classifier, _classifier_failures
+    if _classifier is not None:
+        return _classifier
+    if time.monotonic() < _classifier_retry_at:
+        return None
+
+    with _classifier_lock:
+        if _classifier is not None:
+            return _classifier
+        if time.monotonic() < _classifier_retry_at:
+            return None
+
+        classifier = CriteriaCategoryClassifier()
+        if CENTROIDS_PATH and os.path.exists(CENTROIDS_PATH):
+            classifier.load(CENTROIDS_PATH)
+            # Centroids cached for another embedding size are rebuilt
+            if classifier.centroids.shape[1] != EMBEDDING_DIMENSIONS:
+                print(f"Criteria centroids in {CENTROIDS_PATH} have {classifier.centroids.shape[1]} dimensions, rebuilding")
+                classifier = CriteriaCategoryClassifier()
+        if not classifier.is_fitted:
+            labelled_criteria_response = fetch_labelled_criteria(limit=MAX_LABELLED_JOBS)
+            if labelled_criteria_response["success"] is False:
+                print(labelled_criteria_response["message"])
+                _record_classifier_failure()
+                return None
+            fit_response = classifier.fit(labelled_criteria_response["data"])
+            print(fit_response["message"])
+            if fit_response["success"] is False:
+                _record_classifier_failure()
+                return None
+            if CENTROIDS_PATH:
+                classifier.save(CENTROIDS_PATH)
+
+        _classifier = classifier
+        _classifier_failures = 0
+        return _classifier
@@ -0,0 +1,330 @@
+import os
+import re
+from typing import List, Dict, NamedTuple, Optional
+import numpy as np
+
+
+class MetricInterval(NamedTuple):
+    """A canonical eligibility range for a lab or anthropometric metric, HbA1c in % and BMI in kg/m2."""
+    metric: str
+    low: Optional[float] = None
+    high: Optional[float] = None
+    low_inclusive: bool = True
+    high_inclusive: bool = True
+
+
+_metric_names = {
+    "HbA1c": r"hb\s*a1c|hemoglobin\s+a1c|haemoglobin\s+a1c|glyc(?:ated|osylated)\s+ha?emoglobin|a1c",
+    "BMI": r"bmi|body\s+mass\s+index"
+}
+# Plausible values in canonical units, anything outside is a different number (age, duration, dose)
+_plausible_ranges = {"HbA1c": (3.0, 20.0), "BMI": (10.0, 100.0)}
+
+# (lower bound?, strict?) for comparators written as "metric <comparator> value"
+_comparators = {
+    "≥": (True, False), ">=": (True, False), "=>": (True, False), "≧": (True, False),
+    ">": (True, True), "greater than or equal to": (True, False), "equal to or greater than": (True, False),
+    "greater than": (True, True), "higher than": (True, True), "more than": (True, True), "exceeding": (True, True),
+    "above": (True, True), "over": (True, True), "at least": (True, False), "no less than": (True, False),
+    "not less than": (True, False), "minimum of": (True, False), "minimum": (True, False),
+    "≤": (False, False), "<=": (False, False), "=<": (False, False), "≦": (False, False),
+    "<": (False, True), "less than or equal to": (False, False), "equal to or less than": (False, False),
+    "less than": (False, True), "lower than": (False, True), "below": (False, True), "under": (False, True),
+    "at most": (False, False), "up to": (False, False), "no more than": (False, False),
+    "not more than": (False, False), "not exceeding": (False, False), "maximum of": (False, False),
+    "maximum": (False, False)
+}
+_directions = {"or higher": True, "or more": True, "or above": True, "or greater": True, "or over": True,
+               "or lower": False, "or less": False, "or below": False, "or under": False}
+
+_symbolic_comparators = "|".join(
+    re.escape(comparator) for comparator in sorted(_comparators, key=len, reverse=True) if not comparator[0].isalpha()
+)
+_word_comparators = "|".join(
+    re.escape(comparator) for comparator in sorted(_comparators, key=len, reverse=True) if comparator[0].isalpha()
+)
+_direction_alternatives = "|".join(re.escape(direction) for direction in _directions)
+_token_pattern = re.compile(
+    rf"(?P<metric>{'|'.join(f'(?:{pattern})' for pattern in _metric_names.values())})\b"
+    rf"|(?P<direction>{_direction_alternatives})\b"
+    rf"|(?P<comparator>{_symbolic_comparators}|(?:{_word_comparators})\b)"
+    r"|(?P<number>\d+(?:\.\d+)?)\s*(?P<unit>%|percent\b|mmol\s*/\s*mol\b|kg\s*/\s*m\s*(?:\^?\s*2|²)|years?\b|yrs?\b|months?\b"
+    r"|weeks?\b|days?\b|kg\b|mg\b|g\s*/\s*dl\b|mmol\s*/\s*l\b|mg\s*/\s*dl\b)?"
+    r"|(?P<separator>between\b|and\b|to\b|-|–|—|,)"
+    r"|(?P<word>[a-z]+)",
+    re.IGNORECASE
+)
+# "7.0% (53 mmol/mol)" restates the same limit in another unit
+_restated_unit_pattern = re.compile(r"\(\s*[\d.\s\-–≤≥<>=,]*(?:to|and)?[\d.\s]*(?:mmol\s*/\s*mol|%)\s*\)", re.IGNORECASE)
+_clause_pattern = re.compile(r"[;\n]|\.(?!\d)")
+_metric_patterns = {metric: re.compile(pattern, re.IGNORECASE) for metric, pattern in _metric_names.items()}
+
+# Send trials whose HbA1c/BMI limits no rule understood to `values_count_prompt`
+METRIC_RANGES_LLM_FALLBACK = os.getenv("METRIC_RANGES_LLM_FALLBACK", "true").lower() == "true"
+
+# Filler words allowed between a metric and its limit, e.g. "HbA1c value at screening of"
+MAX_FILLER_WORDS = 4
+
+
+def _tokenize(clause: str) -> list:
+    tokens = []
+    for match in _token_pattern.finditer(clause):
+        kind = match.lastgroup if match.lastgroup != "unit" else "number"
+        if kind == "metric":
+            value = next(metric for metric, pattern in _metric_patterns.items() if pattern.fullmatch(match.group("metric")))
+        elif kind == "number":
+            value = (float(match.group("number")), (match.group("unit") or "").lower().replace(" ", ""))
+        else:
+            value = " ".join(match.group(kind).lower().split())
+        tokens.append((kind, value))
+    return tokens
+
+
+def _to_canonical(metric: str, number: tuple) -> Optional[float]:
+    """Converts a (value, unit) token into the canonical unit, or None if it is not a value of the metric."""
+    value, unit = number
+    if unit and unit not in ("%", "percent", "mmol/mol") and not unit.startswith("kg/m"):
+        return None
+    if metric == "HbA1c" and (unit == "mmol/mol" or (not unit and value > 20)):
+        # IFCC (mmol/mol) to NGSP (%)
+        value = round(value / 10.929 + 2.15, 1)
+    low, high = _plausible_ranges[metric]
+    return value if low <= value <= high else None
+
+
+def _parse_right_side(metric: str, tokens: list, start: int) -> list:
+    """Parses "metric [fillers] <limit(s)>" starting right after the metric token. Returns (is_low, value, strict)."""
+    index = start
+    fillers = 0
+    while index < len(tokens) and tokens[index][0] in ("word", "separator") and tokens[index][1] != "between":
+        if tokens[index][0] == "word":
+            fillers += 1
+        if fillers > MAX_FILLER_WORDS:
+            return []
+        index += 1
+    if index >= len(tokens):
+        return []
+
+    kind, value = tokens[index]
+    bounds = []
+    if value == "between" or kind == "number":
+        # "between X and Y", "X - Y", "X to Y", "X or higher"
+        if value == "between":
+            index += 1
+        if index >= len(tokens) or tokens[index][0] != "number":
+            return []
+        first = _to_canonical(metric, tokens[index][1])
+        if first is None:
+            return []
+        if index + 2 < len(tokens) and tokens[index + 1][0] == "separator" and tokens[index + 2][0] == "number":
+            second = _to_canonical(metric, tokens[index + 2][1])
+            if second is not None and second > first:
+                return [(True, first, False), (False, second, False)]
+        if index + 1 < len(tokens) and tokens[index + 1][0] == "direction":
+            return [(_directions[tokens[index + 1][1]], first, False)]
+        return []
+
+    # "≥ X", "≥ X and ≤ Y", "greater than X, less than Y"
+    while index + 1 < len(tokens) and tokens[index][0] == "comparator" and tokens[index + 1][0] == "number":
+        limit = _to_canonical(metric, tokens[index + 1][1])
+        if limit is None:
+            break
+        is_low, strict = _comparators[tokens[index][1]]
+        bounds.append((is_low, limit, strict))
+        index += 2
+        if index < len(tokens) and tokens[index][1] in ("and", ","):
+            index += 1
+    return bounds
+
+
+def _parse_left_side(metric: str, tokens: list, end: int) -> list:
+    """Parses "X <comparator> metric" ending right before the metric token."""
+    if end < 2 or tokens[end - 1][0] != "comparator" or tokens[end - 2][0] != "number":
+        return []
+    limit = _to_canonical(metric, tokens[end - 2][1])
+    comparator = tokens[end - 1][1]
+    if limit is None or comparator not in ("<", "<=", "=<", "≤", "≦", ">", ">=", "=>", "≥", "≧"):
+        return []
+    # The comparator reads the other way round: "7.5 ≤ HbA1c" is a lower bound, "10 > HbA1c" an upper bound
+    is_low, strict = _comparators[comparator]
+    return [(not is_low, limit, strict)]
+
+
+def extract_metric_intervals(text: str) -> List[MetricInterval]:
+    """
+    Extracts HbA1c and BMI eligibility ranges from free eligibility text.
+
+    Understands symbolic and written comparators ("≥ 7%", "at least 27 kg/m2", "7.5% ≤ HbA1c ≤ 10.0%"),
+    "between X and Y", "X - Y", "X or higher" and HbA1c in mmol/mol, which is converted to %.
+
+    Args:
+        text (str): Eligibility criteria text.
+
+    Returns:
+        List[MetricInterval]: The unique intervals found, in order of appearance.
+    """
+    text = _restated_unit_pattern.sub(" ", text.replace("\\", ""))
+    intervals = []
+    for clause in _clause_pattern.split(text):
+        tokens = _tokenize(" ".join(clause.split()))
+        for index, (kind, metric) in enumerate(tokens):
+            if kind != "metric":
+                continue
+            bounds = _parse_left_side(metric, tokens, index) + _parse_right_side(metric, tokens, index + 1)
+            low = next(((value, strict) for is_low, value, strict in bounds if is_low), None)
+            high = next(((value, strict) for is_low, value, strict in bounds if not is_low), None)
+            if low is None and high is None:
+                continue
+            if low is not None and high is not None and low[0] >= high[0]:
+                continue
+            interval = canonical_interval(MetricInterval(
+                metric=metric,
+                low=low[0] if low else None,
+                high=high[0] if high else None,
+                low_inclusive=not low or not low[1],
+                high_inclusive=not high or not high[1]
+            ))
+            if interval not in intervals:
+                intervals.append(interval)
+    return intervals
+
+
+def canonical_interval(interval: MetricInterval) -> MetricInterval:
+    """
+    Normalizes an interval like `values_count_prompt`: ranges with both bounds are not distinguished by
+    strictness, and a strict one-sided limit moves by 0.5 ("greater than 7.0" is "7.5 - X").
+    """
+    if interval.low is not None and interval.high is not None:
+        return interval._replace(low_inclusive=True, high_inclusive=True)
+    if interval.low is not None and not interval.low_inclusive:
+        return interval._replace(low=interval.low + 0.5, low_inclusive=True)
+    if interval.high is not None and not interval.high_inclusive:
+        return interval._replace(high=interval.high - 0.5, high_inclusive=True)
+    return interval
+
+
+def format_metric_interval(interval: MetricInterval) -> str:
+    """Renders an interval in the `values_count_prompt` format: "HbA1c 7 - 10", "BMI 30 - X" or "HbA1c X - 9.5"."""
+    interval = canonical_interval(interval)
+    low = "X" if interval.low is None else f"{interval.low:g}"
+    high = "X" if interval.high is None else f"{interval.high:g}"
+    return f"{interval.metric} {low} - {high}"
+
+
+_value_pattern = re.compile(
+    r"^\s*(?P<metric>hba1c|bmi)\s*(?:(?P<low>\d+(?:\.\d+)?|x)\s*-\s*(?P<high>\d+(?:\.\d+)?|x)"
+    r"|(?P<comparator>>=|<=|>|<)\s*(?P<limit>\d+(?:\.\d+)?))\s*%?\s*$",
+    re.IGNORECASE
+)
+
+
+def parse_metric_value(value: str) -> Optional[MetricInterval]:
+    """
+    Parses a rendered range ("HbA1c 7.5 - 10", "BMI X - 44.5", or "BMI >= 30" as rendered before) back into
+    a canonical interval.
+
+    Returns None for values in any other format.
+    """
+    match = _value_pattern.match(value)
+    if not match:
+        return None
+    metric = "HbA1c" if match.group("metric").lower() == "hba1c" else "BMI"
+    if match.group("comparator"):
+        limit = float(match.group("limit"))
+        comparator = match.group("comparator")
+        if comparator.startswith(">"):
+            return canonical_interval(MetricInterval(metric, low=limit, low_inclusive=comparator == ">="))
+        return canonical_interval(MetricInterval(metric, high=limit, high_inclusive=comparator == "<="))
+    low = None if match.group("low").lower() == "x" else float(match.group("low"))
+    high = None if match.group("high").lower() == "x" else float(match.group("high"))
+    if low is None and high is None:
+        return None
+    return MetricInterval(metric, low=low, high=high)
+
+
+def extract_metric_ranges(documents: list) -> dict:
+    """
+    Extracts and counts HbA1c and BMI ranges across trials, the rule-based counterpart of `values_count_prompt`.
+
+    Args:
+        documents (list): Trial documents with "nctId" and "document" -> "inclusionCriteria".
+
+    Returns:
+        dict: A dictionary containing:
+            - response (list): [{"value", "count", "source", "interval"}] entries, one per unique interval.
+            - unparsed (list): [{"nctId", "inclusionCriteria"}] for trials that mention HbA1c or BMI in a way
+              no rule understood, to be sent to the LLM.
+    """
+    ranges = {}
+    unparsed = []
+    for document in documents:
+        inclusion_criteria = f"{document['document'].get('inclusionCriteria') or ''}"
+        intervals = extract_metric_intervals(inclusion_criteria)
+        found_metrics = {interval.metric for interval in intervals}
+        mentioned_metrics = {metric for metric, pattern in _metric_patterns.items() if pattern.search(inclusion_criteria)}
+        if mentioned_metrics - found_metrics:
+            unparsed.append({"nctId": document["nctId"], "inclusionCriteria": inclusion_criteria})
+
+        for interval in intervals:
+            entry = ranges.setdefault(interval, {"value": format_metric_interval(interval), "count": 0,
+                                                 "source": [], "interval": interval._asdict()})
+            if document["nctId"] not in entry["source"]:
+                entry["source"].append(document["nctId"])
+                entry["count"] += 1
+
+    return {"response": list(ranges.values()), "unparsed": unparsed}
+
+
+def merge_metric_ranges(data: List[Dict]) -> List[Dict]:
+    """
+    Merges extracted ranges from several batches by their interval instead of their display string.
+
+    Entries without an "interval" (LLM fallback output) are parsed from their "value"; values that cannot be
+    parsed are merged by their string as before.
+
+    Args:
+        data (List[Dict]): Dictionaries with 'value', 'count', 'source' and optionally 'interval' keys.
+
+    Returns:
+        List[Dict]: Merged [{"value", "count", "source"}] entries.
+    """
+    intervals = []
+    interval_entries = []
+    string_entries = {}
+    for item in data:
+        interval = canonical_interval(MetricInterval(**item["interval"])) if item.get("interval") \
+            else parse_metric_value(item["value"])
+        if interval is None:
+            string_entries.setdefault(item["value"], []).extend(item["source"])
+        else:
+            intervals.append(interval)
+            interval_entries.append(item)
+
+    merged = []
+    if intervals:
+        # One row per interval, open bounds as infinities, grouped in one vectorized pass
+        rows = np.array([
+            [interval.metric == "BMI",
+             -np.inf if interval.low is None else interval.low,
+             np.inf if interval.high is None else interval.high,
+             interval.low_inclusive, interval.high_inclusive]
+            for interval in intervals
+        ], dtype=np.float64)
+        _, first_indices, group_ids = np.unique(rows, axis=0, return_index=True, return_inverse=True)
+        group_ids = group_ids.reshape(-1)
+        # Rows sorted by group (stable, so sources keep their input order), split at the group boundaries
+        order = np.argsort(group_ids, kind="stable")
+        boundaries = np.flatnonzero(np.diff(group_ids[order])) + 1
+        groups = {int(group_ids[indices[0]]): indices for indices in np.split(order, boundaries)}
+        for group in np.argsort(first_indices, kind="stable"):
+            sources = {}
+            for index in groups[int(group)]:
+                sources.update(dict.fromkeys(interval_entries[index]["source"]))
+            merged.append({"value": format_metric_interval(intervals[first_indices[group]]), "count": len(sources),
+                           "source": list(sources)})
+
+    for value, sources in string_entries.items():
+        unique_sources = list(dict.fromkeys(sources))
+        merged.append({"value": value, "count": len(unique_sources), "source": unique_sources})
+
+    return merged
@@ -1,5 +1,38 @@
 from database.document_retrieval.fetch_preprocessed_trial_document_with_nct_id import fetch_preprocessed_trial_document_with_nct_id
+from utils.metrics import timed_stage
+
+
+def extract_trial_filters(preprocessed_trial_document: dict) -> dict:
+    """
+    Extracts the filter fields of a trial from its preprocessed (ClinicalTrials.gov) document.
+
+    Args:
+        preprocessed_trial_document (dict): The preprocessed trial document with a `protocolSection`.
+
+    Returns:
+        dict: The trial's locations, phases, enrollmentCount, startDate, endDate and sponsorType.
+    """
+    protocol_section = preprocessed_trial_document["protocolSection"]
+    design_module = protocol_section.get("designModule", {})
+    date_info = protocol_section.get("statusModule", {})
+
+    return {
+        # fetch country for each document
+        "locations": list({location["country"] for location in
+                           protocol_section.get("contactsLocationsModule", {}).get("locations", [])}),
+        # fetch phase for document
+        "phases": design_module.get("phases", ["Unknown"]),
+        # fetch trail participant count protocolSection.designModule.enrollmentInfo.count
+        "enrollmentCount": design_module.get("enrollmentInfo", {}).get("count", 0),
+        # fetch trial start date and end date
+        "startDate": date_info.get("startDateStruct", {}).get("date", None),
+        "endDate": date_info.get("completionDateStruct", {}).get("date", None),
+        # Fetch Sponsor Type
+        "sponsorType": protocol_section.get("sponsorCollaboratorsModule", {}).get("leadSponsor", {}).get("class", "Unknown")
+    }
+
 
+@timed_stage("filter_enrichment")
 def fetch_trial_filters(trial_documents: list) -> dict:
     final_response = {
         "success": False,
@@ -19,36 +52,7 @@ def fetch_trial_filters(trial_documents: list) -> dict:
             if preprocessed_trial_document_response["success"] is False:
                 continue
             else:
-
-                preprocessed_trial_document = preprocessed_trial_document_response["data"]
-
-                # fetch country for each document
-                trial_locations = preprocessed_trial_document["protocolSection"].get("contactsLocationsModule", {}).get("locations", [])
-                countries = set()
-                for location in trial_locations:
-                    countries.add(location["country"])
-                item["locations"] = list(countries)
-
-                # fetch phase for document
-                phases_info = preprocessed_trial_document["protocolSection"].get("designModule",{}).get("phases", ["Unknown"])
-                trial_phases = phases_info
-                item['phases'] = trial_phases
-
-                # fetch trail participant count protocolSection.designModule.enrollmentInfo.count
-                enrollment_info = preprocessed_trial_document["protocolSection"].get("designModule",{}).get("enrollmentInfo",{})
-                enrollment = enrollment_info.get("count", 0)
-                item['enrollmentCount'] = enrollment
-
-                # fetch trial start date and end date
-                date_info = preprocessed_trial_document["protocolSection"].get("statusModule",{})
-                start_date = date_info.get("startDateStruct", {}).get("date", None)
-                end_date = date_info.get("completionDateStruct", {}).get("date", None)
-                item['startDate'] = start_date
-                item['endDate'] = end_date
-
-                # Fetch Sponsor Type
-                sponsorType = preprocessed_trial_document["protocolSection"].get("sponsorCollaboratorsModule",{}).get("leadSponsor", {}).get("class", "Unknown")
-                item['sponsorType'] = sponsorType
+                item.update(extract_trial_filters(preprocessed_trial_document_response["data"]))
 
         final_response["success"] = True
         final_response["data"] = trial_documents
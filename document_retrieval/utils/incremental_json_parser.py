@@ -0,0 +1,98 @@
+import json
+
+
+class IncrementalJSONArrayParser:
+    """
+    Incrementally parses a streamed JSON object of the form {"key": [{...}, {...}], ...}.
+
+    Chunks are fed as they arrive and every object inside a top-level array is returned as soon as its closing
+    brace has been received, together with the key of the array it belongs to. Anything after the last complete
+    object (a truncated response) is never returned, but the objects completed before it are kept.
+
+    Example:
+        parser = IncrementalJSONArrayParser()
+        for chunk in chunks:
+            for key, item in parser.feed(chunk):
+                ...
+    """
+
+    def __init__(self):
+        self.buffer = []
+        self.stack = []
+        self.in_string = False
+        self.escaped = False
+        self.started = False
+        self.string_start = None
+        self.last_key = None
+        self.current_array_key = None
+        self.item_start = None
+        self.items_parsed = 0
+        self.items_failed = 0
+
+    @property
+    def complete(self) -> bool:
+        """True once the top-level object has been closed."""
+        return self.started and not self.stack
+
+    def feed(self, chunk: str) -> list:
+        """
+        Consumes the next chunk of the response.
+
+        Args:
+            chunk (str): The next piece of streamed text.
+
+        Returns:
+            list: (array key, parsed item) tuples for every item completed within this chunk.
+        """
+        completed_items = []
+        offset = len(self.buffer)
+        self.buffer.extend(chunk)
+
+        for position in range(offset, len(self.buffer)):
+            char = self.buffer[position]
+
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.stack == ["{"]:
+                        # A string directly inside the top-level object, the last one before "[" is the array key
+                        self.last_key = "".join(self.buffer[self.string_start + 1:position])
+                continue
+
+            if not self.started:
+                # Skip any text (e.g. a ```json fence) before the top-level object
+                if char == "{":
+                    self.started = True
+                    self.stack.append("{")
+                continue
+            if self.complete:
+                continue
+
+            if char == '"':
+                self.in_string = True
+                self.string_start = position
+            elif char in "{[":
+                if char == "[" and self.stack == ["{"]:
+                    self.current_array_key = self.last_key
+                elif char == "{" and self.stack == ["{", "["]:
+                    self.item_start = position
+                self.stack.append(char)
+            elif char in "}]":
+                if not self.stack:
+                    continue
+                self.stack.pop()
+                if char == "}" and self.stack == ["{", "["] and self.item_start is not None:
+                    item_text = "".join(self.buffer[self.item_start:position + 1])
+                    self.item_start = None
+                    try:
+                        completed_items.append((self.current_array_key, json.loads(item_text)))
+                        self.items_parsed += 1
+                    except ValueError as e:
+                        self.items_failed += 1
+                        print(f"Skipping unparseable streamed item: {e}")
+
+        return completed_items
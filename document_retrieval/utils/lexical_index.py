@@ -0,0 +1,270 @@
+"""
+In-process BM25 index over the processed trial sections, fused with the Pinecone results in `process_criteria`.
+
+Eligibility text is full of exact tokens ("HbA1c", "eGFR", "metformin", "BMI ≥ 30") that dense embeddings only
+match loosely. The index keeps one inverted index per section with compact posting lists: for every term a
+slice of a uint32 array of document ids and a uint16 array of term frequencies, addressed by a per-term offset.
+It is built from MongoDB at startup, or loaded from the LEXICAL_INDEX_PATH snapshot.
+
+Usage:
+    python -m document_retrieval.utils.lexical_index [--path lexical_index.npz]
+    python -m document_retrieval.utils.lexical_index --query "HbA1c 7.5 to 10%" --module eligibilityModule
+"""
+import os
+import re
+import math
+import argparse
+import threading
+from array import array
+from collections import Counter
+
+import numpy as np
+
+from database.document_retrieval.fetch_processed_trial_sections import fetch_processed_trial_sections
+
+# Search the lexical index next to Pinecone and fuse both rankings (default true)
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "true").lower() == "true"
+# Optional .npz snapshot the index is loaded from and saved to, so it is not rebuilt on every start
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH")
+# Trials taken from the lexical index per query
+LEXICAL_TOP_K = int(os.getenv("LEXICAL_TOP_K", "20"))
+# Reciprocal-rank fusion constant, larger values flatten the advantage of the top ranks
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Fused trials kept per query for filtering and weighted scoring
+HYBRID_MAX_CANDIDATES = int(os.getenv("HYBRID_MAX_CANDIDATES", "15"))
+
+# Pinecone modules and the processed document sections they cover
+LEXICAL_SECTIONS = {
+    "identificationModule": ["officialTitle"],
+    "conditionsModule": ["conditions"],
+    "eligibilityModule": ["inclusionCriteria", "exclusionCriteria"],
+    "outcomesModule": ["primaryOutcomes", "secondaryOutcomes"],
+}
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?|[≥≤<>]=?")
+# Comparison operators are kept as terms, "BMI ≥ 30" and "BMI >= 30" index the same
+_OPERATORS = {"≥": "ge", ">=": "ge", "≤": "le", "<=": "le", ">": "gt", "<": "lt", "≥=": "ge", "≤=": "le"}
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it of on or that the their this to was were with "
+    "who will within".split()
+)
+_MAX_TOKEN_LENGTH = 40
+
+
+def tokenize(text: str) -> list:
+    """Lower-cased word, number and comparison operator tokens of a text, without stopwords."""
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(text.lower()):
+        token = _OPERATORS.get(token, token)
+        if token not in _STOPWORDS and len(token) <= _MAX_TOKEN_LENGTH:
+            tokens.append(token)
+    return tokens
+
+
+def _section_text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple)):
+        return " ".join(_section_text(item) for item in value)
+    return str(value)
+
+
+class BM25Index:
+    """Okapi BM25 over several sections of the same trials, sharing one vocabulary."""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.nct_ids = []
+        self.vocabulary = {}
+        self.sections = {}
+
+    def fit(self, documents: list, fields: list) -> "BM25Index":
+        """
+        Builds the posting lists of the given sections.
+
+        Args:
+            documents (list): {"nctId", <field>: text} dictionaries.
+            fields (list): The sections to index.
+        """
+        self.nct_ids = [document["nctId"] for document in documents]
+        self.vocabulary = {}
+        postings = {}
+        for field in fields:
+            term_ids, doc_ids, term_freqs = array("I"), array("I"), array("H")
+            lengths = np.zeros(len(documents), dtype=np.float32)
+            for doc_id, document in enumerate(documents):
+                tokens = tokenize(_section_text(document.get(field)))
+                lengths[doc_id] = len(tokens)
+                for term, term_freq in Counter(tokens).items():
+                    term_ids.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                    doc_ids.append(doc_id)
+                    term_freqs.append(min(term_freq, 65535))
+            postings[field] = (term_ids, doc_ids, term_freqs, lengths)
+
+        for field, (term_ids, doc_ids, term_freqs, lengths) in postings.items():
+            term_ids = np.frombuffer(term_ids, dtype=np.uint32)
+            # Stable sort by term keeps the document ids of every posting list ascending
+            order = np.argsort(term_ids, kind="stable")
+            offsets = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(term_ids, minlength=len(self.vocabulary)), out=offsets[1:])
+            self.sections[field] = {
+                "offsets": offsets,
+                "doc_ids": np.frombuffer(doc_ids, dtype=np.uint32)[order],
+                "term_freqs": np.frombuffer(term_freqs, dtype=np.uint16)[order],
+                "lengths": lengths,
+                "average_length": max(float(lengths.mean()) if len(lengths) else 0.0, 1.0),
+            }
+        return self
+
+    def __len__(self) -> int:
+        return len(self.nct_ids)
+
+    def search(self, query: str, fields: list = None, top_k: int = LEXICAL_TOP_K) -> list:
+        """
+        Scores the trials against a query, summing the BM25 scores of the given sections.
+
+        Args:
+            query (str): The query text.
+            fields (list, optional): The sections to search. Defaults to all indexed sections.
+            top_k (int): Number of trials to return.
+
+        Returns:
+            list: (nctId, score) tuples, best first. Trials without any query term are left out.
+        """
+        query_terms = Counter(self.vocabulary[token] for token in tokenize(query) if token in self.vocabulary)
+        if not query_terms or not self.nct_ids:
+            return []
+
+        trials = len(self.nct_ids)
+        scores = np.zeros(trials, dtype=np.float32)
+        for field in fields or self.sections:
+            section = self.sections.get(field)
+            if section is None:
+                continue
+            offsets, doc_ids, term_freqs = section["offsets"], section["doc_ids"], section["term_freqs"]
+            length_norm = self.k1 * (1 - self.b + self.b * section["lengths"] / section["average_length"])
+            for term_id, query_freq in query_terms.items():
+                start, end = offsets[term_id], offsets[term_id + 1]
+                if start == end:
+                    continue
+                documents = doc_ids[start:end]
+                term_freq = term_freqs[start:end].astype(np.float32)
+                idf = math.log(1 + (trials - (end - start) + 0.5) / ((end - start) + 0.5))
+                # Document ids are unique within a posting list, so the fancy-indexed add is safe
+                scores[documents] += query_freq * idf * term_freq * (self.k1 + 1) / (term_freq + length_norm[documents])
+
+        matched = np.flatnonzero(scores)
+        if len(matched) > top_k:
+            matched = matched[np.argpartition(-scores[matched], top_k - 1)[:top_k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(self.nct_ids[doc_id], float(scores[doc_id])) for doc_id in matched]
+
+    def save(self, path: str) -> None:
+        arrays = {
+            "nct_ids": np.array(self.nct_ids),
+            "terms": np.array(sorted(self.vocabulary, key=self.vocabulary.get)),
+            "fields": np.array(list(self.sections)),
+            "parameters": np.array([self.k1, self.b]),
+        }
+        for field, section in self.sections.items():
+            for name in ("offsets", "doc_ids", "term_freqs", "lengths"):
+                arrays[f"{field}__{name}"] = section[name]
+        # Written through a file object, so the snapshot is saved under the exact path even without .npz
+        with open(path, "wb") as f:
+            np.savez(f, **arrays)
+
+    def load(self, path: str) -> None:
+        with np.load(path) as data:
+            self.nct_ids = data["nct_ids"].tolist()
+            self.vocabulary = {term: term_id for term_id, term in enumerate(data["terms"].tolist())}
+            self.k1, self.b = (float(value) for value in data["parameters"])
+            self.sections = {}
+            for field in data["fields"].tolist():
+                section = {name: data[f"{field}__{name}"] for name in ("offsets", "doc_ids", "term_freqs", "lengths")}
+                section["average_length"] = max(float(section["lengths"].mean()) if len(section["lengths"]) else 0.0, 1.0)
+                self.sections[field] = section
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = RRF_K) -> list:
+    """
+    Fuses ranked lists of ids by reciprocal rank: every list adds 1 / (k + rank) to the ids it contains.
+
+    Args:
+        rankings (list): Lists of ids, best first.
+        k (int): The fusion constant.
+
+    Returns:
+        list: (id, fused score) tuples, best first. Ties keep the order in which the ids were first seen.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            fused[item_id] = fused.get(item_id, 0.0) + 1 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+def build_lexical_index() -> BM25Index:
+    """Builds the index over every section in LEXICAL_SECTIONS from the processed trial documents."""
+    fields = [field for section_fields in LEXICAL_SECTIONS.values() for field in section_fields]
+    documents_response = fetch_processed_trial_sections(fields)
+    if documents_response["success"] is False:
+        raise RuntimeError(documents_response["message"])
+    return BM25Index().fit(documents_response["data"], fields)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_lexical_index():
+    """
+    Returns the shared lexical index, loading it from LEXICAL_INDEX_PATH or building it from the processed
+    trials on first use. Returns None if hybrid retrieval is disabled or the index cannot be built.
+    """
+    global _index
+    if not HYBRID_RETRIEVAL:
+        return None
+    if _index is not None:
+        return _index
+
+    with _index_lock:
+        if _index is not None:
+            return _index
+
+        index = BM25Index()
+        if LEXICAL_INDEX_PATH and os.path.exists(LEXICAL_INDEX_PATH):
+            index.load(LEXICAL_INDEX_PATH)
+        else:
+            try:
+                index = build_lexical_index()
+            except Exception as e:
+                print(f"Failed to build lexical index: {e}")
+                return None
+            if LEXICAL_INDEX_PATH:
+                index.save(LEXICAL_INDEX_PATH)
+        print(f"Loaded lexical index of {len(index)} trials and {len(index.vocabulary)} terms")
+
+        _index = index
+        return _index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default=LEXICAL_INDEX_PATH, help="Snapshot to write, defaults to LEXICAL_INDEX_PATH")
+    parser.add_argument("--query", help="Search the rebuilt index")
+    parser.add_argument("--module", choices=list(LEXICAL_SECTIONS), help="Pinecone module of the query")
+    args = parser.parse_args()
+
+    index = build_lexical_index()
+    print(f"Built lexical index of {len(index)} trials and {len(index.vocabulary)} terms")
+    if args.path:
+        index.save(args.path)
+        print(f"Saved {args.path}")
+    if args.query:
+        for nct_id, score in index.search(args.query, LEXICAL_SECTIONS.get(args.module)):
+            print(f"{nct_id}\t{score:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - declared in pyproject.toml, estimated from characters without it
+    tiktoken = None
+
+# gpt-4o family tokenizer
+TOKENIZER_ENCODING = "o200k_base"
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception as e:
+            print(f"Failed to load tokenizer {TOKENIZER_ENCODING}, using character estimate: {e}")
+    return _encoding
+
+
+def estimate_tokens(text) -> int:
+    """
+    Estimates the number of prompt tokens for the given text.
+
+    Uses the gpt-4o tokenizer and falls back to ~4 characters per token when it cannot be loaded.
+
+    Args:
+        text: The text (or any object, rendered with str()) to measure.
+
+    Returns:
+        int: Estimated token count.
+    """
+    text = text if isinstance(text, str) else f"{text}"
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def pack_trial_documents(similar_documents: list, token_budget: int, base_tokens: int = 0,
+                         max_documents_per_batch: int = 8) -> list:
+    """
+    Groups trial documents into drafting batches that fit into a prompt token budget.
+
+    Documents are packed greedily in the given order (highest similarity first), so the most relevant
+    trials end up together in the first batches. A document that does not fit into the budget on its own
+    is sent in a batch of its own.
+
+    Args:
+        similar_documents (list): Trial documents as prepared for `draft_eligibility_criteria`.
+        token_budget (int): Maximum prompt tokens per drafting call, including the fixed prompt overhead.
+        base_tokens (int): Tokens repeated in every call (system prompt, user criteria, rationale).
+        max_documents_per_batch (int): Upper bound on trials per call to keep the output within max_tokens.
+
+    Returns:
+        list: A list of batches, each a list of documents.
+    """
+    batches = []
+    current_batch = []
+    current_tokens = base_tokens
+
+    for document in similar_documents:
+        document_tokens = estimate_tokens(document)
+        batch_full = len(current_batch) >= max_documents_per_batch
+        if current_batch and (batch_full or current_tokens + document_tokens > token_budget):
+            batches.append(current_batch)
+            current_batch = []
+            current_tokens = base_tokens
+
+        current_batch.append(document)
+        current_tokens += document_tokens
+
+    if current_batch:
+        batches.append(current_batch)
+
+    return batches
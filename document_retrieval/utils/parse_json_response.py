@@ -0,0 +1,186 @@
+import re
+import json
+import threading
+from collections import defaultdict
+from utils.metrics import record_json_parse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - declared in pyproject.toml, the standard library parser is used without it
+    orjson = None
+
+_code_fence_pattern = re.compile(r"^\s*```(?:json|json_object)?\s*|\s*```\s*$", re.IGNORECASE)
+_trailing_comma_pattern = re.compile(r",\s*([}\]])")
+
+# Parse outcomes per schema: parsed (clean), repaired (parsed after a local repair), failed and rerequested
+_parse_stats = defaultdict(lambda: {"parsed": 0, "repaired": 0, "failed": 0, "rerequested": 0})
+_parse_stats_lock = threading.Lock()
+
+
+def record_parse_outcome(schema_name: str, outcome: str) -> None:
+    with _parse_stats_lock:
+        _parse_stats[schema_name][outcome] += 1
+    record_json_parse(schema_name, outcome)
+
+
+def get_json_parse_stats() -> dict:
+    """Returns the parse outcome counters per schema since the process started."""
+    with _parse_stats_lock:
+        return {schema_name: dict(stats) for schema_name, stats in _parse_stats.items()}
+
+
+def _loads(text: str):
+    return orjson.loads(text) if orjson is not None else json.loads(text)
+
+
+def _scan(text: str):
+    """
+    Returns the open brackets and string state at the end of `text`, and the positions after which the text
+    could be cut off and closed again (after each complete value inside an array or object).
+    """
+    stack = []
+    in_string = False
+    escaped = False
+    cut_points = []
+    for position, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append(char)
+        elif char in "}]":
+            if stack:
+                stack.pop()
+            cut_points.append((position + 1, list(stack)))
+        elif char == ",":
+            cut_points.append((position, list(stack)))
+    return stack, in_string, cut_points
+
+
+def _close(text: str, stack: list) -> str:
+    return text + "".join("}" if bracket == "{" else "]" for bracket in reversed(stack))
+
+
+def repair_json_text(text: str) -> str:
+    """
+    Repairs the usual defects of model JSON output without another request.
+
+    Removes code fences and text around the JSON object, trailing commas, and closes truncated output by
+    dropping the incomplete last value and closing all open strings, arrays and objects.
+
+    Args:
+        text (str): The raw model output.
+
+    Returns:
+        str: The repaired JSON text (which may still be invalid).
+    """
+    text = _code_fence_pattern.sub("", text.strip())
+    start = text.find("{")
+    if start == -1:
+        return text
+    text = text[start:]
+
+    end = text.rfind("}")
+    stack, in_string, cut_points = _scan(text)
+    if not stack and not in_string and end != -1:
+        # Complete object followed by extra text
+        return _trailing_comma_pattern.sub(r"\1", text[:end + 1])
+
+    # Truncated output: try to close it as it is, then cut back to earlier complete values
+    candidates = [_close(text + ('"' if in_string else ""), stack)]
+    candidates.extend(_close(text[:position], open_brackets) for position, open_brackets in reversed(cut_points))
+    for candidate in candidates[:50]:
+        candidate = _trailing_comma_pattern.sub(r"\1", candidate)
+        try:
+            _loads(candidate)
+            return candidate
+        except ValueError:
+            continue
+    return text
+
+
+def _validate(instance, schema: dict, path: str = "$") -> list:
+    """Checks an instance against the subset of JSON schema used in `response_schemas`. Returns error messages."""
+    expected_type = schema.get("type")
+    type_checks = {
+        "object": lambda value: isinstance(value, dict),
+        "array": lambda value: isinstance(value, list),
+        "string": lambda value: isinstance(value, str),
+        "integer": lambda value: isinstance(value, int) and not isinstance(value, bool),
+        "number": lambda value: isinstance(value, (int, float)) and not isinstance(value, bool),
+        "boolean": lambda value: isinstance(value, bool)
+    }
+    if expected_type in type_checks and not type_checks[expected_type](instance):
+        return [f"{path}: expected {expected_type}"]
+    if "enum" in schema and instance not in schema["enum"]:
+        return [f"{path}: {instance!r} is not one of the allowed values"]
+
+    errors = []
+    if expected_type == "object":
+        for key in schema.get("required", []):
+            if key not in instance:
+                errors.append(f"{path}: missing {key}")
+        for key, property_schema in schema.get("properties", {}).items():
+            if key in instance:
+                errors.extend(_validate(instance[key], property_schema, f"{path}.{key}"))
+    elif expected_type == "array" and "items" in schema:
+        for index, item in enumerate(instance):
+            errors.extend(_validate(item, schema["items"], f"{path}[{index}]"))
+    return errors
+
+
+def parse_json_response(content: str, schema: dict = None, schema_name: str = "unknown") -> dict:
+    """
+    Parses a model response as JSON, repairing it locally if needed, and validates it against a schema.
+
+    Args:
+        content (str): The raw message content of the model response.
+        schema (dict, optional): JSON schema the parsed response must follow.
+        schema_name (str): Name used for the parse outcome counters.
+
+    Returns:
+        dict: A response dictionary whose data is the parsed JSON.
+    """
+    final_response = {
+        "success": False,
+        "message": "Failed to parse JSON response",
+        "data": None
+    }
+    if content is None:
+        final_response["message"] = "Empty model response"
+        record_parse_outcome(schema_name, "failed")
+        return final_response
+
+    outcome = "parsed"
+    try:
+        data = _loads(content)
+    except ValueError:
+        outcome = "repaired"
+        try:
+            data = _loads(repair_json_text(content))
+        except ValueError as e:
+            final_response["message"] = f"Failed to parse JSON response: {e}"
+            record_parse_outcome(schema_name, "failed")
+            print(f"{final_response['message']} ({schema_name})")
+            return final_response
+
+    errors = _validate(data, schema) if schema else []
+    if errors:
+        final_response["message"] = f"JSON response does not match the {schema_name} schema: {'; '.join(errors[:5])}"
+        record_parse_outcome(schema_name, "failed")
+        print(final_response["message"])
+        return final_response
+
+    record_parse_outcome(schema_name, outcome)
+    if outcome == "repaired":
+        print(f"Repaired JSON response ({schema_name})")
+    final_response["success"] = True
+    final_response["message"] = "Successfully parsed JSON response"
+    final_response["data"] = data
+    return final_response
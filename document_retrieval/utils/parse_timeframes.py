@@ -0,0 +1,141 @@
+import re
+from collections import defaultdict
+
+_number_words = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9,
+    "ten": 10, "eleven": 11, "twelve": 12, "thirteen": 13, "fourteen": 14, "fifteen": 15, "sixteen": 16,
+    "seventeen": 17, "eighteen": 18, "nineteen": 19, "twenty": 20, "thirty": 30, "forty": 40, "fifty": 50,
+    "sixty": 60, "seventy": 70, "eighty": 80, "ninety": 90
+}
+
+_unit_aliases = {
+    "minute": "minute", "minutes": "minute", "min": "minute", "mins": "minute",
+    "hour": "hour", "hours": "hour", "hr": "hour", "hrs": "hour", "h": "hour",
+    "day": "day", "days": "day", "d": "day",
+    "week": "week", "weeks": "week", "wk": "week", "wks": "week", "w": "week",
+    "month": "month", "months": "month", "mo": "month", "mos": "month", "mon": "month",
+    "year": "year", "years": "year", "yr": "year", "yrs": "year", "y": "year"
+}
+
+_number = r"\d+(?:\.\d+)?"
+_unit = r"minutes?|mins?|hours?|hrs?|h|days?|d|weeks?|wks?|w|months?|mos?|mon|years?|yrs?|y"
+
+# Number words such as "six" or "twenty-four" are converted to digits before matching
+_number_word_pattern = re.compile(
+    r"\b((?:twenty|thirty|forty|fifty|sixty|seventy|eighty|ninety)(?:[\s-]+(?:one|two|three|four|five|six|seven|eight|nine))?"
+    r"|one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve|thirteen|fourteen|fifteen|sixteen"
+    r"|seventeen|eighteen|nineteen)\b",
+    re.IGNORECASE
+)
+# "Week 26", "Weeks 12, 24 and 52", "Weeks 4-12", "Day 1"
+_unit_first_pattern = re.compile(
+    rf"\b(?P<unit>{_unit})\.?\s*(?P<numbers>{_number}(?:\s*(?:,|and|&|or|/|to|-)\s*{_number}(?!\s*-?\s*(?:{_unit})\b))*)\b",
+    re.IGNORECASE
+)
+# "26 weeks", "13-week", "52 wks", "12/24 weeks"
+_number_first_pattern = re.compile(
+    rf"\b(?P<numbers>{_number}(?:\s*(?:,|and|&|or|/|to|-)\s*{_number})*)\s*-?\s*(?P<unit>{_unit})\b",
+    re.IGNORECASE
+)
+_numbers_pattern = re.compile(_number)
+
+
+def _replace_number_words(text: str) -> str:
+    def to_digits(match):
+        return str(sum(_number_words[word] for word in re.split(r"[\s-]+", match.group(0).lower())))
+    return _number_word_pattern.sub(to_digits, text)
+
+
+def normalize_duration(value: float, unit: str):
+    """
+    Converts a duration into the canonical "week N" / "day N" style used for trial timelines.
+
+    Days that are whole weeks, months that are whole weeks (multiples of 3 months) and years become weeks,
+    everything else keeps its own unit. Returns None for zero durations such as "Week 0".
+
+    Args:
+        value (float): The numeric duration.
+        unit (str): A unit name or alias ("wk", "months", ...).
+
+    Returns:
+        str | None: The normalized duration.
+    """
+    unit = _unit_aliases[unit.lower()]
+    if value <= 0:
+        return None
+
+    if unit == "day" and value >= 7 and value % 7 == 0:
+        unit, value = "week", value / 7
+    elif unit == "month" and (value * 52 / 12) % 1 == 0:
+        unit, value = "week", value * 52 / 12
+    elif unit == "year":
+        unit, value = "week", value * 52
+
+    return f"{unit} {value:g}"
+
+
+def parse_timeframe_text(text: str) -> list:
+    """
+    Extracts all normalized durations from a free-text trial time frame.
+
+    Args:
+        text (str): A time frame such as "Baseline to Week 24" or "Day 1, 26 weeks".
+
+    Returns:
+        list: The unique normalized durations, in order of appearance.
+    """
+    text = _replace_number_words(text)
+    matches = []
+    consumed_numbers = set()
+    for pattern in (_unit_first_pattern, _number_first_pattern):
+        for match in pattern.finditer(text):
+            unit = match.group("unit")
+            # Single letter units are only accepted directly after a number ("26w", "3 d")
+            if len(unit) == 1 and pattern is _unit_first_pattern:
+                continue
+            for number in _numbers_pattern.finditer(match.group("numbers")):
+                position = match.start("numbers") + number.start()
+                # In "Week 12 and 24 months" the 12 belongs to "Week", not to "months"
+                if position in consumed_numbers:
+                    continue
+                consumed_numbers.add(position)
+                matches.append((position, normalize_duration(float(number.group(0)), unit)))
+
+    values = []
+    for _, value in sorted(matches, key=lambda item: item[0]):
+        if value and value not in values:
+            values.append(value)
+    return values
+
+
+def parse_timeframes(time_line_output: list) -> dict:
+    """
+    Counts normalized time frame values across trials, the rule-based counterpart of `timeframe_count_prompt`.
+
+    Args:
+        time_line_output (list): [{"nctId": str, "timeLine": [str]}] as built by the eligibility agent.
+
+    Returns:
+        dict: A dictionary containing:
+            - response (list): [{"value": str, "count": int, "source": [nctId]}] like the LLM output.
+            - unparsed (list): Entries of `time_line_output` with time frames that no rule understood.
+    """
+    sources = defaultdict(list)
+    unparsed = []
+
+    for entry in time_line_output:
+        time_line = [text for text in entry.get("timeLine", []) if text and text.strip()]
+        values = []
+        for text in time_line:
+            values.extend(value for value in parse_timeframe_text(text) if value not in values)
+
+        if time_line and not values:
+            unparsed.append(entry)
+        for value in values:
+            if entry["nctId"] not in sources[value]:
+                sources[value].append(entry["nctId"])
+
+    return {
+        "response": [{"value": value, "count": len(source), "source": source} for value, source in sources.items()],
+        "unparsed": unparsed
+    }
@@ -1,16 +1,32 @@
 from providers.openai.generate_embeddings import validate_document_similarity
 from providers.pinecone.similarity_search_service import query_pinecone_db_extended
+from document_retrieval.utils.lexical_index import (
+    HYBRID_MAX_CANDIDATES, LEXICAL_SECTIONS, LEXICAL_TOP_K, get_lexical_index, reciprocal_rank_fusion
+)
+from utils.metrics import track_stage
 
-def process_criteria(criteria: str, document_search_data: dict, module: str = None) -> list:
+def process_criteria(criteria: str, document_search_data: dict, module: str = None,
+                     pinecone_response: dict = None, depth: int = 1) -> list:
     """
     Process a single search criteria, query the Pinecone DB, validate documents,
     and return a list of documents with high similarity scores.
+
+    `pinecone_response` is the criteria's result of a `query_pinecone_db_modules` call covering several
+    criteria, Pinecone is only queried here when it is not given.
+
+    When the lexical index is available, its BM25 ranking for the same criteria and module is fused with
+    the Pinecone ranking by reciprocal rank, and only the best HYBRID_MAX_CANDIDATES trials are kept.
+    Trials found only by the lexical index have a similarity_score of 0. A search widened to `depth` times
+    the default Pinecone top_k takes that many times more lexical matches and fused trials.
     """
     if not criteria:
         return []
-    print(f"Pinecone DB Started")
-    pinecone_response = query_pinecone_db_extended(query=criteria, module=module)
-    print(f"Pinecone DB Finished")
+    if pinecone_response is None:
+        print(f"Pinecone DB Started")
+        pinecone_response = query_pinecone_db_extended(query=criteria, module=module)
+        print(f"Pinecone DB Finished")
+    if pinecone_response["success"] is False:
+        print(pinecone_response["message"])
 
     # document_validation = validate_document_similarity(
     #     similar_documents=pinecone_response["data"],
@@ -20,7 +36,7 @@ def process_criteria(criteria: str, document_search_data: dict, module: str = No
 
     # generate a final data list
     final_list = []
-    for item in pinecone_response["data"]:
+    for item in pinecone_response["data"] or []:
         new_item = {
             "nctId": item["nctId"],
             "module": item["module"],
@@ -28,5 +44,24 @@ def process_criteria(criteria: str, document_search_data: dict, module: str = No
         }
         final_list.append(new_item)
 
-    return final_list
+    lexical_index = get_lexical_index()
+    if lexical_index is None:
+        return final_list
+
+    with track_stage("lexical_search", module):
+        lexical_results = lexical_index.search(criteria, LEXICAL_SECTIONS.get(module), top_k=LEXICAL_TOP_K * depth)
+
+    vector_items = {item["nctId"]: item for item in final_list}
+    vector_ranking = sorted(vector_items, key=lambda nct_id: vector_items[nct_id]["similarity_score"], reverse=True)
+    lexical_scores = dict(lexical_results)
+    fused = reciprocal_rank_fusion([vector_ranking, [nct_id for nct_id, _ in lexical_results]])
+
+    fused_list = []
+    for nct_id, fused_score in fused[:HYBRID_MAX_CANDIDATES * depth]:
+        new_item = vector_items.get(nct_id) or {"nctId": nct_id, "module": module, "similarity_score": 0}
+        new_item["retrieval_score"] = round(fused_score, 6)
+        if nct_id in lexical_scores:
+            new_item["lexical_score"] = round(lexical_scores[nct_id], 3)
+        fused_list.append(new_item)
 
+    return fused_list
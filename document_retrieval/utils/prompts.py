@@ -319,6 +319,34 @@ medical_writer_agent_role = (
             """
 )
 
+medical_writer_agent_role_packed = medical_writer_agent_role + (
+            """
+                Multiple Trial Documents:
+                  Several Similar/Existing Medical Trial Documents are provided as a list, each identified by its "nctId".
+                  Draft the criteria from all of the provided documents together.
+                  For multiple documents the "source" field must be a list instead of a string, with one entry holding the
+                  "nctId" and the original "statement" for every document a criterion was drawn from.
+
+                ### Example output format for multiple documents
+
+                {
+                  "inclusionCriteria": [
+                    {
+                      "criteria": "Male or female, 18 years or older at the time of signing informed consent",
+                      "source": [
+                        {"nctId": "NCT03141073", "statement": "Participants must be at least 18 years old at the time of enrollment"},
+                        {"nctId": "NCT00552227", "statement": "Age 18 years or above at the time of signing the informed consent"}
+                      ],
+                      "class": "Age"
+                    }
+                  ],
+                  "exclusionCriteria": []
+                }
+
+                  Only use nctId values that appear in the provided documents.
+            """
+)
+
 filter_role = ("""
             Role:
                 You are an agent responsible for filtering AI-generated trial eligibility criteria.
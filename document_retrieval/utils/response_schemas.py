@@ -0,0 +1,80 @@
+import os
+
+# Use the structured outputs mode (json_schema) instead of plain json_object responses
+STRUCTURED_OUTPUTS = os.getenv("STRUCTURED_OUTPUTS", "true").lower() == "true"
+
+criteria_categories = [
+    "Gender", "Health Condition/Status", "Clinical and Laboratory Parameters",
+    "Medication Status", "Informed Consent", "Ability to Comply with Study Procedures",
+    "Lifestyle Requirements", "Reproductive Status", "Co-morbid Conditions",
+    "Recent Participation in Other Clinical Trials", "Allergies and Drug Reactions",
+    "Mental Health Disorders", "Infectious Diseases", "Other", "Age"
+]
+
+
+def _object(properties: dict) -> dict:
+    # Structured outputs require every property to be listed as required and no additional properties
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False
+    }
+
+
+def _array(items: dict) -> dict:
+    return {"type": "array", "items": items}
+
+
+_string = {"type": "string"}
+_category = {"type": "string", "enum": criteria_categories}
+
+_drafted_criterion = _object({"criteria": _string, "source": _string, "class": _category})
+# Packed drafting calls attribute every criterion to one or more of the trials in the call
+_packed_drafted_criterion = _object({
+    "criteria": _string,
+    "source": _array(_object({"nctId": _string, "statement": _string})),
+    "class": _category
+})
+_counted_values = _object({
+    "response": _array(_object({"value": _string, "count": {"type": "integer"}, "source": _array(_string)}))
+})
+_categorised_criterion = _object({"criteriaID": _string, "class": _category})
+
+response_schemas = {
+    "draft_eligibility_criteria": _object({
+        "inclusionCriteria": _array(_drafted_criterion),
+        "exclusionCriteria": _array(_drafted_criterion)
+    }),
+    "draft_eligibility_criteria_packed": _object({
+        "inclusionCriteria": _array(_packed_drafted_criterion),
+        "exclusionCriteria": _array(_packed_drafted_criterion)
+    }),
+    "values_count": _counted_values,
+    "timeframe_count": _counted_values,
+    "categorise_eligibility_criteria": _object({
+        "inclusionCriteria": _array(_categorised_criterion),
+        "exclusionCriteria": _array(_categorised_criterion)
+    }),
+    "filter_generated_criteria": _object({
+        "inclusionCriteria": _array(_string),
+        "exclusionCriteria": _array(_string)
+    }),
+    "merge_criteria": _object({
+        "response": _array(_object({"criteria": _string, "criteriaID": _array(_string)}))
+    })
+}
+
+
+def get_response_format(schema_name: str) -> dict:
+    """
+    Returns the `response_format` for a chat completion that must follow one of the `response_schemas`.
+
+    Falls back to the plain JSON mode when STRUCTURED_OUTPUTS is disabled.
+    """
+    if not STRUCTURED_OUTPUTS:
+        return {"type": "json_object"}
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": schema_name, "schema": response_schemas[schema_name], "strict": True}
+    }
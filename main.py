@@ -1,10 +1,34 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
 from document_retrieval.routes import search_routes
+from database.write_behind_queue import shutdown_write_behind_queue
+from utils.metrics import render_metrics
+from utils.tracing import configure_tracing, current_trace_id, request_context, shutdown_tracing
+from utils.warmup import get_readiness, mark_shutting_down, start_warmup, startup_steps
 from datetime import datetime
 import pytz
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    print(configure_tracing())
+
+    # Providers are created on first use, warmup connects them before traffic arrives. It also makes sure the
+    # hot queries are served by indexes, in the background so an unreachable database does not block startup
+    steps = startup_steps()
+    if steps:
+        start_warmup(steps)
+
+    yield
+
+    mark_shutting_down()
+    # Write the results that are still queued for the database before the process exits
+    shutdown_write_behind_queue()
+    shutdown_tracing()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Set Mumbai timezone (IST)
 mumbai_tz = pytz.timezone("Asia/Kolkata")
@@ -23,6 +47,24 @@ app.add_middleware(
 
 app.include_router(search_routes.router, prefix="/api/v1/ml", tags=["search"])
 
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # Every request gets a root span and a request ID that the stage spans in worker threads are attached to
+    debug_timings = (request.query_params.get("debug_timings", "").lower() == "true"
+                     or request.headers.get("X-Debug-Timings", "").lower() == "true")
+    with request_context(f"{request.method} {request.url.path}",
+                         request_id=request.headers.get("X-Request-ID"),
+                         debug_timings=debug_timings,
+                         attributes={"http.method": request.method, "http.route": request.url.path}) as request_id:
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = request_id
+        trace_id = current_trace_id()
+        if trace_id:
+            response.headers["X-Trace-ID"] = trace_id
+        return response
+
+
 @app.get("/")
 async def root():
     print(f"Server started at: {server_start_time}")
@@ -30,3 +72,24 @@ async def root():
         "message": "Python Backend Services Running",
         "server_started_at": server_start_time
     }
+
+
+@app.get("/metrics")
+def metrics():
+    # Prometheus scrape endpoint with the per-stage latency histograms and counters
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+
+@app.get("/healthz")
+def healthz():
+    # Liveness: the process is up and serving requests, independent of its dependencies
+    return {"status": "alive"}
+
+
+@app.get("/readyz")
+def readyz(response: Response):
+    # Readiness: warmup connected the required providers and the service is not shutting down
+    readiness = get_readiness()
+    response.status_code = status.HTTP_200_OK if readiness["ready"] else status.HTTP_503_SERVICE_UNAVAILABLE
+    return readiness
@@ -0,0 +1,92 @@
+"""
+Builds a new version of the corpus embedding file from the processed trial documents and publishes it.
+
+Every scoring module of every trial is embedded in batches, written to a new versioned file next to the
+CORPUS_STORE_PATH symlink together with its quantized int8 and binary tiers and, once complete, published
+by atomically swapping the symlink. Running workers switch to it within CORPUS_STORE_CHECK_SECONDS.
+
+Usage:
+    python -m providers.corpus.build_corpus_store [--dtype float16] [--batch-size 256] [--limit 1000] [--keep 2]
+"""
+import argparse
+import os
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from database.mongo_db_connection import get_mongo_dao
+from providers.corpus.corpus_store import (
+    CORPUS_MODULES, CORPUS_STORE_PATH, CorpusEmbeddingStore, CorpusStoreWriter, publish_corpus_store
+)
+from providers.corpus.quantized_index import build_quantized_sidecars
+from providers.openai.generate_embeddings import EMBEDDING_DIMENSIONS, generate_batch_embeddings_from_azure_client
+
+PROCESSED_TRIALS_COLLECTION = "t2dm_final_data_samples_processed"
+
+
+def fetch_corpus_documents(limit: int = None) -> list:
+    projection = {"_id": 0, "nctId": 1, **{field: 1 for field in CORPUS_MODULES.values()}}
+    cursor = get_mongo_dao().database[PROCESSED_TRIALS_COLLECTION].find({}, projection).sort("nctId", 1)
+    if limit:
+        cursor = cursor.limit(limit)
+    return [document for document in cursor if document.get("nctId")]
+
+
+def build_corpus_store(directory: str, dtype: str = "float16", batch_size: int = 256, limit: int = None,
+                       dim: int = EMBEDDING_DIMENSIONS) -> str:
+    """
+    Embeds the corpus into a new versioned file in `directory`.
+
+    Returns:
+        str: The path of the written file.
+    """
+    documents = fetch_corpus_documents(limit)
+    nct_ids = [document["nctId"] for document in documents]
+    print(f"Embedding {len(nct_ids)} trials x {len(CORPUS_MODULES)} modules")
+
+    os.makedirs(directory, exist_ok=True)
+    version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    writer_path = os.path.join(directory, f"corpus-{version}.emb")
+    with CorpusStoreWriter(writer_path, nct_ids, list(CORPUS_MODULES), dim=dim, dtype=dtype,
+                           version=version) as writer:
+        for module, field in CORPUS_MODULES.items():
+            for start in range(0, len(documents), batch_size):
+                batch = documents[start:start + batch_size]
+                texts = [str(document.get(field) or "") for document in batch]
+                vectors = np.zeros((len(batch), dim), dtype=np.float32)
+                # Trials without text for a module keep a zero vector, which scores 0
+                present = [position for position, text in enumerate(texts) if text.strip()]
+                if present:
+                    embedding_response = generate_batch_embeddings_from_azure_client([texts[position] for position in present])
+                    if embedding_response["success"] is False:
+                        raise RuntimeError(embedding_response["message"])
+                    vectors[present] = embedding_response["data"]
+                writer.write(start, module, vectors)
+            print(f"Embedded {module}")
+
+    # The int8 and binary first-pass tiers are published together with the vectors
+    build_quantized_sidecars(CorpusEmbeddingStore(writer_path))
+    return writer_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default=CORPUS_STORE_PATH, help="Symlink to publish, defaults to CORPUS_STORE_PATH")
+    parser.add_argument("--dtype", choices=["float16", "float32"], default="float16")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--limit", type=int, help="Only embed the first trials, for testing")
+    parser.add_argument("--keep", type=int, default=2, help="Published versions to keep on disk")
+    args = parser.parse_args()
+    if not args.path:
+        parser.error("Set CORPUS_STORE_PATH or pass --path")
+
+    start = time.perf_counter()
+    version_path = build_corpus_store(os.path.dirname(os.path.abspath(args.path)), args.dtype, args.batch_size,
+                                      args.limit)
+    publish_corpus_store(version_path, args.path, keep=args.keep)
+    print(f"Published {version_path} as {args.path} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Builds a new version of the criterion-level index from the processed trial documents and publishes it.
+
+The inclusion and exclusion sections of every trial are split into their individual criteria, embedded in
+batches into a new versioned file next to the CRITERIA_INDEX_PATH symlink and, once complete, published by
+atomically swapping the symlink. Running workers switch to it within CORPUS_STORE_CHECK_SECONDS.
+
+Usage:
+    python -m providers.corpus.build_criteria_index [--dtype float16] [--batch-size 2048] [--limit 1000] [--keep 2]
+"""
+import argparse
+import os
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from providers.corpus.build_corpus_store import fetch_corpus_documents
+from providers.corpus.corpus_store import _normalize, publish_corpus_store
+from providers.corpus.criteria_index import CRITERIA_INDEX_PATH, CRITERIA_TYPES, split_criteria_lines, \
+    write_criteria_index
+from providers.openai.generate_embeddings import EMBEDDING_DIMENSIONS, generate_batch_embeddings_from_azure_client
+
+
+def build_criteria_index(directory: str, dtype: str = "float16", batch_size: int = 2048, limit: int = None,
+                         dim: int = EMBEDDING_DIMENSIONS) -> str:
+    """
+    Splits and embeds the criteria of the corpus into a new versioned index in `directory`.
+
+    Returns:
+        str: The path of the written vector file.
+    """
+    nct_ids, trial_offsets, line_types, texts = [], [0], [], []
+    for document in fetch_corpus_documents(limit):
+        for criteria_type in CRITERIA_TYPES:
+            lines = split_criteria_lines(document.get(f"{criteria_type}Criteria"))
+            texts.extend(lines)
+            line_types.extend([CRITERIA_TYPES.index(criteria_type)] * len(lines))
+        nct_ids.append(document["nctId"])
+        trial_offsets.append(len(texts))
+    print(f"Embedding {len(texts)} criteria of {len(nct_ids)} trials")
+
+    os.makedirs(directory, exist_ok=True)
+    version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    version_path = os.path.join(directory, f"criteria-{version}.criteria")
+    vectors = np.lib.format.open_memmap(version_path, mode="w+", dtype=np.dtype(dtype), shape=(len(texts), dim))
+    for start in range(0, len(texts), batch_size):
+        embedding_response = generate_batch_embeddings_from_azure_client(texts[start:start + batch_size])
+        if embedding_response["success"] is False:
+            raise RuntimeError(embedding_response["message"])
+        vectors[start:start + batch_size] = _normalize(embedding_response["data"])
+        print(f"Embedded {min(start + batch_size, len(texts))}/{len(texts)} criteria")
+    vectors.flush()
+    del vectors
+
+    write_criteria_index(version_path, nct_ids, trial_offsets, line_types, texts)
+    return version_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default=CRITERIA_INDEX_PATH, help="Symlink to publish, defaults to CRITERIA_INDEX_PATH")
+    parser.add_argument("--dtype", choices=["float16", "float32"], default="float16")
+    parser.add_argument("--batch-size", type=int, default=2048, help="Criteria embedded and written at a time")
+    parser.add_argument("--limit", type=int, help="Only index the first trials, for testing")
+    parser.add_argument("--keep", type=int, default=2, help="Published versions to keep on disk")
+    args = parser.parse_args()
+    if not args.path:
+        parser.error("Set CRITERIA_INDEX_PATH or pass --path")
+
+    start = time.perf_counter()
+    version_path = build_criteria_index(os.path.dirname(os.path.abspath(args.path)), args.dtype, args.batch_size,
+                                        args.limit)
+    publish_corpus_store(version_path, args.path, keep=args.keep)
+    print(f"Published {version_path} as {args.path} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Memory-mapped trial embedding corpus shared by all worker processes.
+
+A corpus file holds one unit-length embedding per (trial, module) in a (trials, modules, dim) float32 or
+float16 matrix after a small header:
+
+    8 bytes   magic b"TRCORP01"
+    4 bytes   little-endian length of the JSON header
+    JSON      {"version", "dtype", "dim", "modules", "nctIds", "createdAt"}
+    padding   up to a multiple of 64 bytes
+    matrix    trials x modules x dim, C order
+
+The file is opened read-only with `np.memmap`, so every uvicorn worker maps the same pages from the page cache
+instead of holding its own copy, and scoring reads the vectors without copying the matrix. New corpus
+versions are written next to the old ones and published by atomically replacing the CORPUS_STORE_PATH
+symlink. Workers pick up the new target on their next check; requests that already hold the old store keep
+reading it until they finish, since a mapped file stays readable after it is unlinked.
+"""
+import os
+import json
+import time
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+
+from providers.openai.generate_embeddings import EMBEDDING_DIMENSIONS
+
+# Symlink (or file) of the published corpus, local scoring falls back to Pinecone/embeddings without it
+CORPUS_STORE_PATH = os.getenv("CORPUS_STORE_PATH", "")
+# How often a worker checks whether a new corpus version was published
+CORPUS_STORE_CHECK_SECONDS = float(os.getenv("CORPUS_STORE_CHECK_SECONDS", "30"))
+
+_MAGIC = b"TRCORP01"
+_ALIGNMENT = 64
+_DTYPES = {"float32": np.float32, "float16": np.float16}
+
+# Scoring modules of `process_similarity_scores` and the processed trial document fields they embed
+CORPUS_MODULES = {
+    "inclusionCriteria": "inclusionCriteria",
+    "exclusionCriteria": "exclusionCriteria",
+    "title": "officialTitle",
+    "trialOutcomes": "primaryOutcomes",
+    "condition": "conditions",
+}
+
+
+def _data_offset(header_length: int) -> int:
+    unaligned = len(_MAGIC) + 4 + header_length
+    return (unaligned + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+class CorpusEmbeddingStore:
+    """Read-only view of a corpus file. Vectors are unit length, so dot products are cosine similarities."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(_MAGIC)) != _MAGIC:
+                raise ValueError(f"{path} is not a corpus embedding file")
+            header_length = int.from_bytes(f.read(4), "little")
+            header = json.loads(f.read(header_length))
+
+        self.version = header["version"]
+        self.dtype = header["dtype"]
+        self.dim = header["dim"]
+        self.modules = header["modules"]
+        self.nct_ids = header["nctIds"]
+        self.created_at = header.get("createdAt")
+        self.matrix = np.memmap(path, dtype=_DTYPES[self.dtype], mode="r", offset=_data_offset(header_length),
+                                shape=(len(self.nct_ids), len(self.modules), self.dim))
+        self._rows = {nct_id: row for row, nct_id in enumerate(self.nct_ids)}
+        self._module_positions = {module: position for position, module in enumerate(self.modules)}
+
+    def __len__(self) -> int:
+        return len(self.nct_ids)
+
+    def rows(self, nct_ids: list) -> tuple:
+        """Returns the matrix rows of the trials that are in the corpus and the NCT IDs that are not."""
+        rows, missing = [], []
+        for nct_id in nct_ids:
+            row = self._rows.get(nct_id)
+            if row is None:
+                missing.append(nct_id)
+            else:
+                rows.append(row)
+        return np.asarray(rows, dtype=np.int64), missing
+
+    def module_vectors(self, module: str) -> np.ndarray:
+        """Zero-copy (trials, dim) view of one module's vectors."""
+        return self.matrix[:, self._module_positions[module], :]
+
+    def similarities(self, rows: np.ndarray, module: str, query_vector) -> np.ndarray:
+        """Cosine similarities of the given trial rows to a query vector for one module."""
+        query_vector = _normalize(np.asarray(query_vector).ravel())
+        vectors = self.matrix[rows, self._module_positions[module], :]
+        return vectors.astype(np.float32, copy=False) @ query_vector
+
+    def search(self, query_vector, module: str, top_k: int = 20, chunk_size: int = 65536) -> list:
+        """
+        Exact nearest trials of a query vector within one module, scanned in chunks of the mapped matrix.
+
+        Returns:
+            list: (nctId, score) tuples, best first.
+        """
+        query_vector = _normalize(np.asarray(query_vector).ravel())
+        vectors = self.module_vectors(module)
+        scores = np.empty(len(self.nct_ids), dtype=np.float32)
+        for start in range(0, len(scores), chunk_size):
+            scores[start:start + chunk_size] = vectors[start:start + chunk_size].astype(np.float32, copy=False) @ query_vector
+
+        top_k = min(top_k, len(scores))
+        if top_k == 0:
+            return []
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.nct_ids[row], float(scores[row])) for row in top]
+
+
+class CorpusStoreWriter:
+    """
+    Writes a corpus file, filled module by module with `write`. Use as a context manager; the file is
+    flushed and synced on exit, and only then should it be published with `publish_corpus_store`.
+    """
+
+    def __init__(self, path: str, nct_ids: list, modules: list, dim: int, dtype: str = "float16",
+                 version: str = None):
+        if dtype not in _DTYPES:
+            raise ValueError(f"Unsupported corpus dtype {dtype}, use one of {', '.join(_DTYPES)}")
+        self.path = path
+        self.version = version or datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        self.modules = list(modules)
+        self._module_positions = {module: position for position, module in enumerate(self.modules)}
+
+        header = json.dumps({
+            "version": self.version,
+            "dtype": dtype,
+            "dim": dim,
+            "modules": self.modules,
+            "nctIds": list(nct_ids),
+            "createdAt": datetime.now(timezone.utc).isoformat()
+        }).encode()
+        offset = _data_offset(len(header))
+        with open(path, "wb") as f:
+            f.write(_MAGIC)
+            f.write(len(header).to_bytes(4, "little"))
+            f.write(header)
+            f.write(b"\0" * (offset - f.tell()))
+        self.matrix = np.memmap(path, dtype=_DTYPES[dtype], mode="r+", offset=offset,
+                                shape=(len(nct_ids), len(self.modules), dim))
+
+    def write(self, start_row: int, module: str, vectors) -> None:
+        """Writes consecutive rows of one module, normalising the vectors to unit length."""
+        vectors = _normalize(vectors)
+        self.matrix[start_row:start_row + len(vectors), self._module_positions[module], :] = vectors
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.matrix.flush()
+        del self.matrix
+        with open(self.path, "rb+") as f:
+            os.fsync(f.fileno())
+        return False
+
+
+def publish_corpus_store(version_path: str, current_path: str = None, keep: int = 2) -> str:
+    """
+    Points the `current_path` symlink at a written corpus file, atomically, and removes older versions in
+    the same directory beyond the `keep` most recent ones.
+
+    Args:
+        version_path (str): The corpus file to publish.
+        current_path (str, optional): The symlink the service reads. Defaults to CORPUS_STORE_PATH.
+        keep (int, optional): Number of published versions to keep on disk, including the new one.
+
+    Returns:
+        str: The path of the symlink.
+    """
+    current_path = current_path or CORPUS_STORE_PATH
+    if not current_path:
+        raise ValueError("No symlink to publish to, set CORPUS_STORE_PATH")
+
+    directory = os.path.dirname(os.path.abspath(current_path))
+    target = os.path.relpath(os.path.abspath(version_path), directory)
+    temporary_link = f"{current_path}.{os.getpid()}.tmp"
+    os.symlink(target, temporary_link)
+    # rename() over the old link is atomic, readers see either the old or the new version
+    os.replace(temporary_link, current_path)
+
+    suffix = os.path.splitext(version_path)[1]
+    published = os.path.realpath(current_path)
+    versions = sorted((os.path.join(directory, name) for name in os.listdir(directory)
+                       if name.endswith(suffix) and os.path.isfile(os.path.join(directory, name))
+                       and not os.path.islink(os.path.join(directory, name))),
+                      key=os.path.getmtime, reverse=True)
+    for path in versions[keep:]:
+        if os.path.realpath(path) != published:
+            os.remove(path)
+            # Sidecar files of the version, such as its quantized tiers
+            for name in os.listdir(directory):
+                if name.startswith(f"{os.path.basename(path)}."):
+                    os.remove(os.path.join(directory, name))
+    return current_path
+
+
+_store = None
+_store_target = None
+_store_checked_at = 0.0
+_store_lock = threading.Lock()
+
+
+def get_corpus_store():
+    """
+    Returns the published corpus of this process, or None when CORPUS_STORE_PATH is not set or not published.
+
+    The symlink target is re-checked every CORPUS_STORE_CHECK_SECONDS and a newly published version is opened
+    in place of the old one.
+    """
+    global _store, _store_target, _store_checked_at
+    if not CORPUS_STORE_PATH:
+        return None
+
+    now = time.monotonic()
+    if _store is not None and now - _store_checked_at < CORPUS_STORE_CHECK_SECONDS:
+        return _store
+
+    with _store_lock:
+        if _store is not None and now - _store_checked_at < CORPUS_STORE_CHECK_SECONDS:
+            return _store
+        _store_checked_at = now
+        target = os.path.realpath(CORPUS_STORE_PATH)
+        if target != _store_target:
+            try:
+                store = CorpusEmbeddingStore(target)
+                if store.dim != EMBEDDING_DIMENSIONS:
+                    raise ValueError(f"corpus {store.version} holds {store.dim}-dimensional embeddings, "
+                                     f"expected {EMBEDDING_DIMENSIONS}")
+                print(f"Opened corpus {store.version} with {len(store)} trials from {target}")
+                _store, _store_target = store, target
+            except (OSError, ValueError) as e:
+                print(f"Failed to open corpus embeddings at {CORPUS_STORE_PATH}: {e}")
+        return _store
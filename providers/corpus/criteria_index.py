@@ -0,0 +1,274 @@
+"""
+Criterion-level vector index: one embedding per eligibility criterion line of every trial.
+
+Trials are indexed at section level elsewhere, so a 15-line inclusion block is compared with whole sections.
+This index splits the inclusion and exclusion sections into their individual criteria offline and matches a
+batch of criterion lines against all of them in one vectorized pass, returning the nearest criteria with their
+trials. Two files make up a version, both written by `providers.corpus.build_criteria_index`:
+
+    <name>.criteria           lines x dim unit-length vectors, .npy format, memory-mapped read-only
+    <name>.criteria.meta.npz  nct_ids, trial_offsets (lines of trial i are trial_offsets[i]:trial_offsets[i + 1]),
+                              line_types (0 inclusion, 1 exclusion), text_offsets and the UTF-8 text_blob
+
+Versions are published by swapping the CRITERIA_INDEX_PATH symlink, like the corpus embedding file.
+"""
+import os
+import re
+import time
+import threading
+
+import numpy as np
+
+from providers.corpus.corpus_store import CORPUS_STORE_CHECK_SECONDS, _normalize
+from providers.openai.generate_embeddings import EMBEDDING_DIMENSIONS, generate_batch_embeddings_from_azure_client
+from utils.metrics import track_stage
+
+# Symlink of the published criterion index, criterion matching and index attribution are off without it
+CRITERIA_INDEX_PATH = os.getenv("CRITERIA_INDEX_PATH", "")
+# Cosine similarity a drafted source statement needs to be attributed to a trial through the index
+CRITERIA_MATCH_MIN_SCORE = float(os.getenv("CRITERIA_MATCH_MIN_SCORE", "0.75"))
+
+CRITERIA_TYPES = ("inclusion", "exclusion")
+
+_CHUNK_SIZE = 65536
+# Numbering and bullets in front of a criterion: "1.", "2)", "(a)", "-", "*", "•"
+_LINE_PREFIX = re.compile(r"^\s*(?:[-*•·]+|\(?\d{1,3}[.)]|\([a-z]\)|[a-z]\))\s*", re.IGNORECASE)
+# Section headings such as "Inclusion Criteria:" or "Key exclusion criteria"
+_HEADING = re.compile(r"^(?:key\s+)?(?:inclusion|exclusion|eligibility)(?:\s+criteria)?\s*:?$", re.IGNORECASE)
+
+
+def split_criteria_lines(text) -> list:
+    """
+    Splits an eligibility section into its individual criteria, one per line, without numbering, bullets
+    and headings.
+    """
+    if not text:
+        return []
+    if isinstance(text, (list, tuple)):
+        return [line for item in text for line in split_criteria_lines(item)]
+
+    lines = []
+    for line in str(text).splitlines():
+        line = _LINE_PREFIX.sub("", line).strip()
+        if len(line) < 3 or _HEADING.match(line):
+            continue
+        lines.append(line)
+    return lines
+
+
+def _meta_path(path: str) -> str:
+    return f"{path}.meta.npz"
+
+
+def write_criteria_index(path: str, nct_ids: list, trial_offsets: list, line_types: list, texts: list) -> None:
+    """Writes the metadata of a criterion index whose vectors were written to `path`."""
+    encoded = [text.encode("utf-8") for text in texts]
+    text_offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    np.cumsum([len(text) for text in encoded], out=text_offsets[1:])
+    # Written through a file object, so the name is not extended with another .npz
+    with open(_meta_path(path), "wb") as f:
+        np.savez(
+            f,
+            nct_ids=np.array(nct_ids),
+            trial_offsets=np.asarray(trial_offsets, dtype=np.uint64),
+            line_types=np.asarray(line_types, dtype=np.uint8),
+            text_offsets=text_offsets,
+            text_blob=np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        )
+
+
+class CriterionIndex:
+    """Read-only view of a criterion index. Vectors are unit length, so dot products are cosine similarities."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.vectors = np.load(path, mmap_mode="r")
+        with np.load(_meta_path(path)) as meta:
+            self.nct_ids = meta["nct_ids"].tolist()
+            self.trial_offsets = meta["trial_offsets"].astype(np.int64)
+            self.line_types = meta["line_types"]
+            self._text_offsets = meta["text_offsets"].astype(np.int64)
+            self._text_blob = meta["text_blob"].tobytes()
+        self.line_trials = np.repeat(np.arange(len(self.nct_ids), dtype=np.uint32), np.diff(self.trial_offsets))
+        self._trial_positions = {nct_id: position for position, nct_id in enumerate(self.nct_ids)}
+
+    def __len__(self) -> int:
+        return len(self.line_types)
+
+    def text(self, line: int) -> str:
+        return self._text_blob[self._text_offsets[line]:self._text_offsets[line + 1]].decode("utf-8")
+
+    def _candidate_lines(self, criteria_type: str = None, nct_ids: list = None):
+        """Line numbers allowed by the filters, or None for all lines."""
+        if nct_ids is None and criteria_type is None:
+            return None
+        if nct_ids is None:
+            lines = np.arange(len(self), dtype=np.int64)
+        else:
+            # Lines of a trial are contiguous, so a trial filter only reads the lines of those trials
+            positions = [self._trial_positions[nct_id] for nct_id in dict.fromkeys(nct_ids)
+                         if nct_id in self._trial_positions]
+            lines = np.concatenate([np.arange(self.trial_offsets[position], self.trial_offsets[position + 1])
+                                    for position in positions]) if positions else np.empty(0, dtype=np.int64)
+        if criteria_type is not None:
+            lines = lines[self.line_types[lines] == CRITERIA_TYPES.index(criteria_type)]
+        return lines
+
+    def query(self, query_vectors, top_k: int = 5, criteria_type: str = None, nct_ids: list = None) -> list:
+        """
+        Finds the nearest indexed criteria of every query vector in one pass over the index.
+
+        Args:
+            query_vectors: (queries, dim) array of criterion embeddings.
+            top_k (int): Number of matches per query.
+            criteria_type (str, optional): Only match "inclusion" or "exclusion" criteria.
+            nct_ids (list, optional): Only match criteria of these trials.
+
+        Returns:
+            list: One list per query of {"nctId", "criteria", "criteriaType", "score"} dictionaries, best first.
+        """
+        queries = _normalize(np.atleast_2d(query_vectors)).T
+        candidate_lines = self._candidate_lines(criteria_type, nct_ids)
+        total = len(self) if candidate_lines is None else len(candidate_lines)
+        best_scores = np.empty((queries.shape[1], 0), dtype=np.float32)
+        best_lines = np.empty((queries.shape[1], 0), dtype=np.int64)
+
+        for start in range(0, total, _CHUNK_SIZE):
+            if candidate_lines is None:
+                lines = np.arange(start, min(start + _CHUNK_SIZE, total))
+                vectors = self.vectors[start:start + _CHUNK_SIZE]
+            else:
+                lines = candidate_lines[start:start + _CHUNK_SIZE]
+                vectors = self.vectors[lines]
+            # (queries, chunk) similarities, reduced to the running top k of every query
+            scores = (vectors.astype(np.float32, copy=False) @ queries).T
+            k = min(top_k, scores.shape[1])
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+            best_lines = np.concatenate([best_lines, lines[top]], axis=1)
+            if best_scores.shape[1] > top_k:
+                keep = np.argpartition(-best_scores, top_k - 1, axis=1)[:, :top_k]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_lines = np.take_along_axis(best_lines, keep, axis=1)
+
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        results = []
+        for query_scores, query_lines in zip(np.take_along_axis(best_scores, order, axis=1),
+                                             np.take_along_axis(best_lines, order, axis=1)):
+            results.append([{
+                "nctId": self.nct_ids[self.line_trials[line]],
+                "criteria": self.text(line),
+                "criteriaType": CRITERIA_TYPES[self.line_types[line]],
+                "score": round(float(score), 4)
+            } for score, line in zip(query_scores, query_lines)])
+        return results
+
+
+_index = None
+_index_target = None
+_index_checked_at = 0.0
+_index_lock = threading.Lock()
+
+
+def get_criteria_index():
+    """
+    Returns the published criterion index of this process, or None when CRITERIA_INDEX_PATH is not set or not
+    published. A newly published version is opened within CORPUS_STORE_CHECK_SECONDS.
+    """
+    global _index, _index_target, _index_checked_at
+    if not CRITERIA_INDEX_PATH:
+        return None
+
+    now = time.monotonic()
+    if _index is not None and now - _index_checked_at < CORPUS_STORE_CHECK_SECONDS:
+        return _index
+
+    with _index_lock:
+        if _index is not None and now - _index_checked_at < CORPUS_STORE_CHECK_SECONDS:
+            return _index
+        _index_checked_at = now
+        target = os.path.realpath(CRITERIA_INDEX_PATH)
+        if target != _index_target:
+            try:
+                index = CriterionIndex(target)
+                if index.vectors.shape[1] != EMBEDDING_DIMENSIONS:
+                    raise ValueError(f"the index holds {index.vectors.shape[1]}-dimensional embeddings, "
+                                     f"expected {EMBEDDING_DIMENSIONS}")
+                print(f"Opened criterion index with {len(index)} criteria of {len(index.nct_ids)} trials from {target}")
+                _index, _index_target = index, target
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Failed to open criterion index at {CRITERIA_INDEX_PATH}: {e}")
+        return _index
+
+
+def match_criteria_lines(lines: list, top_k: int = 5, criteria_type: str = None, nct_ids: list = None) -> dict:
+    """
+    Matches a batch of criterion lines against every indexed criterion, embedding all lines in one call.
+
+    Args:
+        lines (list): The criterion lines to match.
+        top_k (int): Number of matches per line.
+        criteria_type (str, optional): Only match "inclusion" or "exclusion" criteria.
+        nct_ids (list, optional): Only match criteria of these trials.
+
+    Returns:
+        dict: A response dictionary whose data is one {"line", "matches"} dictionary per input line.
+    """
+    final_response = {
+        "success": False,
+        "message": "Failed to match criteria",
+        "data": None
+    }
+
+    try:
+        criteria_index = get_criteria_index()
+        if criteria_index is None:
+            final_response["message"] = "No criterion index published, set CRITERIA_INDEX_PATH"
+            return final_response
+        if not lines:
+            final_response.update({"success": True, "message": "No criteria to match", "data": []})
+            return final_response
+
+        embedding_response = generate_batch_embeddings_from_azure_client(lines)
+        if embedding_response["success"] is False:
+            final_response["message"] = embedding_response["message"]
+            return final_response
+
+        with track_stage("criteria_match", criteria_type):
+            matches = criteria_index.query(embedding_response["data"], top_k=top_k, criteria_type=criteria_type,
+                                           nct_ids=nct_ids)
+
+        final_response["data"] = [{"line": line, "matches": line_matches} for line, line_matches in zip(lines, matches)]
+        final_response["success"] = True
+        final_response["message"] = f"Matched {len(lines)} criteria"
+    except Exception as e:
+        final_response["message"] = f"Error matching criteria: {e}"
+
+    return final_response
+
+
+def attribute_statements(statements: list, nct_ids: list, min_score: float = CRITERIA_MATCH_MIN_SCORE) -> list:
+    """
+    Attributes drafted source statements to the trials they were most likely taken from, by their nearest
+    indexed criterion among `nct_ids`.
+
+    Returns:
+        list: One list of nctIds per statement, empty when no criterion is similar enough or there is no index.
+    """
+    attributions = [[] for _ in statements]
+    # Empty statements cannot be embedded
+    positions = [position for position, statement in enumerate(statements) if statement.strip()]
+    if not positions or get_criteria_index() is None:
+        return attributions
+    match_response = match_criteria_lines([statements[position] for position in positions], top_k=3, nct_ids=nct_ids)
+    if match_response["success"] is False:
+        print(match_response["message"])
+        return attributions
+
+    for position, item in zip(positions, match_response["data"]):
+        matched = [match for match in item["matches"] if match["score"] >= min_score]
+        # Trials whose criterion is as close as the best one, the same statement often appears in several
+        attributions[position] = list(dict.fromkeys(
+            match["nctId"] for match in matched if match["score"] >= matched[0]["score"] - 0.01
+        ))
+    return attributions
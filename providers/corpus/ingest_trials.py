@@ -0,0 +1,312 @@
+"""
+Ingests ClinicalTrials.gov studies into MongoDB and Pinecone, re-embedding only what changed.
+
+The studies (API v2 JSON with a `protocolSection`) are read from a directory of .json files, a .zip download,
+a .jsonl file or a .json file holding one study, a list of studies or an API page with "studies". Every study
+is stored as-is in `t2dm_data_preprocessed`, where the search filters read their facets from, and as a
+processed document in `t2dm_final_data_samples_processed`.
+
+The text of every Pinecone module (LEXICAL_SECTIONS) is hashed, and the hashes of the embedded texts are kept
+per trial and index in `trial_ingestion_state`. Only modules whose text changed since they were embedded into
+the active index are embedded in batches and upserted; documents are only rewritten when the study changed.
+After every batch the position in the source is written to a checkpoint file, so an interrupted run resumes
+where it stopped.
+
+Rebuild the corpus store and criterion index afterwards (`providers.corpus.build_corpus_store` and
+`providers.corpus.build_criteria_index`) when they are used; the lexical index is rebuilt on the next start.
+
+Usage:
+    python -m providers.corpus.ingest_trials --source ctg-studies.json.zip [--batch-size 200] [--restart]
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import time
+import zipfile
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+
+from database.mongo_db_connection import get_mongo_dao
+from document_retrieval.utils.lexical_index import LEXICAL_SECTIONS
+from providers.openai.generate_embeddings import generate_batch_embeddings_from_azure_client
+from providers.pinecone.pinecone_connection import get_pinecone_store
+
+PROCESSED_TRIALS_COLLECTION = "t2dm_final_data_samples_processed"
+PREPROCESSED_TRIALS_COLLECTION = "t2dm_data_preprocessed"
+INGESTION_STATE_COLLECTION = "trial_ingestion_state"
+
+# "Exclusion Criteria:" heading of the eligibility text, everything before it is inclusion criteria
+_EXCLUSION_HEADING = re.compile(r"^\W*(?:key\s+)?exclusion\s+criteria\W*$", re.IGNORECASE | re.MULTILINE)
+_INCLUSION_HEADING = re.compile(r"^\W*(?:key\s+)?inclusion\s+criteria\W*$", re.IGNORECASE | re.MULTILINE)
+
+
+def read_studies(source: str):
+    """Yields the studies of a directory, .zip, .jsonl or .json source, in a stable order."""
+    if os.path.isdir(source):
+        for path in sorted(glob.glob(os.path.join(source, "**", "*.json"), recursive=True)):
+            with open(path) as f:
+                yield from _studies_of(json.load(f))
+    elif zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for name in sorted(name for name in archive.namelist() if name.endswith(".json")):
+                yield from _studies_of(json.loads(archive.read(name)))
+    elif source.endswith((".jsonl", ".ndjson")):
+        with open(source) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(source) as f:
+            yield from _studies_of(json.load(f))
+
+
+def _studies_of(data) -> list:
+    if isinstance(data, list):
+        return data
+    if "studies" in data:
+        return data["studies"]
+    return [data]
+
+
+def split_eligibility_criteria(text: str) -> tuple:
+    """Splits the eligibility text of a study into its inclusion and exclusion criteria."""
+    text = text or ""
+    exclusion_heading = _EXCLUSION_HEADING.search(text)
+    inclusion, exclusion = (text[:exclusion_heading.start()], text[exclusion_heading.end():]) \
+        if exclusion_heading else (text, "")
+    return _INCLUSION_HEADING.sub("", inclusion, count=1).strip(), exclusion.strip()
+
+
+def _format_outcomes(outcomes: list) -> str:
+    # Same layout as the processed corpus, TrialEligibilityAgent reads the time frames from it
+    return "\n".join(
+        ", ".join(f"{key} - {outcome[key]}" for key in ("measure", "description", "timeFrame") if outcome.get(key))
+        for outcome in outcomes or []
+    )
+
+
+def build_processed_document(study: dict) -> dict:
+    """
+    Builds the processed document of a ClinicalTrials.gov study.
+
+    Returns:
+        dict: The processed fields read by the search and drafting services, None if the study has no nctId.
+    """
+    protocol_section = study.get("protocolSection", {})
+    identification_module = protocol_section.get("identificationModule", {})
+    nct_id = identification_module.get("nctId")
+    if not nct_id:
+        return None
+
+    conditions_module = protocol_section.get("conditionsModule", {})
+    outcomes_module = protocol_section.get("outcomesModule", {})
+    inclusion_criteria, exclusion_criteria = split_eligibility_criteria(
+        protocol_section.get("eligibilityModule", {}).get("eligibilityCriteria")
+    )
+    return {
+        "nctId": nct_id,
+        "officialTitle": identification_module.get("officialTitle") or identification_module.get("briefTitle", ""),
+        "conditions": ", ".join(conditions_module.get("conditions", [])),
+        "inclusionCriteria": inclusion_criteria,
+        "exclusionCriteria": exclusion_criteria,
+        "primaryOutcomes": _format_outcomes(outcomes_module.get("primaryOutcomes")),
+        "secondaryOutcomes": _format_outcomes(outcomes_module.get("secondaryOutcomes")),
+        "designModule": protocol_section.get("designModule", {}),
+        "keywords": conditions_module.get("keywords", [])
+    }
+
+
+def module_texts(processed_document: dict) -> dict:
+    """Text embedded for every Pinecone module of a processed document."""
+    return {
+        module: "\n".join(str(processed_document[field]) for field in fields if processed_document.get(field))
+        for module, fields in LEXICAL_SECTIONS.items()
+    }
+
+
+def content_hash(content) -> str:
+    if not isinstance(content, str):
+        content = json.dumps(content, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def ingest_batch(studies: list) -> dict:
+    """
+    Stores, embeds and upserts the changed trials and modules of a batch of studies.
+
+    Returns:
+        dict: The counts of the batch: trials, invalid, unchanged, documentsWritten, modulesEmbedded and
+            vectorsDeleted.
+    """
+    counts = {"trials": 0, "invalid": 0, "unchanged": 0, "documentsWritten": 0, "modulesEmbedded": 0,
+              "vectorsDeleted": 0}
+    trials = {}
+    for study in studies:
+        processed_document = build_processed_document(study)
+        if processed_document is None:
+            counts["invalid"] += 1
+            continue
+        # A study listed twice in the source is ingested once, with its last version
+        trials[processed_document["nctId"]] = (study, processed_document)
+    counts["trials"] = len(trials)
+    if not trials:
+        return counts
+
+    mongo_dao = get_mongo_dao()
+    pinecone_store = get_pinecone_store()
+    states = {state["nctId"]: state for state in mongo_dao.find(
+        collection_name=INGESTION_STATE_COLLECTION,
+        query={"nctId": {"$in": list(trials)}},
+        projection={"_id": 0}
+    )}
+
+    document_writes, state_writes = {PROCESSED_TRIALS_COLLECTION: [], PREPROCESSED_TRIALS_COLLECTION: []}, []
+    to_embed, to_delete = [], {}
+    now = datetime.now(timezone.utc)
+    for nct_id, (study, processed_document) in trials.items():
+        state = states.get(nct_id, {})
+        document_hash = content_hash(study)
+        texts = module_texts(processed_document)
+        module_hashes = {module: content_hash(text) for module, text in texts.items() if text}
+        embedded_hashes = state.get("embedded", {}).get(pinecone_store.target, {})
+
+        changed_modules = [module for module, module_hash in module_hashes.items()
+                           if embedded_hashes.get(module) != module_hash]
+        removed_modules = [module for module in embedded_hashes if module not in module_hashes]
+        if state.get("documentHash") == document_hash and not changed_modules and not removed_modules:
+            counts["unchanged"] += 1
+            continue
+
+        if state.get("documentHash") != document_hash:
+            document_writes[PROCESSED_TRIALS_COLLECTION].append(
+                UpdateOne({"nctId": nct_id}, {"$set": processed_document}, upsert=True))
+            document_writes[PREPROCESSED_TRIALS_COLLECTION].append(
+                UpdateOne({"protocolSection.identificationModule.nctId": nct_id}, {"$set": study}, upsert=True))
+        to_embed.extend((nct_id, module, texts[module]) for module in changed_modules)
+        for module in removed_modules:
+            to_delete.setdefault(module, []).append(f"{nct_id}_{module}")
+        state_writes.append(UpdateOne({"nctId": nct_id}, {"$set": {
+            "nctId": nct_id, "documentHash": document_hash, f"embedded.{pinecone_store.target}": module_hashes,
+            "updatedAt": now
+        }}, upsert=True))
+
+    for collection_name, operations in document_writes.items():
+        if operations:
+            mongo_dao.bulk_write(collection_name, operations, ordered=False)
+    counts["documentsWritten"] = len(document_writes[PROCESSED_TRIALS_COLLECTION])
+
+    if to_embed:
+        embedding_response = generate_batch_embeddings_from_azure_client([text for _, _, text in to_embed])
+        if embedding_response["success"] is False:
+            raise RuntimeError(embedding_response["message"])
+        pinecone_store.upsert_vectors([
+            {"id": f"{nct_id}_{module}", "values": embedding.tolist(), "metadata": {"nctId": nct_id, "module": module}}
+            for (nct_id, module, _), embedding in zip(to_embed, embedding_response["data"])
+        ])
+        counts["modulesEmbedded"] = len(to_embed)
+    if to_delete:
+        pinecone_store.delete_vectors(to_delete)
+        counts["vectorsDeleted"] = sum(len(vector_ids) for vector_ids in to_delete.values())
+
+    # The hashes are only recorded once the vectors are written, an interrupted batch is redone
+    if state_writes:
+        mongo_dao.bulk_write(INGESTION_STATE_COLLECTION, state_writes, ordered=False)
+    return counts
+
+
+def _load_checkpoint(checkpoint_path: str, source: str) -> dict:
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("source") == os.path.abspath(source):
+            return checkpoint
+    return {"source": os.path.abspath(source), "position": 0, "counts": {}}
+
+
+def _save_checkpoint(checkpoint_path: str, checkpoint: dict) -> None:
+    temporary_path = f"{checkpoint_path}.tmp"
+    with open(temporary_path, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(temporary_path, checkpoint_path)
+
+
+def ingest_trials(source: str, batch_size: int = 200, checkpoint_path: str = None, restart: bool = False,
+                  limit: int = None) -> dict:
+    """
+    Ingests the studies of a source in batches, resuming from the checkpoint file if there is one.
+
+    Returns:
+        dict: A response dictionary whose data has the total counts of `ingest_batch` and the source position.
+    """
+    final_response = {
+        "success": False,
+        "message": "Failed to ingest trials",
+        "data": None
+    }
+
+    checkpoint = {"source": os.path.abspath(source), "position": 0, "counts": {}} if restart \
+        else _load_checkpoint(checkpoint_path, source)
+    if checkpoint["position"]:
+        print(f"Resuming after {checkpoint['position']} studies of {source}")
+
+    try:
+        start = time.perf_counter()
+        ingested = 0
+        batch = []
+        studies = read_studies(source)
+        for position, study in enumerate(studies):
+            if position < checkpoint["position"]:
+                continue
+            if limit is not None and ingested >= limit:
+                break
+            batch.append(study)
+            ingested += 1
+            if len(batch) == batch_size:
+                _ingest_and_checkpoint(batch, position + 1, checkpoint, checkpoint_path, start, ingested)
+                batch = []
+        if batch:
+            _ingest_and_checkpoint(batch, checkpoint["position"] + len(batch), checkpoint, checkpoint_path, start,
+                                   ingested)
+
+        final_response["success"] = True
+        final_response["message"] = f"Ingested {ingested} studies from {source}: {checkpoint['counts']}"
+        final_response["data"] = checkpoint
+    except Exception as e:
+        final_response["message"] = f"Error ingesting trials after {checkpoint['position']} studies: {e}"
+
+    return final_response
+
+
+def _ingest_and_checkpoint(batch: list, position: int, checkpoint: dict, checkpoint_path: str, start: float,
+                           ingested: int) -> None:
+    for key, value in ingest_batch(batch).items():
+        checkpoint["counts"][key] = checkpoint["counts"].get(key, 0) + value
+    checkpoint["position"] = position
+    checkpoint["updatedAt"] = datetime.now(timezone.utc).isoformat()
+    if checkpoint_path:
+        _save_checkpoint(checkpoint_path, checkpoint)
+    print(f"Ingested {ingested} studies ({ingested / (time.perf_counter() - start):.1f}/s): {checkpoint['counts']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", required=True, help="Directory, .zip, .jsonl or .json file of studies")
+    parser.add_argument("--batch-size", type=int, default=200, help="Studies stored, embedded and checkpointed at a time")
+    parser.add_argument("--checkpoint", help="Checkpoint file, defaults to <source>.checkpoint.json")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and read the source from the start")
+    parser.add_argument("--limit", type=int, help="Only ingest this many studies, for testing")
+    args = parser.parse_args()
+
+    checkpoint_path = args.checkpoint or f"{os.path.abspath(args.source).rstrip(os.sep)}.checkpoint.json"
+    response = ingest_trials(args.source, args.batch_size, checkpoint_path, args.restart, args.limit)
+    print(response["message"])
+    if response["success"] is False:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
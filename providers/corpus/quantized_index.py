@@ -0,0 +1,167 @@
+"""
+Quantized first-pass tier over the corpus embeddings.
+
+Two compressed copies of the corpus matrix are kept next to a corpus file, as memory-mapped .npy sidecars:
+
+    int8    Every vector scaled by its own max |value| to [-127, 127], 1 byte per dimension (4x smaller than
+            float32). Scored against the float query, asymmetric scalar quantization.
+    binary  The sign bit of every dimension, 1 bit per dimension (32x smaller). Scored by Hamming distance,
+            which estimates the angle between the vectors: cos ~ cos(pi * hamming / dim).
+
+Both are stored module-major, (modules, trials, dim), so a module is scanned as one contiguous block.
+A weighted search scans every trial and module in the chosen tier, keeps the best candidates and re-scores
+them with the full-precision vectors of the corpus, giving the same weighted cosine score as
+`calculate_weighted_similarity_score` for the trials it returns.
+
+The service does not search with it yet: similarity searches score the Pinecone candidates exactly. The
+sidecars are built with every corpus version, and `benchmarks.benchmark_quantized_recall` measures the
+recall and latency a whole-corpus first pass would have.
+"""
+import os
+
+import numpy as np
+
+
+QUANTIZATION_MODES = ("int8", "binary")
+
+# Rows per scanned block, small enough for the dequantized block to stay in cache
+_CHUNK_SIZE = 8192
+# Number of set bits of every byte value, for numpy versions without np.bitwise_count
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def _sidecar_paths(corpus_path: str) -> dict:
+    return {
+        "int8": f"{corpus_path}.int8.npy",
+        "int8_scales": f"{corpus_path}.int8-scales.npy",
+        "binary": f"{corpus_path}.bits.npy",
+    }
+
+
+def _quantize_int8(vectors: np.ndarray) -> tuple:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.abs(vectors).max(axis=-1) / 127
+    safe_scales = np.where(scales > 0, scales, 1.0)
+    quantized = np.rint(vectors / safe_scales[..., None]).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+def _popcount(values: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return _POPCOUNT[values]
+
+
+def build_quantized_sidecars(corpus_store, chunk_size: int = _CHUNK_SIZE) -> dict:
+    """
+    Writes the int8 and binary sidecars of a corpus file. Run it before the corpus is published, so
+    the sidecars are in place when workers switch to the new version.
+
+    Returns:
+        dict: The sidecar paths by tier.
+    """
+    paths = _sidecar_paths(corpus_store.path)
+    trials, modules, dim = corpus_store.matrix.shape
+    int8 = np.lib.format.open_memmap(paths["int8"], mode="w+", dtype=np.int8, shape=(modules, trials, dim))
+    scales = np.lib.format.open_memmap(paths["int8_scales"], mode="w+", dtype=np.float32, shape=(modules, trials))
+    bits = np.lib.format.open_memmap(paths["binary"], mode="w+", dtype=np.uint8,
+                                     shape=(modules, trials, (dim + 7) // 8))
+    for start in range(0, trials, chunk_size):
+        chunk = np.asarray(corpus_store.matrix[start:start + chunk_size], dtype=np.float32).transpose(1, 0, 2)
+        int8[:, start:start + chunk_size], scales[:, start:start + chunk_size] = _quantize_int8(chunk)
+        bits[:, start:start + chunk_size] = np.packbits(chunk > 0, axis=-1)
+    for array in (int8, scales, bits):
+        array.flush()
+    return paths
+
+
+class QuantizedCorpusIndex:
+    """First-pass scoring over the quantized tiers of a corpus, with full-precision re-scoring."""
+
+    def __init__(self, corpus_store):
+        self.store = corpus_store
+        paths = _sidecar_paths(corpus_store.path)
+        if all(os.path.exists(path) for path in paths.values()):
+            # Shared read-only mappings, like the corpus matrix itself
+            self.int8 = np.load(paths["int8"], mmap_mode="r")
+            self.int8_scales = np.load(paths["int8_scales"], mmap_mode="r")
+            self.bits = np.load(paths["binary"], mmap_mode="r")
+        else:
+            print(f"No quantized sidecars for {corpus_store.path}, quantizing in memory")
+            matrix = np.asarray(corpus_store.matrix, dtype=np.float32).transpose(1, 0, 2)
+            self.int8, self.int8_scales = _quantize_int8(matrix)
+            self.bits = np.packbits(matrix > 0, axis=-1)
+        self.dim = corpus_store.dim
+        self._module_positions = {module: position for position, module in enumerate(corpus_store.modules)}
+
+    def _module_scores(self, mode: str, module: str, query_vector: np.ndarray, start: int, end: int) -> np.ndarray:
+        position = self._module_positions[module]
+        if mode == "int8":
+            vectors = self.int8[position, start:end].astype(np.float32)
+            return (vectors @ query_vector) * self.int8_scales[position, start:end]
+        query_bits = np.packbits(query_vector > 0)
+        hamming = _popcount(np.bitwise_xor(self.bits[position, start:end], query_bits)).sum(axis=-1, dtype=np.int32)
+        return np.cos(np.pi * hamming / self.dim).astype(np.float32)
+
+    def first_pass(self, query_vectors: dict, weights: dict, candidates: int, mode: str = "int8") -> np.ndarray:
+        """
+        Approximate weighted scores of every trial in a quantized tier.
+
+        Args:
+            query_vectors (dict): Module name to unit-length query embedding. Modules without input are left out.
+            weights (dict): Module name to weight.
+            candidates (int): Number of best trials to keep.
+            mode (str): "int8" or "binary".
+
+        Returns:
+            np.ndarray: The corpus rows of the best `candidates` trials, best first.
+        """
+        if mode not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization mode {mode}, use one of {', '.join(QUANTIZATION_MODES)}")
+        # float32 queries keep the products on the BLAS path of the dequantized blocks
+        query_vectors = {module: np.asarray(vector, dtype=np.float32) for module, vector in query_vectors.items()}
+        trials = len(self.store)
+        scores = np.zeros(trials, dtype=np.float32)
+        for start in range(0, trials, _CHUNK_SIZE):
+            end = min(start + _CHUNK_SIZE, trials)
+            for module, query_vector in query_vectors.items():
+                scores[start:end] += weights[module] * self._module_scores(mode, module, query_vector, start, end)
+
+        candidates = min(candidates, trials)
+        if candidates == 0:
+            return np.empty(0, dtype=np.int64)
+        top = np.argpartition(-scores, candidates - 1)[:candidates]
+        return top[np.argsort(-scores[top])]
+
+    def rescore(self, rows: np.ndarray, query_vectors: dict, weights: dict) -> np.ndarray:
+        """Exact weighted cosine scores of the given rows, normalised by the sum of the weights used."""
+        sum_weights = sum(weights[module] for module in query_vectors)
+        scores = np.zeros(len(rows), dtype=np.float32)
+        for module, query_vector in query_vectors.items():
+            scores += weights[module] * self.store.similarities(rows, module, query_vector)
+        return scores / sum_weights if sum_weights else scores
+
+    def search(self, query_vectors: dict, weights: dict, top_k: int = 20, candidates: int = None,
+               mode: str = "int8") -> list:
+        """
+        Finds the trials with the best weighted similarity to the query: a quantized pass over the whole
+        corpus keeps `candidates` trials (default 8 x top_k), which are re-scored with full precision.
+
+        Returns:
+            list: (nctId, weighted_similarity_score) tuples, best first.
+        """
+        query_vectors = {module: _unit(vector) for module, vector in query_vectors.items()
+                         if vector is not None and module in self._module_positions and weights.get(module)}
+        if not query_vectors:
+            return []
+        rows = self.first_pass(query_vectors, weights, candidates or top_k * 8, mode)
+        scores = self.rescore(rows, query_vectors, weights)
+        order = np.argsort(-scores)[:top_k]
+        return [(self.store.nct_ids[rows[position]], float(scores[position])) for position in order]
+
+
+def _unit(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
@@ -1,17 +1,47 @@
 import numpy as np
 import os
 import json
-from openai import AzureOpenAI
+import threading
+from utils.metrics import timed_stage
 
 # Set up environment variables
 os.environ["AZURE_OPENAI_API_KEY"] = "7219267fcc1345cabcd25ac868c686c1"
 os.environ["AZURE_OPENAI_ENDPOINT"] = "https://stock-agent.openai.azure.com/"
-azure_client = AzureOpenAI(
-  api_key = os.environ.get("AZURE_OPENAI_API_KEY"),
-  api_version = "2024-05-01-preview",
-  azure_endpoint = os.environ.get("AZURE_OPENAI_ENDPOINT")
-)
 
+# Full output size of the embedding model
+NATIVE_EMBEDDING_DIMENSIONS = 1536
+# Size of the embeddings used by every index and cache, text-embedding-3 models shorten their output to it
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", str(NATIVE_EMBEDDING_DIMENSIONS)))
+# Azure OpenAI deployment of the embedding model
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "embedding_model")
+
+
+def _embedding_options(dimensions: int) -> dict:
+      # The `dimensions` parameter is only sent for other sizes, text-embedding-ada-002 does not accept it
+      return {"dimensions": dimensions} if dimensions != NATIVE_EMBEDDING_DIMENSIONS else {}
+
+
+_azure_client = None
+_azure_client_lock = threading.Lock()
+
+
+def get_azure_client():
+      """Returns the Azure OpenAI client shared by the process, creating it on first use."""
+      global _azure_client
+      if _azure_client is None:
+            with _azure_client_lock:
+                  if _azure_client is None:
+                        # The openai package takes most of the service's import time, so it is imported on first use
+                        from openai import AzureOpenAI
+                        _azure_client = AzureOpenAI(
+                          api_key = os.environ.get("AZURE_OPENAI_API_KEY"),
+                          api_version = "2024-05-01-preview",
+                          azure_endpoint = os.environ.get("AZURE_OPENAI_ENDPOINT")
+                        )
+      return _azure_client
+
+
+@timed_stage("embedding")
 def generate_embeddings_from_azure_client(text) -> dict:
       final_response = {
           "success": False,
@@ -19,14 +49,15 @@ def generate_embeddings_from_azure_client(text) -> dict:
           "data": None
       }
       try:
-            response = azure_client.embeddings.create(
+            response = get_azure_client().embeddings.create(
                 input=text,
-                model="embedding_model"
+                model=EMBEDDING_MODEL,
+                **_embedding_options(EMBEDDING_DIMENSIONS)
             )
             # Extract and flatten the embedding
             embedding = np.array(json.loads(response.model_dump_json(indent=2))["data"][0]["embedding"])
             final_response["success"] = True
-            final_response["data"] = embedding.reshape(1, 1536)
+            final_response["data"] = embedding.reshape(1, -1)
             final_response["message"] = "Successfully generated embeddings."
             return final_response
       except Exception as e:
@@ -35,6 +66,46 @@ def generate_embeddings_from_azure_client(text) -> dict:
             final_response["message"] = f"Error generating embeddings: {e}"
             return final_response
 
+@timed_stage("embedding", module="batch")
+def generate_batch_embeddings_from_azure_client(texts: list, batch_size: int = 256, model: str = None,
+                                                dimensions: int = None) -> dict:
+      """
+      Generates embeddings for a list of texts with as few embedding requests as possible.
+
+      Args:
+          texts (list): The texts to embed.
+          batch_size (int): Maximum number of texts sent in one embedding request.
+          model (str): Deployment to embed with, defaults to EMBEDDING_MODEL.
+          dimensions (int): Size of the embeddings, defaults to EMBEDDING_DIMENSIONS.
+
+      Returns:
+          dict: A response dictionary whose data is a (len(texts), dim) array, in the order of the input texts.
+      """
+      final_response = {
+          "success": False,
+          "message": "Failed to generate batch embeddings.",
+          "data": None
+      }
+      try:
+            embeddings = []
+            for start in range(0, len(texts), batch_size):
+                  response = get_azure_client().embeddings.create(
+                      input=texts[start:start + batch_size],
+                      model=model or EMBEDDING_MODEL,
+                      **_embedding_options(dimensions or EMBEDDING_DIMENSIONS)
+                  )
+                  # The API may return items out of order, so sort them by their input index
+                  embeddings.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+            final_response["success"] = True
+            final_response["data"] = np.array(embeddings, dtype=np.float32).reshape(len(texts), -1)
+            final_response["message"] = "Successfully generated batch embeddings."
+            return final_response
+      except Exception as e:
+            print(f"Error generating batch embeddings: {e}")
+            final_response["message"] = f"Error generating batch embeddings: {e}"
+            return final_response
+
+@timed_stage("llm", module="validate_document_similarity")
 def validate_document_similarity(similar_documents: list, document_search_criteria: dict) -> dict:
       base_response = {
           "success": False,
@@ -92,7 +163,7 @@ def validate_document_similarity(similar_documents: list, document_search_criter
               {"role": "system", "content": validate_document_similarity_agent_role},
               {"role": "user", "content": user_input},
           ]
-          response = azure_client.chat.completions.create(
+          response = get_azure_client().chat.completions.create(
               model="model-4o",
               response_format={"type": "json_object"},
               messages=input_history,
@@ -1,9 +1,23 @@
 import os
-import openai
-from openai import OpenAI
+import threading
 from dotenv import load_dotenv
 import numpy as np
 
+_openai_client = None
+_openai_client_lock = threading.Lock()
+
+
+def get_openai_client():
+    """Returns the OpenAI client shared by all `OpenAIClient` instances, so they reuse its connection pool."""
+    global _openai_client
+    if _openai_client is None:
+        with _openai_client_lock:
+            if _openai_client is None:
+                # The openai package takes most of the service's import time, so it is imported on first use
+                from openai import OpenAI
+                _openai_client = OpenAI()
+    return _openai_client
+
 
 class OpenAIClient:
     """
@@ -30,10 +44,11 @@ class OpenAIClient:
         if not self.api_key:
             raise ValueError("OPENAI_API_KEY is not set in environment variables.")
 
+        import openai
         openai.api_key = self.api_key
         self.max_tokens = max_tokens
         self.temperature = temperature
-        self.client = OpenAI()
+        self.client = get_openai_client()
 
     def generate_text(self, messages: list[dict], model: str = "gpt-4o",
                       response_format: dict = None, stream: bool = False) -> dict:
@@ -77,6 +92,30 @@ class OpenAIClient:
 
         return final_response
 
+    def generate_text_stream(self, messages: list[dict], model: str = "gpt-4o", response_format: dict = None):
+        """
+        Streams a text response from OpenAI's chat models.
+
+        Args:
+            messages (list[dict]): A list of dictionaries representing the conversation history.
+            model (str, optional): The OpenAI model to use for chat completion. Defaults to "gpt-4o".
+            response_format (dict, optional): Specifies the desired response format. Defaults to None.
+
+        Yields:
+            str: The content deltas of the response as they arrive. If the stream fails midway the error is
+                 logged and the generator stops, so callers keep everything received until then.
+        """
+        response = self.generate_text(messages=messages, model=model, response_format=response_format, stream=True)
+        if response["success"] is False:
+            return
+
+        try:
+            for chunk in response["data"]:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            print(f"An error occurred while streaming text: {e}")
+
     def generate_embeddings(self, text: str, model: str = "text-embedding-3-small") -> dict:
         """
         Generates an embedding vector for the given text using OpenAI's embedding model.
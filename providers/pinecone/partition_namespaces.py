@@ -0,0 +1,78 @@
+"""
+Copies the vectors of the default namespace into one namespace per module.
+
+Every vector of the default namespace is read back and upserted with its id and metadata into the namespace
+named after its "module" metadata, e.g. eligibilityModule. A module query then only scans that module's
+vectors instead of filtering the whole index. Set PINECONE_MODULE_NAMESPACES=true once the copy is complete;
+the default namespace is left untouched so workers without it keep working, and can be deleted afterwards.
+
+Usage:
+    python -m providers.pinecone.partition_namespaces [--index final-similarity-1] [--batch-size 100]
+"""
+import argparse
+import time
+from collections import defaultdict
+
+from providers.pinecone.pinecone_connection import PINECONE_MODULES, PineconeVectorStore, pinecone_index_name
+
+
+def partition_namespaces(index_name: str = None, batch_size: int = 100) -> dict:
+    """
+    Copies every vector of the default namespace of the index into its module's namespace.
+
+    Returns:
+        dict: A response dictionary whose data has the number of vectors copied per namespace.
+    """
+    final_response = {
+        "success": False,
+        "message": "Failed to partition the index",
+        "data": None
+    }
+
+    try:
+        store = PineconeVectorStore(index_name=index_name or pinecone_index_name())
+        copied = defaultdict(int)
+        skipped = 0
+
+        for vector_ids in store.pinecone_index.list(limit=batch_size, namespace=""):
+            if not vector_ids:
+                continue
+            records = store.pinecone_index.fetch(ids=list(vector_ids), namespace="")["vectors"].values()
+            by_module = defaultdict(list)
+            for record in records:
+                metadata = dict(record["metadata"] or {})
+                if metadata.get("module") not in PINECONE_MODULES:
+                    skipped += 1
+                    continue
+                by_module[metadata["module"]].append({"id": record["id"], "values": list(record["values"]),
+                                                      "metadata": metadata})
+            for module, vectors in by_module.items():
+                store.pinecone_index.upsert(vectors=vectors, namespace=module)
+                copied[module] += len(vectors)
+            print(f"Partitioned {sum(copied.values())} vectors: {dict(copied)}")
+
+        final_response["success"] = True
+        final_response["message"] = f"Partitioned {store.index_name} into {len(copied)} module namespaces" + (
+            f", skipped {skipped} vectors without a known module" if skipped else "")
+        final_response["data"] = dict(copied)
+    except Exception as e:
+        final_response["message"] = f"Error partitioning the index: {e}"
+
+    return final_response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", help="Index to partition, defaults to the one for EMBEDDING_DIMENSIONS")
+    parser.add_argument("--batch-size", type=int, default=100, help="Vectors read and upserted at a time")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    response = partition_namespaces(args.index, args.batch_size)
+    print(f"{response['message']} in {time.perf_counter() - start:.1f}s")
+    if response["success"] is False:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,41 @@
 import time
 import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from pinecone import Pinecone, ServerlessSpec
+from utils.metrics import track_stage
+from utils.tracing import with_current_context
+from providers.openai.generate_embeddings import EMBEDDING_DIMENSIONS, EMBEDDING_MODEL, NATIVE_EMBEDDING_DIMENSIONS
+
+# Index of the full-size embeddings, reduced-dimension indexes are kept next to it
+PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "final-similarity-1")
+# Query the per-module namespaces written by providers.pinecone.partition_namespaces instead of filtering the
+# default namespace by the "module" metadata
+PINECONE_MODULE_NAMESPACES = os.getenv("PINECONE_MODULE_NAMESPACES", "false").lower() == "true"
+# Modules with vectors in the index, each in its own namespace when PINECONE_MODULE_NAMESPACES is set
+PINECONE_MODULES = ("eligibilityModule", "conditionsModule", "outcomesModule", "identificationModule")
+# Sub-queries of one multi-module query run in parallel on up to this many threads
+PINECONE_QUERY_WORKERS = int(os.getenv("PINECONE_QUERY_WORKERS", "8"))
+# Collection of the active index record, written when a re-embedding job switches to its new index
+ACTIVE_INDEX_COLLECTION = "embedding_indexes"
+# How often a worker checks whether another index was made active
+ACTIVE_INDEX_CHECK_SECONDS = float(os.getenv("ACTIVE_INDEX_CHECK_SECONDS", "30"))
+# Time allowed for reading the active index record, the configured index is used when MongoDB does not answer
+ACTIVE_INDEX_READ_TIMEOUT_SECONDS = float(os.getenv("ACTIVE_INDEX_READ_TIMEOUT_SECONDS", "2"))
+
+
+def pinecone_index_name(dimensions: int = EMBEDDING_DIMENSIONS) -> str:
+    """Name of the index holding embeddings of the given size, e.g. final-similarity-1-256d for 256."""
+    if dimensions == NATIVE_EMBEDDING_DIMENSIONS:
+        return PINECONE_INDEX_NAME
+    return f"{PINECONE_INDEX_NAME}-{dimensions}d"
 
 
 class PineconeVectorStore:
-    def __init__(self, index_name="final-similarity-1", dimension=1536, metric="cosine", cloud="aws",
-                 region="us-east-1"):
+    def __init__(self, index_name=None, dimension=EMBEDDING_DIMENSIONS, metric="cosine", cloud="aws",
+                 region="us-east-1", namespace=""):
         # Load environment variables
         load_dotenv()
 
@@ -17,14 +46,17 @@ class PineconeVectorStore:
 
         # Initialize Pinecone client
         self.pc = Pinecone(api_key=self.api_key)
-        self.index_name = index_name
+        self.index_name = index_name or pinecone_index_name(dimension)
         self.dimension = dimension
         self.metric = metric
         self.cloud = cloud
         self.region = region
+        # Base namespace of the vectors, module namespaces are created below it
+        self.namespace = namespace or ""
 
         # Setup index
-        self._setup_index()
+        with track_stage("pinecone_connect", self.index_name):
+            self._setup_index()
 
         # Initialize the Pinecone Vector Store
         self.pinecone_index = self.pc.Index(self.index_name)
@@ -41,6 +73,12 @@ class PineconeVectorStore:
             )
             while not self.pc.describe_index(self.index_name).status["ready"]:
                 time.sleep(1)
+        else:
+            # Querying an index of another size fails on every request, so fail once at connection time
+            index_dimension = self.pc.describe_index(self.index_name).dimension
+            if index_dimension != self.dimension:
+                raise ValueError(f"Pinecone index {self.index_name} holds {index_dimension}-dimensional vectors, "
+                                 f"expected {self.dimension}, set EMBEDDING_DIMENSIONS or PINECONE_INDEX_NAME")
 
     def query(self, vector, filters=None, k=5):
         """
@@ -59,6 +97,201 @@ class PineconeVectorStore:
             top_k=k,
             include_values=True,
             include_metadata=True,
-            filter=filters
+            filter=filters,
+            namespace=self.namespace
         )
 
+    @property
+    def target(self) -> str:
+        """Index and base namespace of the vectors, e.g. final-similarity-2 or final-similarity-1/v2."""
+        return f"{self.index_name}/{self.namespace}" if self.namespace else self.index_name
+
+    def module_namespace(self, module: str) -> str:
+        """Namespace the vectors of a module are stored and queried in."""
+        if not PINECONE_MODULE_NAMESPACES:
+            return self.namespace
+        return f"{self.namespace}-{module}" if self.namespace else module
+
+    def upsert_vectors(self, vectors: list, batch_size: int = 100) -> int:
+        """
+        Upserts {"id", "values", "metadata"} vectors in batches, each into the namespace of its "module" metadata.
+
+        Returns:
+            int: The number of vectors upserted.
+        """
+        by_namespace = defaultdict(list)
+        for vector in vectors:
+            by_namespace[self.module_namespace(vector["metadata"]["module"])].append(vector)
+        for namespace, namespace_vectors in by_namespace.items():
+            for start in range(0, len(namespace_vectors), batch_size):
+                self.pinecone_index.upsert(vectors=namespace_vectors[start:start + batch_size], namespace=namespace)
+        return len(vectors)
+
+    def delete_vectors(self, ids_by_module: dict) -> None:
+        """Deletes vectors given as lists of ids per module."""
+        for module, vector_ids in ids_by_module.items():
+            if vector_ids:
+                self.pinecone_index.delete(ids=list(vector_ids), namespace=self.module_namespace(module))
+
+    def query_module(self, vector, module=None, k=5):
+        """
+        Queries the vectors of one module, or of all modules when `module` is None.
+
+        With PINECONE_MODULE_NAMESPACES the module's namespace is queried, so only its vectors are scanned,
+        and an all-module query runs one query per namespace and keeps the best `k` matches.
+
+        Returns:
+            dict: Query results with their "matches".
+        """
+        if not PINECONE_MODULE_NAMESPACES:
+            filters = {"module": {"$eq": module}} if module else None
+            with track_stage("pinecone_query", module):
+                return self.query(vector=vector, filters=filters, k=k)
+
+        if module is None:
+            results = self.query_modules({name: (name, vector) for name in PINECONE_MODULES}, k=k)
+            matches = [match for result in results.values() for match in result["matches"]]
+            return {"matches": sorted(matches, key=lambda match: match["score"], reverse=True)[:k]}
+
+        with track_stage("pinecone_query", module):
+            return self.pinecone_index.query(
+                vector=vector,
+                top_k=k,
+                include_values=True,
+                include_metadata=True,
+                namespace=self.module_namespace(module)
+            )
+
+    def query_modules(self, queries: dict, k=5) -> dict:
+        """
+        Runs several module queries in parallel, as one retrieval call.
+
+        Parameters:
+            queries (dict): Maps a query name to a (module, vector) pair. The module may be None for all modules,
+                and several names may query the same module.
+            k (int, optional): Number of top results to fetch per query.
+
+        Returns:
+            dict: The query results by query name. A failed sub-query raises its exception.
+        """
+        if len(queries) <= 1:
+            return {name: self.query_module(vector, module, k) for name, (module, vector) in queries.items()}
+
+        with ThreadPoolExecutor(max_workers=min(PINECONE_QUERY_WORKERS, len(queries))) as executor:
+            futures = {
+                name: executor.submit(with_current_context(self.query_module), vector, module, k)
+                for name, (module, vector) in queries.items()
+            }
+            return {name: future.result() for name, future in futures.items()}
+
+
+def get_active_index(timeout: float = None):
+    """
+    Returns the active index record ({"indexName", "namespace", "model", "dimensions"}), None if no index
+    was made active and the configured index is used.
+
+    Args:
+        timeout (float, optional): Seconds allowed for the read, including finding a server. Defaults to the
+            client's timeouts.
+    """
+    # Imported here so importing the vector store does not import the MongoDB client
+    import pymongo
+    from database.mongo_db_connection import get_mongo_dao
+    with pymongo.timeout(timeout):
+        return get_mongo_dao().find_one(ACTIVE_INDEX_COLLECTION, {"_id": "active"}, {"_id": 0})
+
+
+def set_active_index(index_name: str, namespace: str, model: str, dimensions: int) -> dict:
+    """
+    Makes an index the one the workers query. The record is replaced in one write, workers embedding with the
+    same model and size switch to it within ACTIVE_INDEX_CHECK_SECONDS.
+
+    Returns:
+        dict: The previous active index record, None if there was none.
+    """
+    from pymongo import ReturnDocument
+    from database.mongo_db_connection import get_mongo_dao
+    return get_mongo_dao().find_one_and_update(
+        ACTIVE_INDEX_COLLECTION,
+        {"_id": "active"},
+        {"$set": {"indexName": index_name, "namespace": namespace or "", "model": model, "dimensions": dimensions,
+                  "switchedAt": time.time()}},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE
+    )
+
+
+_pinecone_store = None
+_pinecone_store_lock = threading.Lock()
+_active_index_checked_at = 0.0
+_active_index_refreshing = False
+_ignored_active_index = None
+
+
+def _configured_target() -> tuple:
+    """(index name, namespace) the worker should query: the active index if it matches its embeddings."""
+    global _ignored_active_index
+    try:
+        active_index = get_active_index(timeout=ACTIVE_INDEX_READ_TIMEOUT_SECONDS)
+    except Exception as e:
+        print(f"Could not read the active Pinecone index: {e}")
+        return None
+    if not active_index:
+        return pinecone_index_name(), ""
+    if active_index.get("model") != EMBEDDING_MODEL or active_index.get("dimensions") != EMBEDDING_DIMENSIONS:
+        # Queries embedded with another model or size cannot search it, the worker keeps its configured index
+        if active_index != _ignored_active_index:
+            print(f"Ignoring active Pinecone index {active_index['indexName']} of {active_index.get('model')} "
+                  f"({active_index.get('dimensions')}d), this worker embeds with {EMBEDDING_MODEL} "
+                  f"({EMBEDDING_DIMENSIONS}d)")
+            _ignored_active_index = active_index
+        return pinecone_index_name(), ""
+    return active_index["indexName"], active_index.get("namespace") or ""
+
+
+def _refresh_pinecone_store() -> None:
+    """Reads the active index record and replaces the shared store when another index was made active."""
+    global _pinecone_store, _active_index_refreshing
+    try:
+        current = _pinecone_store
+        target = _configured_target()
+        # The current index is kept when the record could not be read
+        if target is None or (current.index_name, current.namespace) == target:
+            return
+        try:
+            store = PineconeVectorStore(index_name=target[0], namespace=target[1])
+        except Exception as e:
+            print(f"Could not switch to Pinecone index {target[0]}, keeping {current.target}: {e}")
+            return
+        print(f"Switched Pinecone index from {current.target} to {store.target}")
+        _pinecone_store = store
+    finally:
+        with _pinecone_store_lock:
+            _active_index_refreshing = False
+
+
+def get_pinecone_store() -> PineconeVectorStore:
+    """
+    Returns the vector store shared by the process, connecting to the index on first use.
+
+    The index setup lists the indexes of the project, so it is done once instead of for every query. Every
+    ACTIVE_INDEX_CHECK_SECONDS the active index record is read again in a background thread, and the store is
+    replaced when another index was made active. Requests keep using the current store meanwhile.
+    """
+    global _pinecone_store, _active_index_checked_at, _active_index_refreshing
+    if _pinecone_store is None:
+        with _pinecone_store_lock:
+            if _pinecone_store is None:
+                _active_index_checked_at = time.monotonic()
+                target = _configured_target() or (pinecone_index_name(), "")
+                _pinecone_store = PineconeVectorStore(index_name=target[0], namespace=target[1])
+        return _pinecone_store
+
+    if time.monotonic() - _active_index_checked_at >= ACTIVE_INDEX_CHECK_SECONDS and not _active_index_refreshing:
+        with _pinecone_store_lock:
+            if time.monotonic() - _active_index_checked_at >= ACTIVE_INDEX_CHECK_SECONDS \
+                    and not _active_index_refreshing:
+                _active_index_checked_at = time.monotonic()
+                _active_index_refreshing = True
+                threading.Thread(target=_refresh_pinecone_store, name="pinecone-active-index", daemon=True).start()
+    return _pinecone_store
@@ -0,0 +1,222 @@
+"""
+Re-embeds every module of every processed trial into a new Pinecone index or namespace and switches to it.
+
+For a change of the embedding deployment (EMBEDDING_MODEL) or size (EMBEDDING_DIMENSIONS) while the
+service keeps serving the current index. The processed trials are streamed from MongoDB with a cursor in
+nctId order and embedded in large batches, up to --workers batches at a time. Finished batches are recorded
+in order in a checkpoint file, so an interrupted job resumes after the last trial whose batch and all
+batches before it were written. The embedded module hashes are recorded for the new index in
+`trial_ingestion_state`, so `providers.corpus.ingest_trials` stays incremental after the switch.
+
+Once every trial is written, the new index is made active with a single write of the active index record.
+Workers configured with the same EMBEDDING_MODEL and EMBEDDING_DIMENSIONS switch to it within
+ACTIVE_INDEX_CHECK_SECONDS, others keep their configured index until they are redeployed with that
+configuration. Run it again with --activate and the previous index to roll back.
+
+Usage:
+    python -m providers.pinecone.reembed_corpus --index final-similarity-2-512d --dimensions 512 [--model embedding_model_v3]
+    python -m providers.pinecone.reembed_corpus --index final-similarity-1 --namespace v2 [--workers 4] [--batch-size 500]
+    python -m providers.pinecone.reembed_corpus --index final-similarity-1 --activate
+"""
+import argparse
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import UpdateOne
+
+from database.mongo_db_connection import get_mongo_dao
+from document_retrieval.utils.lexical_index import LEXICAL_SECTIONS
+from providers.corpus.ingest_trials import INGESTION_STATE_COLLECTION, PROCESSED_TRIALS_COLLECTION, content_hash, \
+    module_texts
+from providers.openai.generate_embeddings import EMBEDDING_DIMENSIONS, EMBEDDING_MODEL, \
+    generate_batch_embeddings_from_azure_client
+from providers.pinecone.pinecone_connection import PineconeVectorStore, get_active_index, pinecone_index_name, \
+    set_active_index
+
+
+def stream_trial_batches(after_nct_id: str = None, batch_size: int = 500):
+    """Yields the processed trials after `after_nct_id` in nctId order, in lists of `batch_size`."""
+    query = {"nctId": {"$gt": after_nct_id}} if after_nct_id else {"nctId": {"$exists": True}}
+    projection = {"_id": 0, "nctId": 1, **{field: 1 for fields in LEXICAL_SECTIONS.values() for field in fields}}
+    cursor = get_mongo_dao().database[PROCESSED_TRIALS_COLLECTION].find(query, projection) \
+        .sort("nctId", 1).batch_size(batch_size)
+    batch = []
+    for document in cursor:
+        batch.append(document)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def reembed_batch(documents: list, store: PineconeVectorStore, model: str, dimensions: int) -> int:
+    """
+    Embeds the modules of a batch of processed trials and upserts them into the store.
+
+    Returns:
+        int: The number of vectors written.
+    """
+    texts = []
+    state_writes = []
+    for document in documents:
+        document_texts = {module: text for module, text in module_texts(document).items() if text}
+        texts.extend((document["nctId"], module, text) for module, text in document_texts.items())
+        state_writes.append(UpdateOne({"nctId": document["nctId"]}, {"$set": {
+            f"embedded.{store.target}": {module: content_hash(text) for module, text in document_texts.items()}
+        }}, upsert=True))
+    if not texts:
+        return 0
+
+    embedding_response = generate_batch_embeddings_from_azure_client([text for _, _, text in texts], model=model,
+                                                                     dimensions=dimensions)
+    if embedding_response["success"] is False:
+        raise RuntimeError(embedding_response["message"])
+    if embedding_response["data"].shape[1] != dimensions:
+        raise RuntimeError(f"{model} returned {embedding_response['data'].shape[1]}-dimensional embeddings, "
+                           f"expected {dimensions}")
+
+    store.upsert_vectors([
+        {"id": f"{nct_id}_{module}", "values": embedding.tolist(), "metadata": {"nctId": nct_id, "module": module}}
+        for (nct_id, module, _), embedding in zip(texts, embedding_response["data"])
+    ])
+    get_mongo_dao().bulk_write(INGESTION_STATE_COLLECTION, state_writes, ordered=False)
+    return len(texts)
+
+
+def default_checkpoint_path(index_name: str, namespace: str = "") -> str:
+    return "-".join(filter(None, ["reembed", index_name, namespace])) + ".checkpoint.json"
+
+
+def _load_checkpoint(checkpoint_path: str, job: dict, restart: bool) -> dict:
+    if not restart and os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if checkpoint["job"] != job:
+            raise ValueError(f"{checkpoint_path} belongs to another job ({checkpoint['job']}), use --restart")
+        return checkpoint
+    return {"job": job, "lastNctId": None, "trials": 0, "vectors": 0, "seconds": 0.0, "completed": False}
+
+
+def _save_checkpoint(checkpoint_path: str, checkpoint: dict) -> None:
+    temporary_path = f"{checkpoint_path}.tmp"
+    with open(temporary_path, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(temporary_path, checkpoint_path)
+
+
+def reembed_corpus(index_name: str, namespace: str = "", model: str = EMBEDDING_MODEL,
+                   dimensions: int = EMBEDDING_DIMENSIONS, batch_size: int = 500, workers: int = 4,
+                   checkpoint_path: str = None, restart: bool = False, switch: bool = True) -> dict:
+    """
+    Re-embeds the corpus into `index_name`/`namespace`, resuming from the checkpoint, and makes it the active
+    index when every trial is written and `switch` is set.
+
+    Returns:
+        dict: A response dictionary whose data is the checkpoint: trials and vectors written, seconds spent and
+            the last written nctId.
+    """
+    final_response = {
+        "success": False,
+        "message": "Failed to re-embed the corpus",
+        "data": None
+    }
+
+    try:
+        active_index = get_active_index() or {"indexName": pinecone_index_name(), "namespace": ""}
+        if (active_index["indexName"], active_index.get("namespace") or "") == (index_name, namespace or ""):
+            final_response["message"] = f"{index_name} {namespace} is the active index, " \
+                                        f"re-embed into a new index or namespace"
+            return final_response
+
+        job = {"index": index_name, "namespace": namespace or "", "model": model, "dimensions": dimensions}
+        checkpoint_path = checkpoint_path or default_checkpoint_path(index_name, namespace)
+        checkpoint = _load_checkpoint(checkpoint_path, job, restart)
+        store = PineconeVectorStore(index_name=index_name, dimension=dimensions, namespace=namespace)
+        if checkpoint["lastNctId"]:
+            print(f"Resuming after {checkpoint['lastNctId']}, {checkpoint['trials']} trials already written")
+
+        start = time.perf_counter()
+        seconds_before = checkpoint["seconds"]
+        trials_before = checkpoint["trials"]
+
+        def record(batch_trials: int, batch_vectors: int, last_nct_id: str) -> None:
+            checkpoint["trials"] += batch_trials
+            checkpoint["vectors"] += batch_vectors
+            checkpoint["lastNctId"] = last_nct_id
+            checkpoint["seconds"] = round(seconds_before + time.perf_counter() - start, 1)
+            _save_checkpoint(checkpoint_path, checkpoint)
+            trials_per_second = (checkpoint["trials"] - trials_before) / max(time.perf_counter() - start, 1e-9)
+            print(f"Re-embedded {checkpoint['trials']} trials, {checkpoint['vectors']} vectors "
+                  f"({trials_per_second:.1f} trials/s), last {last_nct_id}")
+
+        if not checkpoint["completed"]:
+            # Batches finish out of order, the checkpoint only advances past batches whose predecessors are done
+            pending = deque()
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                try:
+                    for documents in stream_trial_batches(checkpoint["lastNctId"], batch_size):
+                        pending.append((executor.submit(reembed_batch, documents, store, model, dimensions),
+                                        len(documents), documents[-1]["nctId"]))
+                        # At most two batches per worker are held in memory
+                        while len(pending) >= 2 * workers or (pending and pending[0][0].done()):
+                            future, batch_trials, last_nct_id = pending.popleft()
+                            record(batch_trials, future.result(), last_nct_id)
+                    while pending:
+                        future, batch_trials, last_nct_id = pending.popleft()
+                        record(batch_trials, future.result(), last_nct_id)
+                except BaseException:
+                    for future, _, _ in pending:
+                        future.cancel()
+                    raise
+            checkpoint["completed"] = True
+            _save_checkpoint(checkpoint_path, checkpoint)
+
+        run_seconds = time.perf_counter() - start
+        message = (f"Re-embedded {checkpoint['trials']} trials into {store.target} in {checkpoint['seconds']}s, "
+                   f"{(checkpoint['trials'] - trials_before) / max(run_seconds, 1e-9):.1f} trials/s in this run")
+        if switch:
+            previous = set_active_index(index_name, namespace, model, dimensions)
+            message += f", switched the active index from {(previous or active_index)['indexName']} to {store.target}"
+
+        final_response["success"] = True
+        final_response["message"] = message
+        final_response["data"] = checkpoint
+    except Exception as e:
+        final_response["message"] = f"Error re-embedding the corpus: {e}"
+
+    return final_response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", required=True, help="Index to write the new embeddings to, created if needed")
+    parser.add_argument("--namespace", default="", help="Base namespace in the index, for a new version in the same index")
+    parser.add_argument("--model", default=EMBEDDING_MODEL, help="Embedding deployment, defaults to EMBEDDING_MODEL")
+    parser.add_argument("--dimensions", type=int, default=EMBEDDING_DIMENSIONS, help="Embedding size")
+    parser.add_argument("--batch-size", type=int, default=500, help="Trials embedded and upserted per batch")
+    parser.add_argument("--workers", type=int, default=4, help="Batches embedded at the same time")
+    parser.add_argument("--checkpoint", help="Checkpoint file, defaults to reembed-<index>[-<namespace>].checkpoint.json")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start from the first trial")
+    parser.add_argument("--no-switch", action="store_true", help="Do not make the new index active when done")
+    parser.add_argument("--activate", action="store_true", help="Only make the index active, e.g. to roll back")
+    args = parser.parse_args()
+
+    if args.activate:
+        previous = set_active_index(args.index, args.namespace, args.model, args.dimensions)
+        print(f"Switched the active index from {(previous or {}).get('indexName', pinecone_index_name())} to "
+              f"{args.index} {args.namespace}".rstrip())
+        return
+
+    response = reembed_corpus(args.index, args.namespace, args.model, args.dimensions, args.batch_size, args.workers,
+                              args.checkpoint, args.restart, not args.no_switch)
+    print(response["message"])
+    if response["success"] is False:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Builds reduced-dimension copies of the Pinecone index next to the current one.
+
+Every vector of every namespace of the source index is read back, truncated to the first N dimensions,
+re-normalised to unit length and upserted with its id and metadata into `<PINECONE_INDEX_NAME>-<N>d`,
+which is created if needed. The service queries it once it runs with EMBEDDING_DIMENSIONS=N.
+
+Truncating and re-normalising gives the same vectors as requesting `dimensions=N` from a text-embedding-3
+model, whose embeddings put the most important information first. Embeddings of text-embedding-ada-002 do
+not have that property and must be re-embedded instead.
+
+Usage:
+    python -m providers.pinecone.reindex_dimensions [--dimensions 256 512] [--batch-size 100]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from providers.openai.generate_embeddings import NATIVE_EMBEDDING_DIMENSIONS
+from providers.pinecone.pinecone_connection import PINECONE_INDEX_NAME, PineconeVectorStore, pinecone_index_name
+
+
+def truncate_embeddings(vectors, dimensions: int) -> np.ndarray:
+    """First `dimensions` components of every vector, re-normalised to unit length."""
+    truncated = np.asarray(vectors, dtype=np.float32)[..., :dimensions]
+    norms = np.linalg.norm(truncated, axis=-1, keepdims=True)
+    return np.divide(truncated, norms, out=np.zeros_like(truncated), where=norms > 0)
+
+
+def reindex_dimensions(dimensions: list, source_index_name: str = PINECONE_INDEX_NAME, batch_size: int = 100) -> dict:
+    """
+    Copies every vector of the source index into one truncated index per requested size.
+
+    Returns:
+        dict: A response dictionary whose data has the number of vectors copied per target index.
+    """
+    final_response = {
+        "success": False,
+        "message": "Failed to re-index embeddings",
+        "data": None
+    }
+
+    try:
+        source = PineconeVectorStore(index_name=source_index_name, dimension=NATIVE_EMBEDDING_DIMENSIONS)
+        targets = {size: PineconeVectorStore(index_name=pinecone_index_name(size), dimension=size)
+                   for size in dimensions}
+        copied = {target.index_name: 0 for target in targets.values()}
+
+        namespaces = list(source.pinecone_index.describe_index_stats()["namespaces"]) or [""]
+        for namespace in namespaces:
+            for vector_ids in source.pinecone_index.list(limit=batch_size, namespace=namespace):
+                if not vector_ids:
+                    continue
+                records = list(source.pinecone_index.fetch(ids=list(vector_ids), namespace=namespace)["vectors"].values())
+                values = np.array([record["values"] for record in records], dtype=np.float32)
+                for size, target in targets.items():
+                    truncated = truncate_embeddings(values, size)
+                    target.pinecone_index.upsert(vectors=[
+                        {"id": record["id"], "values": vector.tolist(), "metadata": dict(record["metadata"] or {})}
+                        for record, vector in zip(records, truncated)
+                    ], namespace=namespace)
+                    copied[target.index_name] += len(records)
+            print(f"Re-indexed namespace '{namespace}': {copied}")
+
+        final_response["success"] = True
+        final_response["message"] = f"Re-indexed {source_index_name} into {', '.join(copied)}"
+        final_response["data"] = copied
+    except Exception as e:
+        final_response["message"] = f"Error re-indexing embeddings: {e}"
+
+    return final_response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dimensions", type=int, nargs="+", default=[256, 512], help="Sizes of the new indexes")
+    parser.add_argument("--source-index", default=PINECONE_INDEX_NAME, help="Index of the full-size embeddings")
+    parser.add_argument("--batch-size", type=int, default=100, help="Vectors read and upserted at a time")
+    args = parser.parse_args()
+    if any(size <= 0 or size >= NATIVE_EMBEDDING_DIMENSIONS for size in args.dimensions):
+        parser.error(f"Sizes must be between 1 and {NATIVE_EMBEDDING_DIMENSIONS - 1}")
+
+    start = time.perf_counter()
+    response = reindex_dimensions(args.dimensions, args.source_index, args.batch_size)
+    print(f"{response['message']} in {time.perf_counter() - start:.1f}s")
+    if response["success"] is False:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
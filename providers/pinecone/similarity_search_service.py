@@ -1,20 +1,75 @@
-from providers.pinecone.pinecone_connection import PineconeVectorStore
-from collections import defaultdict
-from providers.openai.generate_embeddings import generate_embeddings_from_azure_client
-from database.document_retrieval.fetch_processed_trial_document_with_nct_id import \
-    fetch_processed_trial_document_with_nct_id
-
-
-def query_pinecone_db_extended(query: str, module: str = None) -> dict:
+import os
+import threading
+from providers.pinecone.pinecone_connection import get_pinecone_store
+from collections import OrderedDict, defaultdict
+from providers.openai.generate_embeddings import generate_batch_embeddings_from_azure_client
+from database.document_retrieval.fetch_processed_trial_documents_with_nct_ids import \
+    fetch_processed_trial_documents_with_nct_ids
+
+# Matches fetched per query, the first stage of an adaptive search
+PINECONE_TOP_K = int(os.getenv("PINECONE_TOP_K", "20"))
+# Query texts whose embeddings are kept, so a search widened to a larger top_k does not embed them again
+QUERY_EMBEDDING_CACHE_SIZE = 256
+
+_query_embeddings = OrderedDict()
+_query_embeddings_lock = threading.Lock()
+
+
+def _embed_queries(texts: list) -> dict:
+    """Embeds the query texts like `generate_batch_embeddings_from_azure_client`, reusing cached embeddings."""
+    with _query_embeddings_lock:
+        cached = {text: _query_embeddings[text] for text in texts if text in _query_embeddings}
+    missing = list(dict.fromkeys(text for text in texts if text not in cached))
+    if missing:
+        embedding_response = generate_batch_embeddings_from_azure_client(missing)
+        if embedding_response["success"] is False:
+            return embedding_response
+        cached.update(zip(missing, embedding_response["data"]))
+    with _query_embeddings_lock:
+        for text in texts:
+            _query_embeddings[text] = cached[text]
+            _query_embeddings.move_to_end(text)
+        while len(_query_embeddings) > QUERY_EMBEDDING_CACHE_SIZE:
+            _query_embeddings.popitem(last=False)
+    return {"success": True, "message": "Successfully generated query embeddings", "data": [cached[text] for text in texts]}
+
+
+def _collect_trials(matches: list) -> dict:
+    """Groups Pinecone matches by trial, keeping the best scoring module and its embedding."""
+    # Prepare a dictionary to store NCT IDs with their related information
+    nct_data = defaultdict(lambda: {'count': 0, 'max_score': 0, 'module_max_score': ''})
+
+    # Process the data
+    for match in matches:
+        nct_id = match['metadata']['nctId']
+        module = match['metadata']['module']
+        score = match['score']
+        value = match['values']
+
+        # Update the count
+        nct_data[nct_id]['count'] += 1
+
+        # Update the max score and corresponding module
+        if score > nct_data[nct_id]['max_score']:
+            nct_data[nct_id]['max_score'] = score
+            nct_data[nct_id]['module_max_score'] = module
+            nct_data[nct_id]['embeddings'] = value
+
+    return nct_data
+
+
+def query_pinecone_db_modules(queries: dict, k: int = PINECONE_TOP_K) -> dict:
     """
-    Queries the Pinecone database to fetch documents related to the provided query and module.
+    Queries the Pinecone database for several queries at once: the query texts are embedded in one batch, the
+    module queries run in parallel and the matched trial documents are fetched from MongoDB in one query.
 
     Parameters:
-        query (str): The query to search for.
-        module (str): The module to filter the results by.
+        queries (dict): Maps a query name to a (query text, module) pair. The module may be None for all modules.
+        k (int): Number of Pinecone matches fetched per query.
 
     Returns:
-        dict: The final response with documents fetched from Pinecone and MongoDB.
+        dict: The final response whose data maps every query name to its documents, like
+            `query_pinecone_db_extended`.
     """
     final_response = {
         "success": False,
@@ -23,56 +78,52 @@ def query_pinecone_db_extended(query: str, module: str = None) -> dict:
     }
 
     try:
-        # Generate embedding for the query
-        embedding_response = generate_embeddings_from_azure_client(query)
-        embedding = embedding_response["data"].flatten().tolist()
-
-        # Initialize Pinecone vector store
-        pinecone_store = PineconeVectorStore()
-
-        # Query Pinecone and fetch similar documents
-        filters = {"module": {"$eq": module}} if module else None
-        result = pinecone_store.query(vector=embedding, filters=filters, k=20)
-
-        # Process the Response Results
-        data = result
-
-        # Prepare a dictionary to store NCT IDs with their related information
-        nct_data = defaultdict(lambda: {'count': 0, 'max_score': 0, 'module_max_score': ''})
-
-        # Process the data
-        for match in data['matches']:
-            nct_id = match['metadata']['nctId']
-            module = match['metadata']['module']
-            score = match['score']
-            value = match['values']
-
-            # Update the count
-            nct_data[nct_id]['count'] += 1
-
-            # Update the max score and corresponding module
-            if score > nct_data[nct_id]['max_score']:
-                nct_data[nct_id]['max_score'] = score
-                nct_data[nct_id]['module_max_score'] = module
-                nct_data[nct_id]['embeddings'] = value
+        names = list(queries)
+        if not names:
+            final_response.update({"success": True, "message": "No queries", "data": {}})
+            return final_response
+
+        # Generate embeddings for all queries in one call
+        embedding_response = _embed_queries([queries[name][0] for name in names])
+        if embedding_response["success"] is False:
+            final_response['message'] = embedding_response["message"]
+            return final_response
+
+        # Shared Pinecone vector store, connected on first use
+        pinecone_store = get_pinecone_store()
+
+        # Query Pinecone for all modules in parallel
+        results = pinecone_store.query_modules({
+            name: (queries[name][1], embedding.tolist())
+            for name, embedding in zip(names, embedding_response["data"])
+        }, k=k)
+
+        # Keep the trials at least 40% similar to their query
+        trial_scores = {}
+        for name in names:
+            trial_scores[name] = []
+            for nctId, value in _collect_trials(results[name]['matches']).items():
+                similarity_score = int(value['max_score'] * 100)
+                if similarity_score >= 40:
+                    trial_scores[name].append((nctId, value['module_max_score'], similarity_score))
+
+        # Fetch the documents of all matched trials at once
+        nct_ids = [nctId for scores in trial_scores.values() for nctId, _, _ in scores]
+        documents = {}
+        if nct_ids:
+            documents_response = fetch_processed_trial_documents_with_nct_ids(nct_ids)
+            if documents_response['success'] is False:
+                final_response['message'] = documents_response['message']
+                return final_response
+            documents = documents_response['data']
 
         # Prepare the final response data
-        final_data = []
-        for key, value in nct_data.items():
-            nctId = key
-            module = value['module_max_score']
-            similarity_score = int(value['max_score'] * 100)
-            if similarity_score < 40:
-                continue
-            else:
-                document_response = fetch_processed_trial_document_with_nct_id(nctId)
-                if document_response['success'] is True:
-                    final_data.append({
-                        "nctId": nctId,
-                        "module": module,
-                        "similarity_score": similarity_score,
-                        "document": document_response['data']
-                    })
+        final_data = {}
+        for name, scores in trial_scores.items():
+            final_data[name] = [
+                {"nctId": nctId, "module": module, "similarity_score": similarity_score, "document": documents[nctId]}
+                for nctId, module, similarity_score in scores if nctId in documents
+            ]
 
         # Return the final response
         final_response['data'] = final_data
@@ -83,3 +134,20 @@ def query_pinecone_db_extended(query: str, module: str = None) -> dict:
         final_response['message'] = f"Error occurred: {str(e)}"
 
     return final_response
+
+
+def query_pinecone_db_extended(query: str, module: str = None) -> dict:
+    """
+    Queries the Pinecone database to fetch documents related to the provided query and module.
+
+    Parameters:
+        query (str): The query to search for.
+        module (str): The module to filter the results by.
+
+    Returns:
+        dict: The final response with documents fetched from Pinecone and MongoDB.
+    """
+    response = query_pinecone_db_modules({"query": (query, module)})
+    if response['success'] is True:
+        response['data'] = response['data']['query']
+    return response
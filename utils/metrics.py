@@ -0,0 +1,121 @@
+import time
+import inspect
+import functools
+from contextlib import contextmanager
+from utils.tracing import record_debug_timing, set_span_outcome, start_span
+
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+except ImportError:  # pragma: no cover - declared in pyproject.toml, the fallback only serves environments without it
+    CONTENT_TYPE_LATEST = "text/plain; charset=utf-8"
+    Counter = Histogram = generate_latest = None
+
+# Pipeline stages take from milliseconds (Mongo reads) to minutes (drafting calls)
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+if Histogram is not None:
+    STAGE_DURATION = Histogram(
+        "trial_service_stage_duration_seconds",
+        "Duration of a pipeline stage.",
+        ["stage", "module", "outcome"],
+        buckets=_LATENCY_BUCKETS
+    )
+    STAGE_TOTAL = Counter(
+        "trial_service_stage_total",
+        "Number of pipeline stage runs.",
+        ["stage", "module", "outcome"]
+    )
+    JSON_PARSE_TOTAL = Counter(
+        "trial_service_json_parse_total",
+        "Outcomes of parsing LLM JSON responses (parsed, repaired, failed, rerequested).",
+        ["schema", "outcome"]
+    )
+else:
+    STAGE_DURATION = STAGE_TOTAL = JSON_PARSE_TOTAL = None
+
+
+class StageTimer:
+    """Outcome holder of a tracked stage. Set `outcome` to report anything other than success."""
+
+    def __init__(self):
+        self.outcome = "success"
+
+    def set_outcome_from(self, response) -> None:
+        # Service functions report failures in their response dictionary instead of raising
+        if isinstance(response, dict) and response.get("success") is False:
+            self.outcome = "failure"
+
+
+def observe_stage(stage: str, duration: float, module: str = None, outcome: str = "success") -> None:
+    """Records one run of a stage that was timed elsewhere."""
+    if STAGE_DURATION is None:
+        return
+    labels = {"stage": stage, "module": module or "", "outcome": outcome}
+    STAGE_DURATION.labels(**labels).observe(duration)
+    STAGE_TOTAL.labels(**labels).inc()
+
+
+@contextmanager
+def track_stage(stage: str, module: str = None):
+    """
+    Times a block of code as a pipeline stage, inside a tracing span of the same name.
+
+    Exceptions are recorded with the "error" outcome and re-raised. The duration is also added to the
+    request's debug timings when they were requested.
+
+    Example:
+        >>> with track_stage("pinecone_query", module="inclusionCriteria") as timer:
+        ...     response = query()
+        ...     timer.set_outcome_from(response)
+    """
+    timer = StageTimer()
+    start = time.perf_counter()
+    with start_span(f"{stage} {module}" if module else stage, {"stage": stage, "module": module or ""}) as span:
+        try:
+            yield timer
+        except Exception:
+            timer.outcome = "error"
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            observe_stage(stage, duration, module, timer.outcome)
+            record_debug_timing(stage, module, duration, timer.outcome)
+            set_span_outcome(span, timer.outcome)
+
+
+def timed_stage(stage: str, module: str = None, module_arg: str = None):
+    """
+    Decorator version of `track_stage` for functions that return a response dictionary.
+
+    Args:
+        stage (str): The stage name.
+        module (str, optional): A fixed module label, such as a collection name.
+        module_arg (str, optional): Name of the function argument whose value is used as the module label.
+    """
+    def decorator(function):
+        signature = inspect.signature(function) if module_arg else None
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            label = module
+            if module_arg:
+                bound_arguments = signature.bind_partial(*args, **kwargs)
+                label = bound_arguments.arguments.get(module_arg, module)
+            with track_stage(stage, label) as timer:
+                response = function(*args, **kwargs)
+                timer.set_outcome_from(response)
+                return response
+        return wrapper
+    return decorator
+
+
+def record_json_parse(schema_name: str, outcome: str) -> None:
+    if JSON_PARSE_TOTAL is not None:
+        JSON_PARSE_TOTAL.labels(schema=schema_name, outcome=outcome).inc()
+
+
+def render_metrics():
+    """Returns the metrics in the Prometheus text format and their content type."""
+    if generate_latest is None:
+        return b"# prometheus_client is not installed, no metrics are collected\n", CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
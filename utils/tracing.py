@@ -0,0 +1,173 @@
+import os
+import sys
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager, nullcontext
+
+try:
+    from opentelemetry import trace
+    from opentelemetry.trace import Status, StatusCode
+except ImportError:  # pragma: no cover - declared in pyproject.toml, without it no spans are recorded
+    trace = None
+
+# Where finished spans are exported: "none", "console", "file" (JSON lines in TRACING_FILE_PATH) or "otlp"
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none").lower()
+TRACING_FILE_PATH = os.getenv("TRACING_FILE_PATH", "traces.jsonl")
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "slices-trial-service")
+
+# Request ID and the opt-in per-request stage timings, carried into worker threads by `with_current_context`
+request_id_var = contextvars.ContextVar("request_id", default=None)
+_debug_timings_var = contextvars.ContextVar("debug_timings", default=None)
+
+_configure_lock = threading.Lock()
+_configured = False
+
+
+def configure_tracing() -> str:
+    """
+    Installs the tracer provider and the exporter selected by TRACING_EXPORTER. Safe to call more than once.
+
+    Returns:
+        str: A message describing the tracing setup.
+
+    Raises:
+        RuntimeError: If the exporter is unknown or its package is not installed, so a configured exporter
+            does not silently record nothing.
+    """
+    global _configured
+    if TRACING_EXPORTER == "none":
+        return "Tracing disabled"
+    if trace is None:
+        raise RuntimeError(f"TRACING_EXPORTER is {TRACING_EXPORTER} but opentelemetry is not installed")
+
+    with _configure_lock:
+        if _configured:
+            return f"Tracing to {TRACING_EXPORTER}"
+        try:
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+            if TRACING_EXPORTER == "console":
+                exporter = ConsoleSpanExporter(out=sys.stdout)
+            elif TRACING_EXPORTER == "file":
+                trace_file = open(TRACING_FILE_PATH, "a", buffering=1)
+                exporter = ConsoleSpanExporter(
+                    out=trace_file, formatter=lambda span: span.to_json(indent=None) + os.linesep
+                )
+            elif TRACING_EXPORTER == "otlp":
+                # Endpoint and headers come from the standard OTEL_EXPORTER_OTLP_* variables
+                from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+                exporter = OTLPSpanExporter()
+            else:
+                raise RuntimeError(f"Unknown TRACING_EXPORTER {TRACING_EXPORTER}, "
+                                   f"use none, console, file or otlp")
+
+            provider = TracerProvider(resource=Resource.create({"service.name": TRACING_SERVICE_NAME}))
+            provider.add_span_processor(BatchSpanProcessor(exporter))
+            trace.set_tracer_provider(provider)
+            _configured = True
+            return f"Tracing to {TRACING_EXPORTER}"
+        except ImportError as e:
+            raise RuntimeError(f"TRACING_EXPORTER is {TRACING_EXPORTER} but its package is not installed: {e}") from e
+
+
+def shutdown_tracing() -> None:
+    """Exports the spans that are still buffered."""
+    if trace is not None and _configured:
+        trace.get_tracer_provider().shutdown()
+
+
+def start_span(name: str, attributes: dict = None):
+    """Returns a context manager for a span that is current inside the block, or a no-op without opentelemetry."""
+    if trace is None:
+        return nullcontext()
+    return trace.get_tracer("slices-trial-service").start_as_current_span(name, attributes=attributes)
+
+
+def set_span_outcome(span, outcome: str) -> None:
+    if span is None or trace is None:
+        return
+    span.set_attribute("outcome", outcome)
+    if outcome != "success":
+        span.set_status(Status(StatusCode.ERROR, outcome))
+
+
+def current_trace_id() -> str:
+    """Returns the hex trace ID of the current span, or None outside of a recorded trace."""
+    if trace is None:
+        return None
+    span_context = trace.get_current_span().get_span_context()
+    return format(span_context.trace_id, "032x") if span_context.is_valid else None
+
+
+@contextmanager
+def request_context(name: str, request_id: str = None, debug_timings: bool = False, attributes: dict = None):
+    """
+    Starts the root span of a request and sets the request ID and the optional debug timings for it.
+
+    Args:
+        name (str): The span name, such as "POST /api/v1/ml/search_documents".
+        request_id (str, optional): The caller's request ID. A new one is generated by default.
+        debug_timings (bool, optional): Collect the stage timings of this request for `get_debug_timings`.
+        attributes (dict, optional): Additional span attributes.
+
+    Yields:
+        str: The request ID.
+    """
+    request_id = request_id or uuid.uuid4().hex
+    request_id_token = request_id_var.set(request_id)
+    timings_token = _debug_timings_var.set([] if debug_timings else None)
+    try:
+        with start_span(name, {"request.id": request_id, **(attributes or {})}):
+            yield request_id
+    finally:
+        _debug_timings_var.reset(timings_token)
+        request_id_var.reset(request_id_token)
+
+
+def with_current_context(function):
+    """
+    Wraps a function so it runs with the caller's trace context, request ID and debug timings.
+
+    Thread pools do not carry context variables over, so functions submitted to an executor lose the active
+    span. Wrap them when they are submitted: `executor.submit(with_current_context(process_batch), batch)`.
+    """
+    parent_context = contextvars.copy_context()
+
+    def wrapper(*args, **kwargs):
+        # A context can only be entered by one thread at a time, so every call runs in its own copy
+        return parent_context.copy().run(function, *args, **kwargs)
+    return wrapper
+
+
+def record_debug_timing(stage: str, module: str, duration: float, outcome: str) -> None:
+    timings = _debug_timings_var.get()
+    if timings is not None:
+        timings.append({"stage": stage, "module": module or "", "seconds": round(duration, 4), "outcome": outcome})
+
+
+def get_debug_timings() -> dict:
+    """
+    Returns the stage timings collected for the current request, or None if they were not requested.
+
+    Returns:
+        dict | None: {"requestId", "traceId", "stages": {stage: {"count", "seconds"}}, "events": [...]}.
+    """
+    timings = _debug_timings_var.get()
+    if timings is None:
+        return None
+    events = list(timings)
+    stages = {}
+    for event in events:
+        stage = stages.setdefault(event["stage"], {"count": 0, "seconds": 0.0})
+        stage["count"] += 1
+        stage["seconds"] = round(stage["seconds"] + event["seconds"], 4)
+    return {
+        "requestId": request_id_var.get(),
+        "traceId": current_trace_id(),
+        "stages": stages,
+        "events": events
+    }
+
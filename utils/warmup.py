@@ -0,0 +1,161 @@
+import os
+import time
+import threading
+
+# Pre-connect the providers and load the caches in the background when the service starts
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+# Warmup steps that must succeed before /readyz reports the service as ready
+READINESS_REQUIRED = [step.strip() for step in os.getenv("READINESS_REQUIRED", "mongo,pinecone").split(",")
+                      if step.strip()]
+
+_state = {"status": "pending", "shutting_down": False, "steps": {}}
+_state_lock = threading.Lock()
+
+
+def _warm_mongo():
+    from database.mongo_db_connection import get_mongo_dao
+    get_mongo_dao().client.admin.command("ping")
+    return "Connected to MongoDB"
+
+
+def _warm_indexes():
+    from database.indexes import ensure_indexes
+    response = ensure_indexes()
+    if response["success"] is False:
+        raise RuntimeError(response["message"])
+    return response["message"]
+
+
+def _warm_pinecone():
+    from providers.pinecone.pinecone_connection import get_pinecone_store
+    return f"Connected to Pinecone index {get_pinecone_store().index_name}"
+
+
+def _warm_azure_openai():
+    from providers.openai.generate_embeddings import get_azure_client
+    get_azure_client()
+    return "Created Azure OpenAI client"
+
+
+def _warm_openai():
+    from providers.openai.openai_connection import get_openai_client
+    get_openai_client()
+    return "Created OpenAI client"
+
+
+def _warm_tokenizer():
+    from document_retrieval.utils.pack_trial_documents import estimate_tokens
+    estimate_tokens("warmup")
+    return "Loaded tokenizer"
+
+
+def _warm_lexical_index():
+    from document_retrieval.utils.lexical_index import get_lexical_index
+    index = get_lexical_index()
+    if index is None:
+        raise RuntimeError("No lexical index available, candidates are retrieved from Pinecone only")
+    return f"Loaded lexical index of {len(index)} trials"
+
+
+def _warm_criteria_classifier():
+    from document_retrieval.utils.criteria_category_classifier import get_criteria_category_classifier
+    if get_criteria_category_classifier() is None:
+        raise RuntimeError("No criteria centroids available, criteria are categorised by the LLM")
+    return "Loaded criteria classifier centroids"
+
+
+# Run in order: the indexes are created once MongoDB answered, the lexical index and the classifier read from Mongo, the classifier embeds labelled criteria
+WARMUP_STEPS = {
+    "mongo": _warm_mongo,
+    "indexes": _warm_indexes,
+    "pinecone": _warm_pinecone,
+    "azure_openai": _warm_azure_openai,
+    "openai": _warm_openai,
+    "tokenizer": _warm_tokenizer,
+    "lexical_index": _warm_lexical_index,
+    "criteria_classifier": _warm_criteria_classifier,
+}
+
+
+def startup_steps() -> list:
+    """
+    Returns the warmup steps to run when the service starts: all of them with WARMUP_ON_STARTUP, otherwise
+    only the index creation, which is left out without ENSURE_INDEXES_ON_STARTUP.
+    """
+    from database.indexes import ENSURE_INDEXES_ON_STARTUP
+    steps = list(WARMUP_STEPS) if WARMUP_ON_STARTUP else ["indexes"]
+    return [name for name in steps if name != "indexes" or ENSURE_INDEXES_ON_STARTUP]
+
+
+def warm_up(steps: list = None) -> dict:
+    """
+    Creates the provider clients, pre-connects MongoDB and Pinecone, creates the MongoDB indexes and loads the
+    caches, so the first requests do not pay for it. A failing step is recorded and does not stop the others.
+
+    Args:
+        steps (list, optional): Names of the WARMUP_STEPS to run, in their order. Defaults to all.
+
+    Returns:
+        dict: A response dictionary whose data has the outcome and duration of every step.
+    """
+    with _state_lock:
+        _state["status"] = "running"
+
+    for name, step in WARMUP_STEPS.items():
+        if steps is not None and name not in steps:
+            continue
+        start = time.perf_counter()
+        try:
+            result = {"success": True, "message": step()}
+        except Exception as e:
+            result = {"success": False, "message": f"{type(e).__name__}: {e}"}
+        result["seconds"] = round(time.perf_counter() - start, 3)
+        print(f"Warmup {name}: {result['message']} ({result['seconds']}s)")
+        with _state_lock:
+            _state["steps"][name] = result
+
+    with _state_lock:
+        _state["status"] = "finished"
+        steps = dict(_state["steps"])
+    failed = [name for name, result in steps.items() if not result["success"]]
+    return {
+        "success": not failed,
+        "message": f"Warmup finished, failed steps: {', '.join(failed)}" if failed else "Warmup finished",
+        "data": steps
+    }
+
+
+def start_warmup(steps: list = None) -> threading.Thread:
+    """Runs `warm_up` in a background thread, so the service answers liveness checks while it warms up."""
+    thread = threading.Thread(target=warm_up, args=(steps,), name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def mark_shutting_down() -> None:
+    """Reports the service as not ready, so no new traffic is routed to it while it drains."""
+    with _state_lock:
+        _state["shutting_down"] = True
+
+
+def get_readiness() -> dict:
+    """
+    Returns whether the service is ready for traffic: not shutting down, and every READINESS_REQUIRED step
+    succeeded. Without warmup on startup the service is ready immediately and connects on first use, the steps
+    then only report the index creation.
+
+    Returns:
+        dict: {"ready", "warmup", "steps"}.
+    """
+    with _state_lock:
+        status = _state["status"]
+        steps = {name: dict(result) for name, result in _state["steps"].items()}
+        shutting_down = _state["shutting_down"]
+
+    if shutting_down:
+        ready = False
+    elif not WARMUP_ON_STARTUP:
+        ready = True
+    else:
+        ready = all(steps.get(name, {}).get("success") for name in READINESS_REQUIRED)
+    return {"ready": ready, "warmup": "shutting_down" if shutting_down else status, "steps": steps}